@@ -0,0 +1,53 @@
+"""Cauda em memória do log de alertas, com espera por alertas novos (long polling).
+
+O log durável é a tabela `alerts` (ids crescentes, só inserção). Cada processo
+guarda aqui os últimos `size` alertas, já decodificados, e acorda quem espera
+em `/alerts?after=<id>&wait=<s>` assim que chega um id maior. Quem pede um
+cursor mais antigo que a cauda cai na leitura do banco (ver app.py).
+"""
+import threading
+from collections import deque
+
+
+class AlertRing:
+    def __init__(self, size=500):
+        self._items = deque(maxlen=size)
+        self._cond = threading.Condition()
+        self.last_id = 0
+
+    def extend(self, alerts):
+        """Acrescenta alertas (dicts com "id", em ordem crescente); ignora os já vistos."""
+        with self._cond:
+            fresh = [a for a in alerts if a["id"] > self.last_id]
+            if fresh:
+                self._items.extend(fresh)
+                self.last_id = fresh[-1]["id"]
+                self._cond.notify_all()
+
+    def clear(self):
+        """Esvazia a cauda e zera o último id (o log foi recriado, ex.: /dev/reseed)."""
+        with self._cond:
+            self._items.clear()
+            self.last_id = 0
+            self._cond.notify_all()
+
+    def covers(self, after) -> bool:
+        """A cauda tem tudo depois de `after`? (senão é preciso ler do banco)"""
+        with self._cond:
+            return after >= self.last_id or (bool(self._items) and self._items[0]["id"] <= after + 1)
+
+    def since(self, after, limit=None):
+        with self._cond:
+            out = [a for a in self._items if a["id"] > after]
+        return out[:limit] if limit else out
+
+    def wait(self, after, timeout) -> bool:
+        """Bloqueia até existir id > `after` ou o tempo acabar."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.last_id > after, timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"buffered": len(self._items), "capacity": self._items.maxlen,
+                    "first_id": self._items[0]["id"] if self._items else None,
+                    "last_id": self.last_id}
@@ -1,4 +1,5 @@
-﻿from flask import Flask, request, jsonify, Response
+﻿from flask import Flask, request, jsonify, Response, stream_with_context
+import click
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
@@ -6,11 +7,30 @@ from flask_jwt_extended import (
     JWTManager, create_access_token, jwt_required, get_jwt, get_jwt_identity,
     verify_jwt_in_request
 )
-from sqlalchemy import func, text
+from sqlalchemy import func, text, case, event, create_engine, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from itsdangerous import BadData, URLSafeTimedSerializer
+from werkzeug.exceptions import RequestEntityTooLarge
 from pathlib import Path
-import csv, io, json, random, statistics, time, math, os
+import csv, hashlib, heapq, io, json, logging, re, secrets, sqlite3, os, threading, time, zlib
 from datetime import datetime, timedelta, timezone
-from collections import defaultdict
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import ingest, migrations, perf, retention, rfm, seedgen, serialization, simulation, timeseries
+from shards import ShardRouter
+from alertlog import AlertRing
+from sse import BroadcastHub, SSE_PING, sse_message
+from cache import DataVersion, ResponseCache
+
+try:  # exportação Parquet/Arrow é opcional
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 # ---------------------------------------------------------------------
 # App & Config
@@ -18,8 +38,9 @@ from collections import defaultdict
 app = Flask(__name__)
 
 # Garante a pasta instance/ e usa SEMPRE o mesmo arquivo de banco ali dentro
+# (DB_PATH permite apontar para outro arquivo, ex.: benchmarks)
 Path(app.instance_path).mkdir(parents=True, exist_ok=True)
-db_path = os.path.join(app.instance_path, "inovatech.db")
+db_path = os.getenv("DB_PATH") or os.path.join(app.instance_path, "inovatech.db")
 app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
 
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
@@ -30,6 +51,69 @@ bcrypt = Bcrypt(app)
 jwt = JWTManager(app)
 CORS(app)
 
+# JSON via orjson (se instalado) + gzip/brotli acima de COMPRESS_MIN_BYTES
+serialization.init_app(
+    app,
+    min_bytes=int(os.getenv("COMPRESS_MIN_BYTES", "1024")),
+    gzip_level=int(os.getenv("COMPRESS_GZIP_LEVEL", "6")),
+    brotli_quality=int(os.getenv("COMPRESS_BROTLI_QUALITY", "5")),
+)
+
+# Tempo por rota + SQL por requisição: histogramas em /dev/perf e Server-Timing
+# (app/sql). Registrado depois da serialização, que monta o Server-Timing.
+perf_metrics = perf.PerfMetrics(app) if os.getenv("PERF_METRICS", "1") != "0" else None
+
+# ---------------------------------------------------------------------
+# SQLITE: PRAGMAs em toda conexão + engine somente-leitura p/ analytics
+# ---------------------------------------------------------------------
+SQLITE_JOURNAL_MODE    = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS     = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB   = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))  # por conexão
+SQLITE_MMAP_SIZE_MB    = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+SQLITE_ANALYTICS_RO    = os.getenv("SQLITE_ANALYTICS_RO", "1") != "0"
+SQLITE_AUTO_VACUUM     = os.getenv("SQLITE_AUTO_VACUUM", "INCREMENTAL")  # só vale em banco novo
+
+def apply_sqlite_pragmas(dbapi_conn, read_only=False):
+    cur = dbapi_conn.cursor()
+    if not read_only:  # journal_mode fica gravado no arquivo; conexão ro não pode alterá-lo
+        # auto_vacuum antes de tudo: só tem efeito enquanto o arquivo ainda não foi criado
+        cur.execute(f"PRAGMA auto_vacuum={SQLITE_AUTO_VACUUM};")
+        cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE};")
+        cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS};")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};")
+    cur.execute(f"PRAGMA cache_size={-SQLITE_CACHE_SIZE_KB};")  # negativo = KiB
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024};")
+    cur.execute("PRAGMA temp_store=MEMORY;")
+    cur.close()
+
+with app.app_context():
+    event.listen(db.engine, "connect", lambda conn, record: apply_sqlite_pragmas(conn))
+
+def _connect_read_only():
+    uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+# Leituras agregadas (dashboard, insights, export) não disputam com escritores:
+# conexões próprias, abertas com mode=ro. SQLITE_ANALYTICS_RO=0 usa db.session.
+analytics_engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"], creator=_connect_read_only)
+event.listen(analytics_engine, "connect",
+             lambda conn, record: apply_sqlite_pragmas(conn, read_only=True))
+analytics_session = scoped_session(sessionmaker(bind=analytics_engine))
+
+def release_read_sessions():
+    """Devolve ao pool as conexões de leitura presas às sessões da thread atual."""
+    analytics_session.remove()
+    shards.remove_sessions()
+
+@app.teardown_appcontext
+def _remove_analytics_session(exc):
+    release_read_sessions()
+
+def read_session():
+    """Sessão das consultas analíticas (somente leitura)."""
+    return analytics_session if SQLITE_ANALYTICS_RO else db.session
+
 # ---- Regras para criar/editar ADMIN ----
 ALLOWED_ADMIN_DOMAINS = {"cannoli.com.br", "inovatech.com.br"}
 ALLOWED_ADMIN_CODES   = {"CANNOLI", "INOVATECH"}
@@ -113,12 +197,20 @@ class Order(db.Model):
     location_id = db.Column(db.Integer, db.ForeignKey("locations.id"), nullable=False)
     ordered_at = db.Column(db.DateTime, index=True, nullable=False)
     total = db.Column(db.Float, nullable=False)
-    owner_cnpj = db.Column(db.String(20), index=True)  # CNPJ dono
+    owner_cnpj = db.Column(db.String(20))  # CNPJ dono
 
     channel = db.relationship("Channel")
     location = db.relationship("Location")
     items = db.relationship("OrderItem", backref="order", cascade="all, delete-orphan")
 
+    # índices de cobertura dos recortes do dashboard (ver migrations.py, v2)
+    __table_args__ = (
+        db.Index("ix_orders_cnpj_time_cover", "owner_cnpj", "ordered_at", "channel_id",
+                 "location_id", "total", "customer_email"),
+        db.Index("ix_orders_time_cover", "ordered_at", "channel_id", "location_id",
+                 "owner_cnpj", "total", "customer_email"),
+    )
+
 class OrderItem(db.Model):
     __tablename__ = "order_items"
     id = db.Column(db.Integer, primary_key=True)
@@ -128,113 +220,932 @@ class OrderItem(db.Model):
     unit_price = db.Column(db.Float, nullable=False)
     item = db.relationship("MenuItem")
 
+    __table_args__ = (
+        db.Index("ix_order_items_item_order", "item_id", "order_id"),
+    )
+
+class OrderHourly(db.Model):
+    """Rollup por hora: uma linha por (hora, canal, loja, CNPJ dono)."""
+    __tablename__ = "orders_hourly"
+    bucket = db.Column(db.String(16), primary_key=True)  # "YYYY-MM-DD HH:00"
+    channel_id = db.Column(db.Integer, db.ForeignKey("channels.id"), primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey("locations.id"), primary_key=True)
+    owner_cnpj = db.Column(db.String(20), primary_key=True, default="")  # "" = sem dono
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    items_qty = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("ix_orders_hourly_cnpj_bucket", "owner_cnpj", "bucket"),
+    )
+
+class ItemSalesDaily(db.Model):
+    """Rollup diário de vendas por item: uma linha por (dia, canal, loja, CNPJ dono, item)."""
+    __tablename__ = "item_sales_daily"
+    day = db.Column(db.String(10), primary_key=True)  # "YYYY-MM-DD"
+    channel_id = db.Column(db.Integer, db.ForeignKey("channels.id"), primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey("locations.id"), primary_key=True)
+    owner_cnpj = db.Column(db.String(20), primary_key=True, default="")  # "" = sem dono
+    item_id = db.Column(db.Integer, db.ForeignKey("menu_items.id"), primary_key=True)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)  # soma de qty * unit_price
+
+    __table_args__ = (
+        db.Index("ix_item_sales_daily_cnpj_day", "owner_cnpj", "day"),
+    )
+
+class CustomerActivity(db.Model):
+    """Uma linha por cliente final de cada CNPJ: base para churn/ativos/recência."""
+    __tablename__ = "customer_activity"
+    owner_cnpj = db.Column(db.String(20), primary_key=True, default="")  # "" = sem dono
+    customer_email = db.Column(db.String(160), primary_key=True)
+    first_order_at = db.Column(db.DateTime, nullable=False)
+    last_order_at = db.Column(db.DateTime, nullable=False, index=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    total_spent = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index("ix_customer_activity_cnpj_last", "owner_cnpj", "last_order_at"),
+    )
+
+class ArchivedCustomer(db.Model):
+    """Totais por cliente dos pedidos já arquivados pela retenção (ver retention.py).
+
+    O rebuild de customer_activity soma estas linhas aos pedidos que restam em orders.
+    """
+    __tablename__ = "archived_customers"
+    owner_cnpj = db.Column(db.String(20), primary_key=True, default="")
+    customer_email = db.Column(db.String(160), primary_key=True)
+    first_order_at = db.Column(db.DateTime, nullable=False)
+    last_order_at = db.Column(db.DateTime, nullable=False)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    total_spent = db.Column(db.Float, nullable=False, default=0.0)
+
+class RetentionRun(db.Model):
+    """Uma linha por execução da retenção; o maior `cutoff` separa pedidos brutos de arquivados."""
+    __tablename__ = "retention_runs"
+    id = db.Column(db.Integer, primary_key=True)
+    ran_at = db.Column(db.DateTime, nullable=False)
+    cutoff = db.Column(db.DateTime, nullable=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    archive = db.Column(db.String(255))
+    bytes_before = db.Column(db.Integer)
+    bytes_after = db.Column(db.Integer)
+
+class EwmaState(db.Model):
+    """Estado EWMA da receita por hora de cada série (CNPJ dono, canal, loja).
+
+    A série global usa owner_cnpj "*" e canal/loja 0. `last_bucket` é a última hora
+    fechada já incorporada; NULL = recalcular a partir da janela de aquecimento.
+    """
+    __tablename__ = "ewma_state"
+    owner_cnpj = db.Column(db.String(20), primary_key=True, default="")
+    channel_id = db.Column(db.Integer, primary_key=True)
+    location_id = db.Column(db.Integer, primary_key=True)
+    last_bucket = db.Column(db.String(16))
+    n = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=False, default=0.0)
+    var = db.Column(db.Float, nullable=False, default=0.0)
+    last_value = db.Column(db.Float, nullable=False, default=0.0)
+    zscore = db.Column(db.Float, nullable=False, default=0.0)
+
+class AlertLog(db.Model):
+    """Log de alertas, só inserção: o id crescente é o cursor de /alerts?after=.
+
+    No máximo um alerta por série e hora (a mesma hora reprocessada, ou avançada
+    por dois workers ao mesmo tempo, não duplica).
+    """
+    __tablename__ = "alerts"
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    owner_cnpj = db.Column(db.String(20), nullable=False, default="")
+    channel_id = db.Column(db.Integer, nullable=False)
+    location_id = db.Column(db.Integer, nullable=False)
+    bucket = db.Column(db.String(16), nullable=False)
+    severity = db.Column(db.String(10), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON entregue ao cliente
+
+    __table_args__ = (
+        db.UniqueConstraint("owner_cnpj", "channel_id", "location_id", "bucket",
+                            name="uq_alerts_series_bucket"),
+    )
+
+class IngestBatch(db.Model):
+    """Lotes de POST /orders/batch já gravados, por Idempotency-Key de cada cliente.
+
+    Gravado na mesma transação dos pedidos: um retry devolve `response` sem
+    inserir de novo.
+    """
+    __tablename__ = "ingest_batches"
+    client = db.Column(db.String(80), primary_key=True)   # "role:identity" do token
+    idempotency_key = db.Column(db.String(120), primary_key=True)
+    body_sha256 = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    response = db.Column(db.Text, nullable=False)
+
+class IdBlock(db.Model):
+    """Próximo id livre de uma sequência global (pedidos no modo sharded).
+
+    Fica no banco principal: shards diferentes nunca recebem o mesmo id.
+    """
+    __tablename__ = "id_blocks"
+    name = db.Column(db.String(40), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
 # ---------------------------------------------------------------------
-# MIGRAÇÃO SIMPLES (SQLite): garante coluna owner_cnpj em bancos antigos
+# ARMAZENAMENTO: banco único ou um arquivo SQLite por CNPJ dono
 # ---------------------------------------------------------------------
-def ensure_owner_cnpj_column():
-    try:
-        cols = db.session.execute(text("PRAGMA table_info(orders);")).mappings().all()
-        names = {c["name"] for c in cols}
-        if "owner_cnpj" not in names:
-            db.session.execute(text("ALTER TABLE orders ADD COLUMN owner_cnpj VARCHAR(20);"))
-            db.session.commit()
-    except Exception as e:
-        print("[migrate] aviso ao checar/alterar owner_cnpj:", e)
+# STORAGE_MODE=sharded: pedidos, itens e rollups de cada CNPJ vivem em
+# SHARDS_DIR/<cnpj>.db (ver shards.py); o resto continua no banco principal.
+# `flask split-shards` copia os pedidos de um banco único para os shards.
+STORAGE_MODE  = os.getenv("STORAGE_MODE", "single")
+SHARDED       = STORAGE_MODE == "sharded"
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "4"))  # consultas sem escopo em paralelo
+
+shards = ShardRouter(
+    os.getenv("SHARDS_DIR") or os.path.join(os.path.dirname(os.path.abspath(db_path)), "shards"),
+    [m.__table__ for m in (Order, OrderItem, OrderHourly, ItemSalesDaily, CustomerActivity,
+                           ArchivedCustomer, RetentionRun)],
+    configure=apply_sqlite_pragmas,
+    on_create=lambda engine: migrations.run_migrations(engine, log=lambda msg: None),
+    workers=SHARD_WORKERS,
+)
+
+def fans_out(f) -> bool:
+    """Recorte sem CNPJ no modo sharded: precisa consultar todos os shards."""
+    return SHARDED and not f.get("cnpj") and "shard" not in f
+
+def fan_out(fn, f, *args):
+    """[fn(f restrito a um shard, *args)] para cada shard, em paralelo (cada um no seu app context)."""
+    return shards.fan_out(perf.carry(lambda key: _in_app_context(fn, {**f, "shard": key}, *args)))
+
+def tenant_session(f):
+    """Sessão de leitura dos pedidos/rollups do recorte `f`.
+
+    Banco único: read_session(). Sharded: o shard do CNPJ de `f` (ou o shard
+    fixado por fan_out); recortes sem CNPJ precisam passar por fan_out.
+    """
+    if not SHARDED:
+        return read_session()
+    if "shard" in f:
+        return shards.session(f["shard"])
+    if not f.get("cnpj"):
+        raise RuntimeError("consulta sem escopo de CNPJ no modo sharded: use fan_out")
+    return shards.session(shards.key(f["cnpj"]))
+
+def order_sessions():
+    """Sessões com pedidos: a principal ou, no modo sharded, uma por shard."""
+    return [shards.session(k) for k in shards.keys()] if SHARDED else [db.session]
+
+def has_orders() -> bool:
+    return any(s.query(Order.id).first() is not None for s in order_sessions())
+
+@app.cli.command("split-shards")
+def split_shards_command():
+    """Copia pedidos e itens do banco principal para um shard por CNPJ e monta os rollups."""
+    src = sqlite3.connect(db_path)
+    owners = [r[0] for r in src.execute("SELECT DISTINCT owner_cnpj FROM orders")]
+    for cnpj in owners:
+        key = shards.key(cnpj)
+        shards.session(key, read_only=False).remove()  # cria arquivo + schema
+        src.execute("ATTACH DATABASE ? AS shard", (str(shards.path(key)),))
+        try:
+            with src:
+                src.execute("DELETE FROM shard.order_items")
+                src.execute("DELETE FROM shard.orders")
+                src.execute(
+                    "INSERT INTO shard.orders (id, customer_email, channel_id, location_id, "
+                    "ordered_at, total, owner_cnpj) SELECT id, customer_email, channel_id, "
+                    "location_id, ordered_at, total, owner_cnpj FROM main.orders "
+                    "WHERE owner_cnpj IS ?", (cnpj,))
+                src.execute(
+                    "INSERT INTO shard.order_items (id, order_id, item_id, qty, unit_price) "
+                    "SELECT i.id, i.order_id, i.item_id, i.qty, i.unit_price "
+                    "FROM main.order_items i JOIN main.orders o ON o.id = i.order_id "
+                    "WHERE o.owner_cnpj IS ?", (cnpj,))
+        finally:
+            src.execute("DETACH DATABASE shard")
+        s = shards.session(key, read_only=False)
+        rebuild_orders_hourly(s)
+        rebuild_customer_activity(s)
+        rebuild_item_sales_daily(s)
+        s.remove()
+        print(f"[shards] {key}: {shards.session(key).query(Order).count()} pedidos")
+    src.close()
+    # os ids copiados vêm do banco único: a sequência global recomeça do maior deles
+    db.session.execute(text("DELETE FROM id_blocks WHERE name = 'orders'"))
+    db.session.commit()
+    if SHARDED:
+        rebuild_ewma_state()
+        data_version.bump()
+    print("[shards] pronto; suba o app com STORAGE_MODE=sharded "
+          "(os pedidos do banco principal não são apagados)")
+
+# ---------------------------------------------------------------------
+# MIGRAÇÕES (SQLite): versões aplicadas ficam em schema_migrations
+# ---------------------------------------------------------------------
+@app.cli.command("check-migrations")
+def check_migrations_command():
+    """Mostra a versão do schema e confere o EXPLAIN QUERY PLAN de cada índice."""
+    with db.engine.connect() as conn:
+        print(f"[migrate] versão do schema: {migrations.current_version(conn)}")
+        failed = 0
+        for m, c, ok, plan in migrations.check_plans(conn):
+            print(f"  v{m.version} {'ok   ' if ok else 'FALHA'} {c.expect}")
+            if not ok:
+                print(f"        plano: {plan}")
+                failed += 1
+    if failed:
+        raise SystemExit(1)
+
+# ---------------------------------------------------------------------
+# ROLLUPS: agregados mantidos a cada escrita de pedidos
+# ---------------------------------------------------------------------
+def hour_bucket(ts: datetime) -> str:
+    return ts.strftime("%Y-%m-%d %H:00")
+
+def first_full_hour(dt_from: datetime) -> datetime:
+    """Primeira hora cheia >= dt_from: a partir dela o recorte sai de baldes inteiros."""
+    start = dt_from.replace(minute=0, second=0, microsecond=0)
+    if start < dt_from:
+        start += timedelta(hours=1)
+    return start
+
+def first_bucket_from(dt_from: datetime) -> str:
+    return hour_bucket(first_full_hour(dt_from))
+
+def current_bucket() -> str:
+    return hour_bucket(datetime.now(timezone.utc))
+
+ORDERS_HOURLY_UPSERT = """
+    INSERT INTO orders_hourly (bucket, channel_id, location_id, owner_cnpj, orders, revenue, items_qty)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (bucket, channel_id, location_id, owner_cnpj) DO UPDATE SET
+        orders = orders + excluded.orders,
+        revenue = revenue + excluded.revenue,
+        items_qty = items_qty + excluded.items_qty
+"""
+
+CUSTOMER_ACTIVITY_UPSERT = """
+    INSERT INTO customer_activity (owner_cnpj, customer_email, first_order_at, last_order_at,
+                                   order_count, total_spent)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (owner_cnpj, customer_email) DO UPDATE SET
+        first_order_at = MIN(first_order_at, excluded.first_order_at),
+        last_order_at = MAX(last_order_at, excluded.last_order_at),
+        order_count = order_count + excluded.order_count,
+        total_spent = total_spent + excluded.total_spent
+"""
+
+ITEM_SALES_DAILY_UPSERT = """
+    INSERT INTO item_sales_daily (day, channel_id, location_id, owner_cnpj, item_id, qty, revenue)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (day, channel_id, location_id, owner_cnpj, item_id) DO UPDATE SET
+        qty = qty + excluded.qty,
+        revenue = revenue + excluded.revenue
+"""
+
+def batch_aggregates(b):
+    """Linhas de orders_hourly e de customer_activity de um lote colunar (ver seedgen)."""
+    n = len(b["total"])
+    if not n:
+        return [], []
+    ts_values = list(b["ts_values"])  # em ordem crescente
+    cnpj_values = [v or "" for v in b["cnpj_values"]]
+    email_values = list(b["email_values"])
+
+    # orders_hourly: chave (balde, canal, loja, CNPJ) compactada num inteiro
+    bucket_labels, ts_bucket = np.unique([v[:13] + ":00" for v in ts_values], return_inverse=True)
+    ch_vals, ch = np.unique(b["channel_id"], return_inverse=True)
+    loc_vals, loc = np.unique(b["location_id"], return_inverse=True)
+    nk = len(cnpj_values)
+    key = ((ts_bucket[b["ts_code"]] * len(ch_vals) + ch) * len(loc_vals) + loc) * nk + b["cnpj_code"]
+    keys, inv = np.unique(key, return_inverse=True)
+    order_qty = np.bincount(b["item_order"], weights=b["qty"], minlength=n)
+    rest, k = np.divmod(keys, nk)
+    rest, l = np.divmod(rest, len(loc_vals))
+    bk, c = np.divmod(rest, len(ch_vals))
+    hourly = list(zip(
+        bucket_labels[bk].tolist(), ch_vals[c].tolist(), loc_vals[l].tolist(),
+        [cnpj_values[i] for i in k.tolist()],
+        np.bincount(inv).tolist(),
+        np.bincount(inv, weights=b["total"]).tolist(),
+        np.bincount(inv, weights=order_qty).astype(np.int64).tolist(),
+    ))
+
+    # customer_activity: chave (CNPJ, e-mail)
+    ne = len(email_values)
+    ckeys, cinv = np.unique(b["cnpj_code"].astype(np.int64) * ne + b["email_code"], return_inverse=True)
+    first = np.full(len(ckeys), len(ts_values), dtype=np.int64)
+    last = np.full(len(ckeys), -1, dtype=np.int64)
+    np.minimum.at(first, cinv, b["ts_code"])
+    np.maximum.at(last, cinv, b["ts_code"])
+    kk, ee = np.divmod(ckeys, ne)
+    customers = list(zip(
+        [cnpj_values[i] for i in kk.tolist()],
+        [email_values[i] for i in ee.tolist()],
+        [ts_values[i] for i in first.tolist()],
+        [ts_values[i] for i in last.tolist()],
+        np.bincount(cinv).tolist(),
+        np.bincount(cinv, weights=b["total"]).tolist(),
+    ))
+    return hourly, customers
+
+def batch_item_sales(b):
+    """Linhas de item_sales_daily de um lote colunar (uma por dia/canal/loja/CNPJ/item)."""
+    if not len(b["item_id"]):
+        return []
+    o = b["item_order"]
+    day_labels, ts_day = np.unique([v[:10] for v in b["ts_values"]], return_inverse=True)
+    cnpj_values = [v or "" for v in b["cnpj_values"]]
+    parts = np.stack([ts_day[b["ts_code"][o]], b["channel_id"][o], b["location_id"][o],
+                      b["cnpj_code"][o], b["item_id"]], axis=1)
+    keys, inv = np.unique(parts, axis=0, return_inverse=True)
+    inv = inv.reshape(-1)
+    return list(zip(
+        day_labels[keys[:, 0]].tolist(), keys[:, 1].tolist(), keys[:, 2].tolist(),
+        [cnpj_values[i] for i in keys[:, 3].tolist()], keys[:, 4].tolist(),
+        np.bincount(inv, weights=b["qty"]).astype(np.int64).tolist(),
+        np.bincount(inv, weights=b["qty"] * b["unit_price"]).tolist(),
+    ))
+
+def write_order_batch(b):
+    """Grava um lote colunar de pedidos + itens e atualiza os agregados.
+
+    É o caminho único de escrita de pedidos: tudo acontece na transação corrente
+    da sessão (executemany direto no driver) e vale a partir do próximo commit.
+    No modo sharded o lote é dividido por CNPJ e cada parte vai para a transação
+    do seu shard, confirmada junto com o commit de db.session (ver
+    _commit_shard_writes); o banco principal só recebe o toque no estado EWMA.
+    Devolve os ids atribuídos aos pedidos, únicos também entre shards (ver
+    reserve_order_ids).
+    """
+    n = len(b["total"])
+    if not n:
+        return np.empty(0, dtype=np.int64)
+    if not SHARDED:
+        ids, hourly = insert_order_batch(db.session.connection(), b)
+    else:
+        ids = reserve_order_ids(n)
+        hourly = []
+        pending = db.session.info.setdefault("shard_writes", [])
+        for code, cnpj in enumerate(b["cnpj_values"]):
+            rows = np.flatnonzero(b["cnpj_code"] == code)
+            if not rows.size:
+                continue
+            s = shards.session(shards.key(cnpj), read_only=False)()
+            if s not in pending:
+                pending.append(s)
+            _, part = insert_order_batch(s.connection(), seedgen.select_batch(b, rows), ids[rows])
+            hourly.extend(part)
+    touch_ewma_state(db.session.connection(), hourly)
+    db.session.info["data_changed"] = True
+    return ids
+
+def reserve_order_ids(n):
+    """Reserva `n` ids de pedido consecutivos na sequência global do banco principal.
+
+    O UPDATE pega a trava de escrita do banco principal até o commit de
+    db.session, então lotes concorrentes recebem faixas disjuntas. Na primeira
+    reserva a sequência parte do maior id já gravado em qualquer shard (ex.:
+    depois de `flask split-shards`).
+    """
+    conn = db.session.connection()
+    bumped = conn.exec_driver_sql(
+        "UPDATE id_blocks SET next_id = next_id + ? WHERE name = 'orders'", (n,)).rowcount
+    if not bumped:
+        sql = text("SELECT COALESCE(MAX(id), 0) FROM orders")
+        top = max([0, *(shards.session(k).execute(sql).scalar() for k in shards.keys())])
+        conn.exec_driver_sql("INSERT INTO id_blocks (name, next_id) VALUES ('orders', ?)",
+                             (top + 1 + n,))
+    end = conn.exec_driver_sql("SELECT next_id FROM id_blocks WHERE name = 'orders'").scalar()
+    return np.arange(end - n, end, dtype=np.int64)
+
+def insert_order_batch(conn, b, ids=None):
+    """Pedidos, itens e rollups de um lote em `conn`; devolve (ids, linhas de orders_hourly).
+
+    Sem `ids`, os pedidos continuam o MAX(id) de `conn`; no modo sharded os ids
+    vêm de reserve_order_ids. Os ids de itens são sempre locais a `conn`.
+    """
+    n = len(b["total"])
+    # pega a trava de escrita ANTES de ler MAX(id): dois escritores concorrentes
+    # (ex.: /orders/batch) esperam um pelo outro em vez de disputar os mesmos ids
+    conn.exec_driver_sql("UPDATE orders SET id = id WHERE 0")
+    if ids is None:
+        first_id = conn.exec_driver_sql("SELECT COALESCE(MAX(id), 0) + 1 FROM orders").scalar()
+        ids = np.arange(first_id, first_id + n, dtype=np.int64)
+    first_item = conn.exec_driver_sql("SELECT COALESCE(MAX(id), 0) + 1 FROM order_items").scalar()
+
+    emails = np.asarray(b["email_values"], dtype=object)[b["email_code"]]
+    cnpjs = np.asarray(b["cnpj_values"], dtype=object)[b["cnpj_code"]]
+    stamps = np.asarray(b["ts_values"], dtype=object)[b["ts_code"]]
+    conn.exec_driver_sql(
+        "INSERT INTO orders (id, customer_email, channel_id, location_id, ordered_at, total, owner_cnpj) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        list(zip(ids.tolist(), emails.tolist(), b["channel_id"].tolist(), b["location_id"].tolist(),
+                 stamps.tolist(), b["total"].tolist(), cnpjs.tolist())))
+
+    m = len(b["item_id"])
+    conn.exec_driver_sql(
+        "INSERT INTO order_items (id, order_id, item_id, qty, unit_price) VALUES (?, ?, ?, ?, ?)",
+        list(zip(range(first_item, first_item + m), ids[b["item_order"]].tolist(),
+                 b["item_id"].tolist(), b["qty"].tolist(), b["unit_price"].tolist())))
+
+    hourly, customers = batch_aggregates(b)
+    conn.exec_driver_sql(ORDERS_HOURLY_UPSERT, hourly)
+    conn.exec_driver_sql(CUSTOMER_ACTIVITY_UPSERT, customers)
+    conn.exec_driver_sql(ITEM_SALES_DAILY_UPSERT, batch_item_sales(b))
+    return ids, hourly
+
+# A versão só avança DEPOIS do commit: uma leitura concorrente nunca guarda no
+# cache, sob a versão nova, um resultado calculado com os dados antigos.
+data_version = DataVersion()
+
+@event.listens_for(Session, "after_commit")
+def _bump_data_version_on_commit(session):
+    if session.info.pop("data_changed", False):
+        data_version.bump()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_data_change_on_rollback(session):
+    session.info.pop("data_changed", None)
+    session.info.pop("dims_changed", None)
+    for s in session.info.pop("shard_writes", ()):
+        s.rollback()
+
+@event.listens_for(Session, "before_commit")
+def _commit_shard_writes(session):
+    """Modo sharded: confirma os shards escritos na transação antes do banco principal.
+
+    O flush vem primeiro para que um erro no principal (ex.: Idempotency-Key
+    repetida) desfaça também os shards. Sem commit em duas fases no SQLite, uma
+    falha entre o commit dos shards e o do principal perde só o toque no EWMA
+    (recalculado depois) e o registro de idempotência.
+    """
+    pending = session.info.get("shard_writes")
+    if not pending:
+        return
+    session.flush()
+    for s in pending:
+        s.commit()
+    session.info.pop("shard_writes", None)
+
+def archived_before(s):
+    """Corte da última retenção no banco de `s` (texto do banco) ou "" se nada foi arquivado.
+
+    Antes dele só restam os rollups: os rebuilds preservam essa parte. O corte é
+    sempre meia-noite (retention_cutoff), início de um balde por hora e de um por
+    dia, então apagar os baldes >= corte e reinserir os pedidos >= corte cobre
+    o mesmo trecho; um corte no meio de um balde perderia a parte já arquivada.
+    """
+    cut = s.query(func.max(RetentionRun.cutoff)).scalar()
+    if not cut:
+        return ""
+    if cut != cut.replace(hour=0, minute=0, second=0, microsecond=0):
+        raise ValueError(f"corte de retenção fora da meia-noite: {cut}")
+    return seedgen.db_timestamp(cut)
+
+def rebuild_customer_activity(s=None):
+    s = s or db.session
+    s.execute(text("DELETE FROM customer_activity;"))
+    s.execute(text("""
+        INSERT INTO customer_activity (owner_cnpj, customer_email, first_order_at,
+                                       last_order_at, order_count, total_spent)
+        SELECT owner_cnpj, customer_email, MIN(first_at), MAX(last_at), SUM(n), SUM(spent)
+        FROM (SELECT COALESCE(owner_cnpj, '') AS owner_cnpj, customer_email,
+                     MIN(ordered_at) AS first_at, MAX(ordered_at) AS last_at,
+                     COUNT(*) AS n, COALESCE(SUM(total), 0.0) AS spent
+              FROM orders
+              GROUP BY 1, 2
+              UNION ALL
+              SELECT owner_cnpj, customer_email, first_order_at, last_order_at,
+                     order_count, total_spent
+              FROM archived_customers)
+        GROUP BY 1, 2;
+    """))
+    s.commit()
+
+def rebuild_orders_hourly(s=None):
+    s = s or db.session
+    cut = archived_before(s)
+    s.execute(text("DELETE FROM orders_hourly WHERE bucket >= :b;"), {"b": cut[:16]})
+    s.execute(text("""
+        INSERT INTO orders_hourly (bucket, channel_id, location_id, owner_cnpj, orders, revenue, items_qty)
+        SELECT strftime('%Y-%m-%d %H:00', o.ordered_at), o.channel_id, o.location_id,
+               COALESCE(o.owner_cnpj, ''), COUNT(*), COALESCE(SUM(o.total), 0.0),
+               COALESCE(SUM(i.qty), 0)
+        FROM orders o
+        LEFT JOIN (SELECT order_id, SUM(qty) AS qty FROM order_items GROUP BY order_id) i
+               ON i.order_id = o.id
+        WHERE o.ordered_at >= :cut
+        GROUP BY 1, 2, 3, 4;
+    """), {"cut": cut})
+    s.commit()
+
+def rebuild_item_sales_daily(s=None):
+    s = s or db.session
+    cut = archived_before(s)
+    s.execute(text("DELETE FROM item_sales_daily WHERE day >= :d;"), {"d": cut[:10]})
+    s.execute(text("""
+        INSERT INTO item_sales_daily (day, channel_id, location_id, owner_cnpj, item_id, qty, revenue)
+        SELECT strftime('%Y-%m-%d', o.ordered_at), o.channel_id, o.location_id,
+               COALESCE(o.owner_cnpj, ''), i.item_id, SUM(i.qty), SUM(i.qty * i.unit_price)
+        FROM order_items i
+        JOIN orders o ON o.id = i.order_id
+        WHERE o.ordered_at >= :cut
+        GROUP BY 1, 2, 3, 4, 5;
+    """), {"cut": cut})
+    s.commit()
+
+def ensure_rollups_built():
+    if SHARDED:
+        # shards nascem vazios e ganham os rollups em write_order_batch/split-shards
+        if has_orders() and not EwmaState.query.first():
+            rebuild_ewma_state()
+            print("[rollup] ewma_state reconstruída")
+        return
+    # bancos antigos: pedidos já existem mas os agregados ainda não foram populados
+    if not Order.query.first():
+        return
+    if not OrderHourly.query.first():
+        rebuild_orders_hourly()
+        print("[rollup] orders_hourly reconstruída")
+    if not CustomerActivity.query.first():
+        rebuild_customer_activity()
+        print("[rollup] customer_activity reconstruída")
+    if not ItemSalesDaily.query.first():
+        rebuild_item_sales_daily()
+        print("[rollup] item_sales_daily reconstruída")
+    if not EwmaState.query.first():
+        rebuild_ewma_state()
+        print("[rollup] ewma_state reconstruída")
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recalcula as tabelas de rollup a partir de orders/order_items (em cada shard, se houver)."""
+    for s in ([shards.session(k, read_only=False) for k in shards.keys()] if SHARDED
+              else [db.session]):
+        rebuild_orders_hourly(s)
+        rebuild_customer_activity(s)
+        rebuild_item_sales_daily(s)
+        print(f"[rollup] orders_hourly: {s.query(OrderHourly).count()} baldes")
+        print(f"[rollup] customer_activity: {s.query(CustomerActivity).count()} clientes")
+        print(f"[rollup] item_sales_daily: {s.query(ItemSalesDaily).count()} linhas")
+    rebuild_ewma_state()
+    print(f"[rollup] ewma_state: {EwmaState.query.count()} séries")
+
+# ---------------------------------------------------------------------
+# ANOMALIAS: EWMA incremental por série, avançado a cada hora fechada
+# ---------------------------------------------------------------------
+EWMA_ALPHA = float(os.getenv("EWMA_ALPHA", "0.3"))
+EWMA_WARMUP_DAYS = int(os.getenv("EWMA_WARMUP_DAYS", "7"))  # histórico usado ao (re)iniciar
+EWMA_MIN_POINTS = int(os.getenv("EWMA_MIN_POINTS", "12"))    # horas antes de pontuar
+# Piso do desvio-padrão: série parada (variância ~0) não transforma um pedido comum em pico
+EWMA_MIN_SD = float(os.getenv("EWMA_MIN_SD", "25"))     # em R$/hora, ~ um ticket médio
+EWMA_REL_SD = float(os.getenv("EWMA_REL_SD", "0.1"))    # fração da média
+GLOBAL_SERIES = ("*", 0, 0)
+
+# Série tocada por uma escrita: cria o estado (vazio) se for nova e, se a escrita
+# caiu numa hora já incorporada, zera last_bucket para recalcular do aquecimento.
+EWMA_TOUCH = """
+    INSERT INTO ewma_state (owner_cnpj, channel_id, location_id, last_bucket,
+                            n, mean, var, last_value, zscore)
+    VALUES (?, ?, ?, NULL, 0, 0, 0, 0, 0)
+    ON CONFLICT (owner_cnpj, channel_id, location_id) DO UPDATE SET
+        last_bucket = CASE WHEN last_bucket >= ? THEN NULL ELSE last_bucket END
+"""
+
+EWMA_SAVE = """
+    UPDATE ewma_state SET last_bucket = ?, n = ?, mean = ?, var = ?, last_value = ?, zscore = ?
+    WHERE owner_cnpj = ? AND channel_id = ? AND location_id = ? AND last_bucket IS ?
+"""
+
+ALERT_INSERT = """
+    INSERT OR IGNORE INTO alerts (created_at, owner_cnpj, channel_id, location_id, bucket,
+                                  severity, payload)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_ewma_lock = threading.Lock()
+
+def touch_ewma_state(conn, hourly):
+    oldest = {}
+    for bucket, ch, loc, cnpj, *_ in hourly:
+        key = (cnpj, ch, loc)
+        if key not in oldest or bucket < oldest[key]:
+            oldest[key] = bucket
+    if oldest:
+        rows = [(*k, b) for k, b in oldest.items()]
+        rows.append((*GLOBAL_SERIES, min(oldest.values())))
+        conn.exec_driver_sql(EWMA_TOUCH, rows)
+
+def rebuild_ewma_state():
+    db.session.execute(text("DELETE FROM ewma_state;"))
+    if SHARDED:  # as séries estão nos shards: junta as de cada um
+        series = [r for part in fan_out(ewma_series, {"cnpj": None}) for r in part]
+        if series:
+            db.session.connection().exec_driver_sql(
+                "INSERT INTO ewma_state (owner_cnpj, channel_id, location_id, last_bucket, "
+                "n, mean, var, last_value, zscore) VALUES (?, ?, ?, NULL, 0, 0, 0, 0, 0)", series)
+    else:
+        db.session.execute(text("""
+            INSERT INTO ewma_state (owner_cnpj, channel_id, location_id, last_bucket,
+                                    n, mean, var, last_value, zscore)
+            SELECT DISTINCT owner_cnpj, channel_id, location_id, NULL, 0, 0, 0, 0, 0
+            FROM orders_hourly;
+        """))
+    db.session.add(EwmaState(owner_cnpj=GLOBAL_SERIES[0], channel_id=0, location_id=0))
+    db.session.commit()
+
+def ewma_series(f):
+    return [tuple(r) for r in tenant_session(f).execute(text(
+        "SELECT DISTINCT owner_cnpj, channel_id, location_id FROM orders_hourly"))]
+
+def hourly_revenue(f, first, last):
+    """(balde, CNPJ, canal, loja, receita) de orders_hourly entre `first` e `last`."""
+    if fans_out(f):
+        return [r for part in fan_out(hourly_revenue, f, first, last) for r in part]
+    sql = ("SELECT bucket, owner_cnpj, channel_id, location_id, revenue FROM orders_hourly "
+           "WHERE bucket >= :a AND bucket <= :b")
+    session = db.session if not SHARDED else tenant_session(f)
+    return [tuple(r) for r in session.execute(text(sql), {"a": first, "b": last})]
+
+def severity_for(z):
+    if z >= 3: return "alto"
+    if z >= 2: return "médio"
+    return "normal"
+
+def advance_ewma():
+    """Incorpora ao estado as horas fechadas ainda não processadas.
+
+    Normalmente não há nada a fazer (uma consulta pequena) ou há uma hora nova
+    por série; só séries reiniciadas relêem a janela de aquecimento do rollup.
+    O z-score de cada hora é medido contra média/variância ANTERIORES a ela
+    (incluir o próprio ponto limita z a 1/sqrt(alpha) e esconde picos), com o
+    desvio-padrão limitado por baixo a max(EWMA_REL_SD * |média|, EWMA_MIN_SD).
+    Devolve as séries que avançaram, como tuplas (chave, estado).
+    """
+    now = datetime.now(timezone.utc)
+    last_closed = hour_bucket(now - timedelta(hours=1))
+    warm = first_bucket_from(now - timedelta(days=EWMA_WARMUP_DAYS))
+
+    with _ewma_lock:
+        pending = (EwmaState.query
+                   .filter(or_(EwmaState.last_bucket.is_(None),
+                               EwmaState.last_bucket < last_closed)).all())
+        if not pending:
+            return []
+
+        fresh = np.array([s.last_bucket is None or s.last_bucket < warm for s in pending])
+        starts = np.array([np.datetime64(warm if f else s.last_bucket, "h") + (0 if f else 1)
+                           for s, f in zip(pending, fresh)], dtype="datetime64[h]")
+        first = str(starts.min()).replace("T", " ") + ":00"
+        rows = hourly_revenue({"cnpj": None}, first, last_closed)
+        buckets = [r[0] for r in rows]
+        revenue = [r[4] for r in rows]
+
+        keys = [(s.owner_cnpj, s.channel_id, s.location_id) for s in pending]
+        axis, Y = timeseries.fill_matrix(buckets, [tuple(r[1:4]) for r in rows], revenue,
+                                         keys, first, last_closed)
+        if GLOBAL_SERIES in keys:
+            Y[keys.index(GLOBAL_SERIES)] = timeseries.fill_series(buckets, revenue, first,
+                                                                  last_closed)[1]
+
+        a = EWMA_ALPHA
+        start_idx = (starts - axis[0]).astype(np.int64)
+        n = np.where(fresh, 0, [s.n for s in pending])
+        m = np.array([s.mean for s in pending], dtype=np.float64)
+        v = np.array([s.var for s in pending], dtype=np.float64)
+        y_last = np.array([s.last_value for s in pending], dtype=np.float64)
+        z = np.zeros(len(pending))
+        for j in range(axis.size):
+            act = start_idx <= j
+            y = Y[:, j]
+            init = act & (n == 0)
+            cont = act & (n > 0)
+            sd = np.maximum(np.sqrt(np.maximum(v, 0.0)),
+                            np.maximum(EWMA_REL_SD * np.abs(m), EWMA_MIN_SD))
+            z = np.where(act, np.where(n >= EWMA_MIN_POINTS, np.abs(y - m) / sd, 0.0), z)
+            m_new = np.where(init, y, np.where(cont, a*y + (1-a)*m, m))
+            v = np.where(init, 0.0, np.where(cont, a*((y-m_new)**2) + (1-a)*v, v))
+            m = m_new
+            n = n + act
+            y_last = np.where(act, y, y_last)
+
+        advanced = []
+        params = []
+        for i, s in enumerate(pending):
+            state = {"last_bucket": last_closed, "n": int(n[i]), "mean": float(m[i]),
+                     "var": float(v[i]), "last_value": float(y_last[i]), "zscore": float(z[i])}
+            params.append((last_closed, state["n"], state["mean"], state["var"],
+                           state["last_value"], state["zscore"], *keys[i], s.last_bucket))
+            advanced.append((keys[i], state))
+        conn = db.session.connection()
+        conn.exec_driver_sql(EWMA_SAVE, params)
+        created = seedgen.db_timestamp(now.replace(tzinfo=None))
+        logged = [(created, *key, state["last_bucket"], severity_for(state["zscore"]),
+                   json.dumps(series_alert(key, state), ensure_ascii=False))
+                  for key, state in advanced if severity_for(state["zscore"]) != "normal"]
+        if logged:
+            conn.exec_driver_sql(ALERT_INSERT, logged)
+        db.session.commit()
+
+    if logged:
+        sync_alert_ring()
+    return advanced
+
+def ewma_dict(row):
+    return {c: getattr(row, c) for c in ("last_bucket", "n", "mean", "var", "last_value", "zscore")}
+
+def series_label(key):
+    cnpj, ch, loc = key
+    if key == GLOBAL_SERIES:
+        return "geral"
+    return f"{dims.channel_name(ch)}/{dims.location_name(loc)}" + (f" (CNPJ {cnpj})" if cnpj else "")
+
+def series_anomaly(key, state):
+    cnpj, ch, loc = key
+    return {
+        "cnpj": None if key == GLOBAL_SERIES else (cnpj or None),
+        "canal": dims.channel_name(ch) if ch else None,
+        "loja": dims.location_name(loc) if loc else None,
+        "last_hour": state["last_bucket"],
+        "valor": round(state["last_value"], 2),
+        "esperado": round(state["mean"], 2),
+        "zscore": round(state["zscore"], 2),
+        "severity": severity_for(state["zscore"]),
+    }
+
+def series_alert(key, state):
+    return {"tipo": "anomalia", **series_anomaly(key, state),
+            "msg": f"Receita atípica em {series_label(key)} às {state['last_bucket'][11:]} "
+                   f"(z={state['zscore']:.1f})."}
+
+# ---------------------------------------------------------------------
+# DIMENSÕES EM MEMÓRIA (canais, lojas, itens do cardápio)
+# ---------------------------------------------------------------------
+MenuEntry = namedtuple("MenuEntry", "id name price")
+
+class DimensionRegistry:
+    """Carrega as dimensões uma vez por processo e recarrega após escritas nelas.
+
+    Cada carga gera um snapshot imutável; leitores nunca veem um estado parcial.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snap = None
+
+    def _load(self):
+        channels = Channel.query.order_by(Channel.name).all()
+        locations = Location.query.order_by(Location.name).all()
+        items = MenuItem.query.order_by(MenuItem.name).all()
+        return {
+            "channel_ids": {c.name: c.id for c in channels},
+            "channel_names": {c.id: c.name for c in channels},
+            "location_ids": {l.name: l.id for l in locations},
+            "location_names": {l.id: l.name for l in locations},
+            "items": {i.name: MenuEntry(i.id, i.name, i.price) for i in items},
+            "item_ids": {i.name: i.id for i in items},
+            "items_by_id": {i.id: MenuEntry(i.id, i.name, i.price) for i in items},
+        }
+
+    def snapshot(self):
+        snap = self._snap
+        if snap is None:
+            with self._lock:
+                if self._snap is None:
+                    self._snap = self._load()
+                snap = self._snap
+        return snap
+
+    def invalidate(self):
+        self._snap = None
+
+    def channel_id(self, name):
+        return self.snapshot()["channel_ids"].get(name)
+
+    def location_id(self, name):
+        return self.snapshot()["location_ids"].get(name)
+
+    def channel_name(self, cid):
+        return self.snapshot()["channel_names"].get(cid)
+
+    def location_name(self, lid):
+        return self.snapshot()["location_names"].get(lid)
+
+    def channel_list(self):
+        return list(self.snapshot()["channel_ids"])  # já ordenado por nome
+
+    def location_list(self):
+        return list(self.snapshot()["location_ids"])
+
+    def menu(self):
+        return self.snapshot()["items"]
+
+    def item(self, iid):
+        return self.snapshot()["items_by_id"].get(iid)
+
+dims = DimensionRegistry()
+
+_DIMENSION_MODELS = (Channel, Location, MenuItem)
+
+@event.listens_for(Session, "before_flush")
+def _flag_dimension_writes(session, flush_context, instances):
+    if any(isinstance(o, _DIMENSION_MODELS)
+           for o in (*session.new, *session.dirty, *session.deleted)):
+        session.info["dims_changed"] = True
+
+@event.listens_for(Session, "after_commit")
+def _reload_dimensions_on_commit(session):
+    if session.info.pop("dims_changed", False):
+        dims.invalidate()
 
 # ---------------------------------------------------------------------
 # SEED LEVE E CONTROLÁVEL
 # ---------------------------------------------------------------------
+def seed_orders(profile, days, scale, cnpjs, seed=None, chunk=50000):
+    """Gera `days` dias de pedidos (perfil de seedgen.PROFILES) e grava em chunks.
+
+    Cada chunk é uma transação; para um mesmo `seed` a saída é determinística.
+    """
+    snap = dims.snapshot()
+    channel_ids = [snap["channel_ids"][c] for c in seedgen.CHANNELS]
+    location_ids = [snap["location_ids"][l] for l in seedgen.LOCATIONS]
+    menu = [(i.id, i.price) for i in dims.menu().values()]
+
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    total_ins = 0
+    for d in range(days):
+        day_start = (now - timedelta(days=d)).replace(hour=0)
+        batch = seedgen.generate_day(seed, d, day_start, seedgen.PROFILES[profile], scale,
+                                     channel_ids, location_ids, menu, cnpjs)
+        n = len(batch["total"])
+        for start in range(0, n, chunk):
+            write_order_batch(seedgen.slice_batch(batch, start, min(n, start + chunk)))
+            db.session.commit()
+        total_ins += n
+    return total_ins
+
+def drop_secondary_indexes(tables):
+    """Remove os índices (não-PK) das tabelas e devolve o DDL para recriá-los.
+
+    Em carga inicial sai bem mais barato construir cada índice uma vez no fim do
+    que mantê-lo linha a linha.
+    """
+    marks = ", ".join(f"'{t}'" for t in tables)
+    rows = db.session.execute(text(
+        f"SELECT name, sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL "
+        f"AND tbl_name IN ({marks});")).all()
+    for name, _ in rows:
+        db.session.execute(text(f'DROP INDEX IF EXISTS "{name}";'))
+    db.session.commit()
+    return [ddl for _, ddl in rows]
+
 def seed_business_data_if_empty():
-    if Order.query.first():
+    if has_orders():
+        return
+    if SHARDED and Order.query.first():
+        print("[shards] o banco principal tem pedidos e os shards estão vazios: rode `flask split-shards`")
         return
 
     SEED_DAYS  = int(os.getenv("SEED_DAYS",  "8"))
     SEED_SCALE = float(os.getenv("SEED_SCALE", "0.5"))
-    CHUNK      = int(os.getenv("SEED_CHUNK", "4000"))
+    CHUNK      = int(os.getenv("SEED_CHUNK", "50000"))
+    SEED_RANDOM = int(os.getenv("SEED_RANDOM", "42"))
 
-    channels  = ["Delivery Próprio","iFood","Balcão","WhatsApp"]
-    locations = ["SP","RJ","BH","POA"]
     items     = [("Cannoli Clássico",16.0),("Cannoli Pistache",18.0),
                  ("Tiramisu",22.0),("Panna Cotta",19.0),("Espresso",8.0)]
 
     if not Channel.query.first():
-        db.session.add_all([Channel(name=c) for c in channels])
+        db.session.add_all([Channel(name=c) for c in seedgen.CHANNELS])
     if not Location.query.first():
-        db.session.add_all([Location(name=l) for l in locations])
+        db.session.add_all([Location(name=l) for l in seedgen.LOCATIONS])
     if not MenuItem.query.first():
         db.session.add_all([MenuItem(name=n, price=p) for n,p in items])
     db.session.commit()
 
-    chmap = {c.name: c.id for c in Channel.query.all()}
-    locmap = {l.name: l.id for l in Location.query.all()}
-    itmap  = {i.name: i for i in MenuItem.query.all()}
-
     client_cnpjs = ["12345678000190", "11111111000191", "22222222000192"]
 
     try:
-        db.session.execute(text("PRAGMA journal_mode=WAL;"))
         db.session.execute(text("PRAGMA synchronous=OFF;"))
     except Exception:
         pass
 
-    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
-    random.seed(42)
-
-    def base_by_hour(h):
-        if 11 <= h <= 14: return 6
-        if 18 <= h <= 22: return 8
-        return 2
-
-    buffer = []
-    total_ins = 0
-
-    for d in range(SEED_DAYS):
-        day = now - timedelta(days=d)
-        for h in range(24):
-            base = base_by_hour(h)
-            vol = {
-                "Delivery Próprio": int((base + random.randint(0,2)) * SEED_SCALE),
-                "iFood":            int((base*1.4 + random.randint(0,2)) * SEED_SCALE),
-                "Balcão":           int((base*0.6 + random.randint(0,1)) * SEED_SCALE),
-                "WhatsApp":         int((base*0.9 + random.randint(0,1)) * SEED_SCALE),
-            }
-            for loc in locations:
-                loc_mult = 1.15 if loc == "SP" else 1.0
-                for ch, n in vol.items():
-                    n = max(0, int(n * loc_mult))
-                    for _ in range(n):
-                        ts = day.replace(hour=h)
-                        o = Order(
-                            customer_email=f"cliente{random.randint(1,120)}@mail.com",
-                            channel_id=chmap[ch],
-                            location_id=locmap[loc],
-                            ordered_at=ts,
-                            total=0.0,
-                            owner_cnpj=random.choices(client_cnpjs, weights=[5,2,2], k=1)[0]
-                        )
-                        k = random.randint(1,2)
-                        total = 0.0
-                        for _ in range(k):
-                            item = random.choice(list(itmap.values()))
-                            qty = 1
-                            total += item.price * qty
-                            o.items.append(OrderItem(item_id=item.id, qty=qty, unit_price=item.price))
-                        o.total = round(total, 2)
-                        buffer.append(o)
-
-                        if len(buffer) >= CHUNK:
-                            db.session.add_all(buffer)
-                            db.session.commit()
-                            total_ins += len(buffer)
-                            buffer.clear()
-
-    if buffer:
-        db.session.add_all(buffer)
+    # shards nascem junto com a carga; só o banco único tem índices a adiar
+    index_ddl = [] if SHARDED else drop_secondary_indexes(["orders", "order_items"])
+    try:
+        total_ins = seed_orders("seed", SEED_DAYS, SEED_SCALE, client_cnpjs,
+                                seed=SEED_RANDOM, chunk=CHUNK)
+    finally:
+        db.session.rollback()
+        for ddl in index_ddl:
+            db.session.execute(text(ddl))
         db.session.commit()
-        total_ins += len(buffer)
 
     try:
-        db.session.execute(text("PRAGMA synchronous=NORMAL;"))
+        db.session.execute(text(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS};"))
     except Exception:
         pass
 
@@ -242,7 +1153,8 @@ def seed_business_data_if_empty():
 
 with app.app_context():
     db.create_all()
-    ensure_owner_cnpj_column()
+    migrations.run_migrations(db.engine)
+    ensure_rollups_built()
 
     if not User.query.filter_by(role="admin").first():
         u = User(
@@ -285,60 +1197,227 @@ def get_scope_cnpj():
         pass
     return None
 
-def base_orders_query(period, channel, location, force_cnpj=None):
-    dt_from = period_to_dt(period)
-    q = Order.query.filter(Order.ordered_at >= dt_from)
+def resolve_filters(period, channel, location, force_cnpj=None):
+    """Traduz os filtros da URL (nomes) para ids + escopo de CNPJ."""
+    f = {"period": period, "dt_from": period_to_dt(period),
+         "channel_id": None, "location_id": None, "cnpj": None}
     if channel:
-        ch = Channel.query.filter_by(name=channel).first()
-        if ch: q = q.filter(Order.channel_id == ch.id)
+        f["channel_id"] = dims.channel_id(channel)
     if location:
-        loc = Location.query.filter_by(name=location).first()
-        if loc: q = q.filter(Order.location_id == loc.id)
-
-    scope = force_cnpj or get_scope_cnpj()
-    if scope:
-        q = q.filter(Order.owner_cnpj == scope)
+        f["location_id"] = dims.location_id(location)
+    f["cnpj"] = force_cnpj or get_scope_cnpj()
+    return f
 
+# ---------------------------------------------------------------------
+# CACHE DE RESPOSTAS (LRU + TTL, invalidado pela versão dos dados) + ETag
+# ---------------------------------------------------------------------
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("CACHE_TTL_SECONDS", "30")),
+)
+# Os períodos são janelas móveis ("últimas 24h"): mesmo sem pedidos novos a
+# resposta muda com o tempo, então o ETag também vira a cada janela.
+ETAG_WINDOW_SECONDS = float(os.getenv("ETAG_WINDOW_SECONDS", str(response_cache.ttl)))
+
+def data_watermark(cnpj=None):
+    """(maior id de pedido, versão local dos dados).
+
+    max(id) é uma busca no fim da PK de orders e enxerga inserções feitas por
+    outros processos; a versão local cobre o que não muda o maior id (reseed,
+    rebuild). No modo sharded vale o maior id do shard de `cnpj` ou, sem CNPJ,
+    a tupla dos maiores ids de todos os shards.
+    """
+    sql = text("SELECT max(id) FROM orders")
+    if SHARDED:
+        keys = [shards.key(cnpj)] if cnpj else shards.keys()
+        return (tuple(shards.session(k).execute(sql).scalar() or 0 for k in keys),
+                data_version.value)
+    top = read_session().execute(sql).scalar()
+    return (top or 0, data_version.value)
+
+def view_etag(key, watermark):
+    window = int(time.time() // ETAG_WINDOW_SECONDS) if ETAG_WINDOW_SECONDS > 0 else 0
+    return hashlib.blake2b(repr((key, watermark, window)).encode(), digest_size=12).hexdigest()
+
+def cached_view(name, args=(), defaults=None):
+    """Cacheia a resposta 200 da view por (endpoint, filtros normalizados, escopo, role).
+
+    A resposta leva um ETag desses mesmos dados + marca d'água; com If-None-Match
+    igual devolve 304 sem agregar nada (só a consulta de data_watermark).
+    Deve ficar abaixo de @jwt_required para que o escopo do token já esteja resolvido.
+    """
+    from functools import wraps
+    defaults = defaults or {}
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*a, **kw):
+            filters = tuple((k, request.args.get(k) or defaults.get(k)) for k in args)
+            role = (get_jwt() or {}).get("role")
+            cnpj = get_scope_cnpj()
+            key = (name, filters, cnpj, role)
+            version = data_watermark(cnpj)
+            etag = view_etag(key, version)
+
+            if request.if_none_match.contains_weak(etag):  # fraco se a resposta foi comprimida
+                resp = Response(status=304)
+                resp.headers["X-Cache"] = "NOT-MODIFIED"
+            else:
+                hit = response_cache.get(key, version)
+                if hit is not None:
+                    body, status, mimetype = hit
+                    resp = Response(body, status=status, mimetype=mimetype)
+                    resp.headers["X-Cache"] = "HIT"
+                else:
+                    resp = app.make_response(fn(*a, **kw))
+                    resp.headers["X-Cache"] = "MISS"
+                    if resp.status_code != 200 or resp.is_streamed:
+                        return resp
+                    response_cache.set(key, version, (resp.get_data(), resp.status_code, resp.mimetype))
+            resp.set_etag(etag)
+            # resposta depende do token: só cache privado, sempre revalidando
+            resp.headers["Cache-Control"] = "private, no-cache"
+            resp.vary.add("Authorization")
+            return resp
+        return wrapper
+    return deco
+
+def apply_order_filters(q, f):
+    """Canal/loja/CNPJ de `f` (sem o recorte de período) sobre uma query de Order."""
+    if f["channel_id"]: q = q.filter(Order.channel_id == f["channel_id"])
+    if f["location_id"]: q = q.filter(Order.location_id == f["location_id"])
+    if f["cnpj"]: q = q.filter(Order.owner_cnpj == f["cnpj"])
     return q
 
-def compute_kpis_from_query(q):
-    pedidos = q.count()
-    total_receita = (db.session.query(func.coalesce(func.sum(Order.total), 0.0))
-                     .select_from(q.subquery()).scalar())
-    ticket = round((total_receita / pedidos), 2) if pedidos else 0.0
-    conversoes = int(pedidos * 0.4)
+def orders_query(f):
+    q = tenant_session(f).query(Order).filter(Order.ordered_at >= f["dt_from"])
+    return apply_order_filters(q, f)
+
+def base_orders_query(period, channel, location, force_cnpj=None):
+    """Pedidos do recorte da URL + escopo do token (no modo sharded, já no shard do CNPJ)."""
+    return orders_query(resolve_filters(period, channel, location, force_cnpj))
+
+def rollup_query(f):
+    """Baldes inteiros do recorte de base_orders_query em orders_hourly (custo ~ nº de baldes).
+
+    O trecho de dt_from até a primeira hora cheia vem de head_rows.
+    """
+    q = (tenant_session(f).query(OrderHourly)
+         .filter(OrderHourly.bucket >= first_bucket_from(f["dt_from"])))
+    if f["channel_id"]: q = q.filter(OrderHourly.channel_id == f["channel_id"])
+    if f["location_id"]: q = q.filter(OrderHourly.location_id == f["location_id"])
+    if f["cnpj"]: q = q.filter(OrderHourly.owner_cnpj == f["cnpj"])
+    return q
 
+def head_rows(f):
+    """Trecho de dt_from até a primeira hora cheia, lido de orders (o balde dessa
+    hora no rollup também tem pedidos anteriores a dt_from).
+
+    [(balde de dt_from, canal, pedidos, receita)]; vazio se dt_from é hora cheia.
+    """
+    end = first_full_hour(f["dt_from"])
+    if end == f["dt_from"]:
+        return []
+    q = (tenant_session(f).query(Order.channel_id, func.count(Order.id),
+                                 func.coalesce(func.sum(Order.total), 0.0))
+         .filter(Order.ordered_at >= f["dt_from"], Order.ordered_at < end))
+    bucket = hour_bucket(f["dt_from"])
+    return [(bucket, cid, n, rev)
+            for cid, n, rev in apply_order_filters(q, f).group_by(Order.channel_id)]
+
+def rollup_totals(f):
+    """(pedidos, receita) do recorte `f`: orders_hourly + o trecho inicial (head_rows)."""
+    if fans_out(f):
+        parts = fan_out(rollup_totals, f)
+        return sum(p[0] for p in parts), sum(p[1] for p in parts)
+    orders, revenue = rollup_query(f).with_entities(
+        func.coalesce(func.sum(OrderHourly.orders), 0),
+        func.coalesce(func.sum(OrderHourly.revenue), 0.0)).one()
+    for _, _, n, rev in head_rows(f):
+        orders, revenue = orders + n, revenue + rev
+    return orders, revenue
+
+def merge_customers(parts):
+    """(clientes em 30d, em 7d) da união das listas (e-mail, comprou em 7d?) dos shards.
+
+    Um mesmo cliente pode comprar de vários CNPJs: contagens distintas não somam.
+    """
+    recent = {}
+    for rows in parts:
+        for email, in_7d in rows:
+            recent[email] = recent.get(email, False) or bool(in_7d)
+    return len(recent), sum(recent.values())
+
+def active_customers(f, d30, d7):
+    """Parcial de um shard para customer_counts: [(e-mail, comprou em 7d?)]."""
+    ca = CustomerActivity
+    return tenant_session(f).query(ca.customer_email, ca.last_order_at >= d7).filter(
+        ca.last_order_at >= d30).all()
+
+def customer_counts(f, d30, d7):
+    """(clientes com compra em 30d, em 7d) via customer_activity: um range por CNPJ."""
+    if fans_out(f):
+        return merge_customers(fan_out(active_customers, f, d30, d7))
+    ca = CustomerActivity
+    q = tenant_session(f).query(
+        func.count(func.distinct(ca.customer_email)),
+        func.count(func.distinct(case((ca.last_order_at >= d7, ca.customer_email)))),
+    ).filter(ca.last_order_at >= d30)
+    if f["cnpj"]: q = q.filter(ca.owner_cnpj == f["cnpj"])
+    return q.one()
+
+def compute_kpis(f, totals=None):
+    """Todos os KPIs no mesmo recorte de base_orders_query.
+
+    Sem canal/loja: pedidos e receita saem de orders_hourly (ou de `totals`, se
+    quem chama já leu o rollup) e os clientes de customer_activity. Com
+    canal/loja (que customer_activity não guarda), tudo sai de uma única
+    varredura de orders com agregados condicionais. Sem CNPJ no modo sharded,
+    cada shard devolve parciais e os clientes distintos saem da união deles.
+    """
     now = datetime.now(timezone.utc)
     d30 = now - timedelta(days=30)
     d7  = now - timedelta(days=7)
 
-    cli_30 = set(e[0] for e in db.session.query(Order.customer_email)
-                 .filter(Order.ordered_at >= d30)
-                 .group_by(Order.customer_email).all())
+    if (f["channel_id"] or f["location_id"]) and fans_out(f):
+        parts = fan_out(kpi_parts, f, d30, d7)
+        pedidos = sum(p[0] for p in parts)
+        total_receita = sum(p[1] for p in parts)
+        cli_30, cli_7 = merge_customers(p[2] for p in parts)
+    elif f["channel_id"] or f["location_id"]:
+        in_period = Order.ordered_at >= f["dt_from"]
+        q = tenant_session(f).query(
+            func.count(case((in_period, 1))),
+            func.coalesce(func.sum(case((in_period, Order.total))), 0.0),
+            func.count(func.distinct(case((Order.ordered_at >= d30, Order.customer_email)))),
+            func.count(func.distinct(case((Order.ordered_at >= d7, Order.customer_email)))),
+        ).filter(Order.ordered_at >= min(f["dt_from"], d30))
+        pedidos, total_receita, cli_30, cli_7 = apply_order_filters(q, f).one()
+    else:
+        pedidos, total_receita = totals if totals is not None else rollup_totals(f)
+        cli_30, cli_7 = customer_counts(f, d30, d7)
 
-    cli_7  = set(e[0] for e in db.session.query(Order.customer_email)
-                 .filter(Order.ordered_at >= d7)
-                 .group_by(Order.customer_email).all())
-
-    churn = round((len(cli_30 - cli_7) / len(cli_30), 3)) if cli_30 else 0.0
-    clientes_ativos = len(cli_7)
-    clientes_inativos = len(cli_30 - cli_7)
+    ticket = round((total_receita / pedidos), 2) if pedidos else 0.0
+    conversoes = int(pedidos * 0.4)
+    clientes_inativos = cli_30 - cli_7  # quem comprou em 7d também comprou em 30d
+    churn = round(clientes_inativos / cli_30, 3) if cli_30 else 0.0
 
     return {
         "conversoes": conversoes,
         "ticketMedio": ticket,
-        "pedidos": pedidos,
+        "pedidos": int(pedidos),
         "churn": churn,
         "totalVendas": round(float(total_receita or 0.0), 2),
-        "clientesAtivos": int(clientes_ativos),
+        "clientesAtivos": int(cli_7),
         "clientesInativos": int(clientes_inativos),
     }
 
-def zscore_anomaly(values):
-    if len(values) < 6: return False
-    mean = statistics.mean(values)
-    stdev = statistics.pstdev(values) or 1
-    return abs(values[-1] - mean) / stdev >= 2.2
+def kpi_parts(f, d30, d7):
+    """Parcial de um shard para compute_kpis com canal/loja: (pedidos, receita, clientes)."""
+    pedidos, receita = orders_query(f).with_entities(
+        func.count(Order.id), func.coalesce(func.sum(Order.total), 0.0)).one()
+    q = tenant_session(f).query(Order.customer_email, func.max(Order.ordered_at) >= d7).filter(
+        Order.ordered_at >= d30)
+    return pedidos, receita, apply_order_filters(q, f).group_by(Order.customer_email).all()
 
 # ---------------------------------------------------------------------
 # AUTH
@@ -623,171 +1702,273 @@ def me_update():
 # FILTERS / METRICS / PANELS
 # ---------------------------------------------------------------------
 @app.get("/filters/options")
+@jwt_required(optional=True)
+@cached_view("filter_options")
 def filter_options():
     periods = ["24h","7d","30d"]
-    channels = [c.name for c in Channel.query.order_by(Channel.name).all()]
-    locations = [l.name for l in Location.query.order_by(Location.name).all()]
-    return jsonify({"periods": periods, "channels": channels, "locations": locations})
+    return jsonify({"periods": periods, "channels": dims.channel_list(),
+                    "locations": dims.location_list()})
+
+def hourly_rows(f):
+    """(balde, canal, pedidos, receita) do recorte `f`: rollup + trecho inicial (head_rows).
+
+    Uma leitura serve à série de pedidos, à receita por canal, à série
+    empilhada e aos totais dos KPIs (ver /dashboard).
+    """
+    if fans_out(f):
+        acc = {}
+        for rows in fan_out(hourly_rows, f):
+            for bucket, cid, orders, revenue in rows:
+                o, r = acc.get((bucket, cid), (0, 0.0))
+                acc[(bucket, cid)] = (o + orders, r + revenue)
+        return [(b, c, o, r) for (b, c), (o, r) in sorted(acc.items())]
+    return head_rows(f) + (rollup_query(f)
+            .with_entities(OrderHourly.bucket, OrderHourly.channel_id,
+                           func.sum(OrderHourly.orders), func.sum(OrderHourly.revenue))
+            .group_by(OrderHourly.bucket, OrderHourly.channel_id).all())
+
+def rows_totals(rows):
+    return sum(r[2] for r in rows), sum(r[3] for r in rows)
+
+def orders_serie(rows, f, granularity="hour"):
+    """Pedidos por hora (ou dia) com eixo completo; aplica o filtro de canal de `f`."""
+    if f["channel_id"]:
+        rows = [r for r in rows if r[1] == f["channel_id"]]
+    axis, counts = timeseries.fill_series([r[0] for r in rows], [r[2] for r in rows],
+                                          hour_bucket(f["dt_from"]), current_bucket(),
+                                          granularity)
+    style = "hour" if f["period"] == "24h" and granularity == "hour" else "day"
+    return [{"hora": h, "pedidos": int(c)}
+            for h, c in zip(timeseries.labels(axis, style), counts.tolist())]
+
+def revenue_by_channel(rows):
+    out = {}
+    for _, cid, _, revenue in rows:
+        name = dims.channel_name(cid)
+        out[name] = out.get(name, 0.0) + float(revenue)
+    return dict(sorted(out.items()))
+
+def channel_stack(rows, f):
+    channels = dims.channel_list()
+    axis, m = timeseries.fill_matrix([r[0] for r in rows], [r[1] for r in rows],
+                                     [r[2] for r in rows],
+                                     [dims.channel_id(ch) for ch in channels],
+                                     hour_bucket(f["dt_from"]), current_bucket())
+    m = m.astype(np.int64)
+    series = {ch: m[i].tolist() for i, ch in enumerate(channels)}
+    return {"labels": timeseries.labels(axis, "bucket"), "series": series, "channels": channels}
+
+def top_items(f, limit=10):
+    """Itens com maior receita (soma de qty * unit_price) no recorte `f`.
+
+    Os dias inteiros do período saem de item_sales_daily; só o trecho do
+    primeiro dia (de dt_from até a meia-noite seguinte) é lido de
+    orders/order_items. O resultado é exato e o custo não cresce com o período.
+    """
+    ranked = sorted(item_totals(f).items(), key=lambda kv: (-kv[1][1], kv[0]))[:limit]
+    return [{"item": dims.item(iid).name, "qtd": qtd, "revenue": rev}
+            for iid, (qtd, rev) in ranked]
+
+def item_totals(f):
+    """{item: (qtd, receita)} do recorte `f` (ver top_items)."""
+    totals = {}
+    def add(iid, qtd, rev):
+        q0, r0 = totals.get(iid, (0, 0.0))
+        totals[iid] = (q0 + int(qtd or 0), r0 + float(rev or 0.0))
+
+    if fans_out(f):
+        for part in fan_out(item_totals, f):
+            for iid, (qtd, rev) in part.items():
+                add(iid, qtd, rev)
+        return totals
+
+    dt_from = f["dt_from"]
+    split = dt_from.replace(hour=0, minute=0, second=0, microsecond=0)
+    if split < dt_from:
+        split += timedelta(days=1)
+
+    head_orders = orders_query(f).filter(Order.ordered_at < split).with_entities(Order.id)
+    head = (tenant_session(f).query(OrderItem.item_id, func.sum(OrderItem.qty),
+                                 func.sum(OrderItem.qty * OrderItem.unit_price))
+            .filter(OrderItem.order_id.in_(head_orders.scalar_subquery()))
+            .group_by(OrderItem.item_id))
+
+    isd = ItemSalesDaily
+    tail = (tenant_session(f).query(isd.item_id, func.sum(isd.qty), func.sum(isd.revenue))
+            .filter(isd.day >= split.strftime("%Y-%m-%d")))
+    if f["channel_id"]: tail = tail.filter(isd.channel_id == f["channel_id"])
+    if f["location_id"]: tail = tail.filter(isd.location_id == f["location_id"])
+    if f["cnpj"]: tail = tail.filter(isd.owner_cnpj == f["cnpj"])
+
+    for iid, qtd, rev in (*head.all(), *tail.group_by(isd.item_id).all()):
+        add(iid, qtd, rev)
+    return totals
+
+def channel_orders(f):
+    """{canal: pedidos} do recorte `f`."""
+    if fans_out(f):
+        out = {}
+        for part in fan_out(channel_orders, f):
+            for cid, c in part.items():
+                out[cid] = out.get(cid, 0) + c
+        return out
+    return dict(orders_query(f).with_entities(Order.channel_id, func.count(Order.id))
+                .group_by(Order.channel_id).all())
+
+def suggestion_list():
+    s = []
+    f = {"period": "7d", "dt_from": period_to_dt("7d"),
+         "channel_id": None, "location_id": None, "cnpj": None}
+    byc = {dims.channel_name(cid): int(c) for cid, c in channel_orders(f).items()}
+
+    if byc.get("Delivery Próprio", 0) < int(byc.get("iFood", 0) * 0.7):
+        s.append("Invista em campanhas no Delivery Próprio para reduzir dependência do iFood.")
+
+    s.append("Teste combos de sobremesa + bebida para elevar o ticket médio.")
+    if not s:
+        s.append("Mantenha o plano atual: métricas dentro do esperado.")
+    return s
+
+def visible_kpis(kpis):
+    if (get_jwt() or {}).get("role") != "admin":
+        kpis.pop("churn", None)
+    return kpis
 
 @app.get("/metrics")
 @jwt_required(optional=True)
+@cached_view("metrics", args=("period", "channel", "location", "granularity"),
+             defaults={"period": "24h", "granularity": "hour"})
 def metrics():
     period  = request.args.get("period","24h")
     channel = request.args.get("channel") or None
     location= request.args.get("location") or None
+    granularity = "day" if request.args.get("granularity") == "day" else "hour"
 
-    q = base_orders_query(period, channel, location)
-    kpis = compute_kpis_from_query(q)
-
-    claims = get_jwt() or {}
-    if claims.get("role") != "admin":
-        kpis.pop("churn", None)
-
-    dt_from = period_to_dt(period)
-    rows = (db.session.query(
-                func.strftime("%Y-%m-%d %H:00", Order.ordered_at).label("h"),
-                func.count(Order.id))
-            .filter(Order.ordered_at >= dt_from)
-            .filter(Order.id.in_(q.with_entities(Order.id)))
-            .group_by("h").order_by("h").all())
-
-    serie = []
-    for h_str, c in rows:
-        label = h_str
-        for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:00"):
-            try:
-                dt = datetime.strptime(h_str, fmt)
-                label = dt.strftime("%H") if period == "24h" else dt.strftime("%d/%m")
-                break
-            except Exception:
-                pass
-        serie.append({"hora": label, "pedidos": int(c)})
-
-    return jsonify({"kpis": kpis, "serie": serie})
+    f = resolve_filters(period, channel, location)
+    rows = hourly_rows(f)
+    kpis = visible_kpis(compute_kpis(f, rows_totals(rows)))
+    return jsonify({"kpis": kpis, "serie": orders_serie(rows, f, granularity)})
 
 @app.get("/panel/by-channel")
 @jwt_required(optional=True)
+@cached_view("panel_by_channel", args=("period", "location"), defaults={"period": "24h"})
 def panel_by_channel():
     period  = request.args.get("period","24h")
     location= request.args.get("location") or None
-    q = base_orders_query(period, None, location)
-
-    rows = (db.session.query(Channel.name, func.coalesce(func.sum(Order.total), 0.0))
-            .join(Channel, Channel.id == Order.channel_id)
-            .filter(Order.id.in_(q.with_entities(Order.id)))
-            .group_by(Channel.name).order_by(Channel.name).all())
-    return jsonify({name: float(total) for name, total in rows})
+    return jsonify(revenue_by_channel(hourly_rows(resolve_filters(period, None, location))))
 
 @app.get("/panel/top-items")
 @jwt_required(optional=True)
+@cached_view("panel_top_items", args=("period", "channel", "location"), defaults={"period": "24h"})
 def panel_top_items():
     period  = request.args.get("period","24h")
     channel = request.args.get("channel") or None
     location= request.args.get("location") or None
-    q = base_orders_query(period, channel, location)
-    sub = q.with_entities(Order.id).subquery()
-    rows = (db.session.query(MenuItem.name,
-                             func.coalesce(func.sum(OrderItem.qty),0).label("qtd"),
-                             func.coalesce(func.sum(OrderItem.qty * OrderItem.unit_price),0.0).label("revenue"))
-            .join(OrderItem, OrderItem.item_id == MenuItem.id)
-            .filter(OrderItem.order_id.in_(sub))
-            .group_by(MenuItem.name)
-            .order_by(func.sum(OrderItem.qty * OrderItem.unit_price).desc())
-            .limit(10).all())
-    out = [{"item": n, "qtd": int(qtd), "revenue": float(rev)} for n,qtd,rev in rows]
-    return jsonify(out)
+    return jsonify(top_items(resolve_filters(period, channel, location)))
 
 @app.get("/suggestions")
 @jwt_required(optional=True)
+@cached_view("suggestions")
 def suggestions():
-    s = []
-    rows = (db.session.query(Channel.name, func.count(Order.id))
-            .join(Channel, Channel.id == Order.channel_id)
-            .filter(Order.ordered_at >= period_to_dt("7d"))
-            .group_by(Channel.name)).all()
-    byc = {n: int(c) for n, c in rows}
-
-    if byc.get("Delivery Próprio", 0) < int(byc.get("iFood", 0) * 0.7):
-        s.append("Invista em campanhas no Delivery Próprio para reduzir dependência do iFood.")
-
-    s.append("Teste combos de sobremesa + bebida para elevar o ticket médio.")
-    if not s:
-        s.append("Mantenha o plano atual: métricas dentro do esperado.")
-    return jsonify(s)
+    return jsonify(suggestion_list())
 
 # ---------------------------------------------------------------------
 # INSIGHTS (anomalia + RFM/propensão) - ADMIN
 # ---------------------------------------------------------------------
+def rfm_ranking(cnpj=None, days=30, weights=rfm.DEFAULT_WEIGHTS, offset=0, limit=10):
+    """(nº de clientes, linhas [offset, offset+limit) do ranking RFM) dos últimos `days` dias.
+
+    Um GROUP BY por cliente (memória ~ nº de clientes, não de pedidos); a
+    normalização e o top-k saem de rfm.py.
+    """
+    rows = rfm_rows({"cnpj": cnpj}, days, datetime.now(timezone.utc))
+    if not rows:
+        return 0, []
+
+    emails, freq, money, age = zip(*rows)
+    freq = np.asarray(freq, dtype=np.float64)
+    money = np.asarray(money, dtype=np.float64)
+    recency = np.maximum(np.floor(np.asarray(age, dtype=np.float64)), 0)  # dias inteiros
+    score = rfm.scores(freq, money, recency, weights)
+    idx = rfm.top_k(score, offset + limit, np.asarray(emails))[offset:]
+    return len(rows), [{"customer": emails[i], "score": round(float(score[i]), 3),
+                        "frequencia": int(freq[i]), "valor": round(float(money[i]), 2),
+                        "recencia_dias": int(recency[i])} for i in idx.tolist()]
+
+def rfm_rows(f, days, now):
+    """(e-mail, pedidos, valor, dias desde a última compra) por cliente, ordenado por e-mail."""
+    if fans_out(f):
+        acc = {}
+        for part in fan_out(rfm_rows, f, days, now):
+            for email, freq, money, age in part:
+                prev = acc.get(email)
+                acc[email] = (freq, money, age) if prev is None else (
+                    prev[0] + freq, prev[1] + money, min(prev[2], age))
+        return [(email, *v) for email, v in sorted(acc.items())]
+    q = (tenant_session(f).query(
+            Order.customer_email,
+            func.count(Order.id),
+            func.coalesce(func.sum(Order.total), 0.0),
+            func.julianday(seedgen.db_timestamp(now)) - func.julianday(func.max(Order.ordered_at)))
+         .filter(Order.ordered_at >= now - timedelta(days=days)))
+    if f["cnpj"]:
+        q = q.filter(Order.owner_cnpj == f["cnpj"])
+    return q.group_by(Order.customer_email).all()
+
+@app.get("/insights/rfm")
+@jwt_required()
+@cached_view("insights_rfm", args=("cnpj", "days", "page", "page_size", "wf", "wm", "wr"))
+def insights_rfm():
+    """Ranking RFM paginado. Cliente vê só o próprio CNPJ; admin pode filtrar por ?cnpj=."""
+    cnpj = get_scope_cnpj()
+    if not cnpj and get_jwt().get("role") == "admin":
+        cnpj = clean_cnpj(request.args.get("cnpj")) or None
+    try:
+        days = min(max(int(request.args.get("days", 30)), 1), 365)
+        page = max(int(request.args.get("page", 1)), 1)
+        page_size = min(max(int(request.args.get("page_size", 20)), 1), 200)
+        weights = rfm.normalize_weights([float(request.args.get(k, d))
+                                         for k, d in zip(("wf", "wm", "wr"), rfm.DEFAULT_WEIGHTS)])
+    except ValueError as e:
+        return jsonify({"error": f"parâmetro inválido: {e}"}), 400
+    cut = archived_until()
+    if cut is not None:  # antes do corte da retenção não há pedidos brutos
+        days = max(min(days, (datetime.now(timezone.utc).replace(tzinfo=None) - cut).days), 1)
+
+    total, items = rfm_ranking(cnpj, days, weights, (page - 1) * page_size, page_size)
+    return jsonify({
+        "cnpj": cnpj,
+        "days": days,
+        "weights": dict(zip(("f", "m", "r"), (round(w, 4) for w in weights.tolist()))),
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "items": items,
+    })
+
 @app.get("/insights/health")
 @admin_required
 def insights_health():
-    dt_from = datetime.now(timezone.utc) - timedelta(days=7)
-    rows = (db.session.query(
-                func.strftime("%Y-%m-%d %H:00", Order.ordered_at).label("h"),
-                func.coalesce(func.sum(Order.total), 0.0)
-            )
-            .filter(Order.ordered_at >= dt_from)
-            .group_by("h").order_by("h").all())
-
-    xs = [r[0] for r in rows]
-    ys = [float(r[1] or 0.0) for r in rows]
-
-    alpha = 0.3
-    mu, s2 = [], []
-    m, v = 0.0, 0.0
-    for i, y in enumerate(ys):
-        m = alpha*y + (1-alpha)*(m if i else y)
-        v = alpha*((y-m)**2) + (1-alpha)*(v if i else 0.0)
-        mu.append(m); s2.append(v)
-
-    z_last = 0.0
-    if ys:
-        sd = math.sqrt(s2[-1]) if s2[-1] > 0 else 1.0
-        z_last = abs(ys[-1] - mu[-1]) / sd if sd else 0.0
-
-    severity = "normal"
-    if z_last >= 3: severity = "alto"
-    elif z_last >= 2: severity = "médio"
-
-    now = datetime.now(timezone.utc)
-    d30 = now - timedelta(days=30)
-    q = (db.session.query(Order.customer_email, Order.total, Order.ordered_at)
-         .filter(Order.ordered_at >= d30)).all()
-
-    F = defaultdict(int)
-    M = defaultdict(float)
-    R = {}
-    for email, tot, ts in q:
-        F[email] += 1
-        M[email] += float(tot or 0.0)
-        days = max(0, (now - ts).days)
-        R[email] = min(R.get(email, 99999), days)
-
-    def norm(d):
-        if not d: return {}
-        lo, hi = min(d.values()), max(d.values())
-        rng = (hi - lo) or 1
-        return {k: (v - lo)/rng for k, v in d.items()}
-
-    Fn = norm(F); Mn = norm(M)
-    Rin = {}
-    if R:
-        lo, hi = min(R.values()), max(R.values())
-        rng = (hi - lo) or 1
-        for k, v in R.items():
-            Rin[k] = 1 - ((v - lo)/rng)
-
-    score = {k: 0.4*Fn.get(k,0) + 0.4*Mn.get(k,0) + 0.2*Rin.get(k,0)
-             for k in set(F) | set(M) | set(R)}
-    top = sorted(score.items(), key=lambda kv: kv[1], reverse=True)[:10]
-    rfm_top = [{"customer": k, "score": round(v, 3)} for k, v in top]
+    # anomalia: leitura do estado EWMA persistido (global + uma linha por série)
+    advance_ewma()
+    g = db.session.get(EwmaState, GLOBAL_SERIES)
+    z_last = g.zscore if g is not None and g.last_bucket else 0.0
+    flagged = (EwmaState.query
+               .filter(EwmaState.zscore >= 2, EwmaState.owner_cnpj != GLOBAL_SERIES[0],
+                       EwmaState.last_bucket.isnot(None))
+               .order_by(EwmaState.zscore.desc()).all())
+
+    _, top = rfm_ranking(limit=10)
+    rfm_top = [{"customer": r["customer"], "score": r["score"]} for r in top]
 
     return jsonify({
         "anomaly": {
-            "last_hour": xs[-1] if xs else None,
+            "last_hour": g.last_bucket if g is not None else None,
             "zscore": round(z_last, 2),
-            "severity": severity
+            "severity": severity_for(z_last)
         },
+        "anomalies": [series_anomaly((s.owner_cnpj, s.channel_id, s.location_id), ewma_dict(s))
+                      for s in flagged],
         "rfm_top": rfm_top
     })
 
@@ -796,113 +1977,732 @@ def insights_health():
 # ---------------------------------------------------------------------
 @app.get("/series/by-channel")
 @jwt_required(optional=True)
+@cached_view("series_by_channel", args=("period", "location", "cnpj"), defaults={"period": "24h"})
 def series_by_channel():
     period  = request.args.get("period","24h")
     location= request.args.get("location") or None
     cnpj_q  = request.args.get("cnpj") or None
 
-    q = base_orders_query(period, None, location, force_cnpj=cnpj_q)
+    f = resolve_filters(period, None, location, force_cnpj=cnpj_q)
+    return jsonify(channel_stack(hourly_rows(f), f))
 
-    dt_from = period_to_dt(period)
-    rows = (db.session.query(
-                func.strftime("%Y-%m-%d %H:00", Order.ordered_at).label("h"),
-                Channel.name,
-                func.count(Order.id)
-            )
-            .join(Channel, Channel.id == Order.channel_id)
-            .filter(Order.ordered_at >= dt_from)
-            .filter(Order.id.in_(q.with_entities(Order.id)))
-            .group_by("h", Channel.name)
-            .order_by("h")
-            .all())
+# ---------------------------------------------------------------------
+# DASHBOARD: todos os painéis numa requisição
+# ---------------------------------------------------------------------
+DASHBOARD_WORKERS = int(os.getenv("DASHBOARD_WORKERS", "0"))  # 0 = tudo na thread da requisição
+_dashboard_pool = (ThreadPoolExecutor(DASHBOARD_WORKERS, thread_name_prefix="dashboard")
+                   if DASHBOARD_WORKERS > 0 else None)
+
+def _in_app_context(fn, *args):
+    with app.app_context():  # sessão própria da thread; removida no teardown
+        return fn(*args)
+
+def run_side_query(fn, *args):
+    """Dispara `fn(*args)` no pool (se houver); devolve um callable que entrega o resultado."""
+    if _dashboard_pool is None:
+        value = fn(*args)
+        return lambda: value
+    return _dashboard_pool.submit(perf.carry(_in_app_context), fn, *args).result
+
+@app.get("/dashboard")
+@jwt_required(optional=True)
+@cached_view("dashboard", args=("period", "channel", "location"), defaults={"period": "24h"})
+def dashboard():
+    """KPIs, série, receita por canal, top itens, série empilhada e sugestões.
+
+    Filtros e escopo do JWT são resolvidos uma vez. Uma única leitura do rollup
+    (recorte sem o filtro de canal) alimenta série, painéis por canal e, sem
+    canal/loja, os totais dos KPIs. As consultas que precisam de `orders` (top
+    itens, KPIs com canal/loja, sugestões) podem rodar em paralelo a ela, num
+    pool de DASHBOARD_WORKERS threads.
+    """
+    period  = request.args.get("period","24h")
+    channel = request.args.get("channel") or None
+    location= request.args.get("location") or None
 
-    data = {}
-    for h, ch, cnt in rows:
-        data.setdefault(h, {})[ch] = int(cnt)
+    f = resolve_filters(period, channel, location)
+    all_channels = {**f, "channel_id": None}
+    items = run_side_query(top_items, f)
+    tips = run_side_query(suggestion_list)
+    kpis = run_side_query(compute_kpis, f) if f["channel_id"] or f["location_id"] else None
 
-    labels = sorted(data.keys())
-    channels = [c.name for c in Channel.query.order_by(Channel.name).all()]
-    series = {ch: [data.get(h, {}).get(ch, 0) for h in labels] for ch in channels}
-    return jsonify({"labels": labels, "series": series, "channels": channels})
+    rows = hourly_rows(all_channels)
+    kpis = kpis() if kpis is not None else compute_kpis(f, rows_totals(rows))
+    return jsonify({
+        "kpis": visible_kpis(kpis),
+        "serie": orders_serie(rows, f),
+        "byChannel": revenue_by_channel(rows),
+        "topItems": items(),
+        "stack": channel_stack(rows, all_channels),
+        "suggestions": tips(),
+    })
 
 # ---------------------------------------------------------------------
-# ALERTS + SSE (tempo real simples)
+# ALERTS + SSE (um produtor, N assinantes)
 # ---------------------------------------------------------------------
-STATE = {"alerta": None, "kpis": {"conversoes":120,"ticketMedio":58.9,"pedidos":340,"churn":0.07}}
+SSE_TICK_SECONDS      = float(os.getenv("SSE_TICK_SECONDS", "3"))
+SSE_QUEUE_SIZE        = int(os.getenv("SSE_QUEUE_SIZE", "16"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_TICKET_SECONDS    = int(os.getenv("SSE_TICKET_SECONDS", "30"))
+
+ALERTS_RING_SIZE        = int(os.getenv("ALERTS_RING_SIZE", "500"))
+ALERTS_MAX_WAIT_SECONDS = float(os.getenv("ALERTS_MAX_WAIT_SECONDS", "30"))
+ALERTS_REFRESH_SECONDS  = float(os.getenv("ALERTS_REFRESH_SECONDS", "2"))  # relê o log (outros workers)
+
+alert_ring = AlertRing(ALERTS_RING_SIZE)
+_alerts_refresh_lock = threading.Lock()
+_alerts_refreshed_at = 0.0
+
+def alert_from_row(row):
+    return {"id": row[0], "created_at": str(row[1]), **json.loads(row[2])}
+
+def read_alert_log(after, limit):
+    rows = db.session.execute(text(
+        "SELECT id, created_at, payload FROM alerts WHERE id > :a ORDER BY id LIMIT :n"),
+        {"a": after, "n": limit}).all()
+    return [alert_from_row(r) for r in rows]
+
+def sync_alert_ring():
+    """Traz para a cauda em memória o que entrou no log depois do último id visto."""
+    rows = db.session.execute(text(
+        "SELECT id, created_at, payload FROM "
+        "(SELECT * FROM alerts WHERE id > :a ORDER BY id DESC LIMIT :n) ORDER BY id"),
+        {"a": alert_ring.last_id, "n": ALERTS_RING_SIZE}).all()
+    alert_ring.extend([alert_from_row(r) for r in rows])
+
+def refresh_alerts():
+    """Avança o EWMA e relê o log, no máximo uma vez a cada ALERTS_REFRESH_SECONDS por processo."""
+    global _alerts_refreshed_at
+    if time.monotonic() - _alerts_refreshed_at < ALERTS_REFRESH_SECONDS:
+        return
+    if not _alerts_refresh_lock.acquire(blocking=False):
+        return  # outra requisição já está atualizando
+    try:
+        advance_ewma()
+        sync_alert_ring()
+        _alerts_refreshed_at = time.monotonic()
+    finally:
+        _alerts_refresh_lock.release()
+
+def alert_visible(alert, role, cnpj):
+    """Admin vê tudo; cliente só as séries do próprio CNPJ; sem login, só alertas gerais."""
+    if role == "admin":
+        return True
+    if alert.get("cnpj"):
+        return role == "cliente" and alert["cnpj"] == cnpj
+    return alert.get("canal") is None
+
+def alerts_after(after, limit):
+    """(alertas com id > after, maior id examinado); lê do banco se a cauda não cobre o cursor."""
+    if alert_ring.covers(after):
+        out = alert_ring.since(after, limit)
+    else:
+        out = read_alert_log(after, limit)
+    return out, (out[-1]["id"] if out else max(after, alert_ring.last_id))
 
 @app.get("/alerts")
+@jwt_required(optional=True)
 def alerts():
-    out = [STATE["alerta"]] if STATE["alerta"] else []
-    STATE["alerta"] = None
-    return jsonify(out)
+    """Alertas do log, do mais antigo para o mais novo.
+
+    Sem `after`: os `limit` mais recentes visíveis. Com `after=<id>`: só os novos;
+    `wait=<s>` segura a resposta até chegar algum (long polling). O cabeçalho
+    X-Alerts-Cursor traz o id a usar no próximo `after`.
+    """
+    try:
+        after = request.args.get("after")
+        if after is not None:
+            after = int(after)  # "abc" e "1.5" -> ValueError
+            if after < 0:
+                raise ValueError(after)
+        wait = min(max(float(request.args.get("wait", 0)), 0.0), ALERTS_MAX_WAIT_SECONDS)
+        limit = min(max(int(request.args.get("limit", 50)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "parâmetros inválidos"}), 400
+    role, cnpj = (get_jwt() or {}).get("role"), get_scope_cnpj()
+    refresh_alerts()
+
+    if after is None:
+        out = [a for a in alert_ring.since(0) if alert_visible(a, role, cnpj)][-limit:]
+        cursor = alert_ring.last_id
+    else:
+        deadline = time.monotonic() + wait
+        cursor = after
+        while True:
+            batch, cursor = alerts_after(cursor, limit)
+            out = [a for a in batch if alert_visible(a, role, cnpj)]
+            remaining = deadline - time.monotonic()
+            if out or remaining <= 0 or len(batch) == limit:
+                break
+            # acorda com alerta novo neste processo; a cada fatia relê o log (outros workers)
+            alert_ring.wait(cursor, min(remaining, ALERTS_REFRESH_SECONDS))
+            refresh_alerts()
+    resp = jsonify(out)
+    resp.headers["X-Alerts-Cursor"] = str(cursor)
+    resp.headers["Access-Control-Expose-Headers"] = "X-Alerts-Cursor"
+    return resp
+
+# EventSource não envia cabeçalhos, e o JWT na URL iria parar nos logs de acesso.
+# O dashboard troca o JWT por um ticket (POST /stream/ticket) e abre o stream com
+# ?ticket=: assinado (vale em qualquer worker), curto e de uso único (o nonce
+# usado fica guardado, por processo, até o ticket expirar).
+stream_tickets = URLSafeTimedSerializer(app.config["JWT_SECRET_KEY"], salt="sse-ticket")
+_used_tickets = {}  # nonce -> instante (monotonic) em que pode ser esquecido
+_used_tickets_lock = threading.Lock()
+
+@app.post("/stream/ticket")
+@jwt_required()
+def stream_ticket():
+    claims = get_jwt()
+    role = claims.get("role")
+    ticket = stream_tickets.dumps({"role": role,
+                                   "cnpj": claims.get("cnpj") if role == "cliente" else None,
+                                   "nonce": secrets.token_urlsafe(12)})
+    return jsonify({"ticket": ticket, "expiresIn": SSE_TICKET_SECONDS})
+
+def redeem_stream_ticket(ticket):
+    """Claims (role, cnpj) do ticket; None se inválido, expirado ou já usado."""
+    try:
+        claims = stream_tickets.loads(ticket, max_age=SSE_TICKET_SECONDS)
+    except BadData:
+        return None
+    now = time.monotonic()
+    with _used_tickets_lock:
+        for nonce in [n for n, until in _used_tickets.items() if until <= now]:
+            del _used_tickets[nonce]
+        if claims["nonce"] in _used_tickets:
+            return None
+        _used_tickets[claims["nonce"]] = now + SSE_TICKET_SECONDS + 1
+    return claims
+
+class RedactQueryCredentials(logging.Filter):
+    """Mascara ?ticket= / ?token= na linha de requisição do log de acesso do werkzeug."""
+    pattern = re.compile(r"([?&](?:ticket|token)=)[^&\s]+")
+
+    def filter(self, record):
+        if isinstance(record.args, tuple):
+            record.args = tuple(self.pattern.sub(r"\1***", a) if isinstance(a, str) else a
+                                for a in record.args)
+        return True
+
+logging.getLogger("werkzeug").addFilter(RedactQueryCredentials())
+
+def stream_topic(period, channel, location, ticket):
+    """Tópico do stream: (período, canal, loja, CNPJ do escopo, vê churn?).
+
+    Sem ticket o stream é anônimo; com ticket inválido devolve None (401).
+    """
+    period = period if period in ("24h", "7d", "30d") else "24h"
+    channel_id = dims.channel_id(channel) if channel else None
+    location_id = dims.location_id(location) if location else None
+    claims = {}
+    if ticket:
+        claims = redeem_stream_ticket(ticket)
+        if claims is None:
+            return None
+    role = claims.get("role")
+    cnpj = claims.get("cnpj") if role == "cliente" else None
+    return (period, channel_id, location_id, cnpj, role == "admin")
+
+def produce_kpi_events(topics):
+    """Um tick do hub: KPIs reais de cada recorte com assinantes (um cálculo por recorte)."""
+    with app.app_context():
+        try:
+            advance_ewma()  # horas recém-fechadas já geram alertas sem esperar /alerts
+        except Exception as e:
+            print(f"[sse] aviso ao avançar EWMA: {e}")
+        kpis = {}
+        out = {}
+        for topic in topics:
+            *cut, with_churn = topic
+            cut = tuple(cut)
+            if cut not in kpis:
+                period, channel_id, location_id, cnpj = cut
+                kpis[cut] = compute_kpis({
+                    "period": period, "dt_from": period_to_dt(period),
+                    "channel_id": channel_id, "location_id": location_id, "cnpj": cnpj})
+            k = dict(kpis[cut])
+            if not with_churn:
+                k.pop("churn", None)
+            out[topic] = sse_message(k)
+        return out
+
+kpi_hub = BroadcastHub(produce_kpi_events, tick=SSE_TICK_SECONDS, queue_size=SSE_QUEUE_SIZE,
+                       name="kpi-hub")
 
 @app.get("/stream/kpis")
 def stream_kpis():
+    """Assina o hub: não calcula nada por conexão, só repassa as mensagens do produtor.
+
+    Aqui (WSGI) cada conexão ocupa uma thread; em produção o app roda via asgi.py,
+    que atende esta rota com uma corrotina por conexão.
+    """
+    a = request.args
+    topic = stream_topic(a.get("period"), a.get("channel"), a.get("location"), a.get("ticket"))
+    if topic is None:
+        return jsonify({"error": "ticket inválido ou expirado"}), 401
+    sub = kpi_hub.subscribe(topic)
+
     def gen():
-        values = [18 + random.randint(-6,6) for _ in range(12)]
-        while True:
-            STATE["kpis"]["pedidos"] += random.randint(-3, 3)
-            STATE["kpis"]["conversoes"] += random.randint(-2, 2)
-            STATE["kpis"]["ticketMedio"] = round(58 + (random.random()-0.5)*4, 2)
-            novo = max(0, 18 + random.randint(-6,6))
-            values.append(novo)
-            if zscore_anomaly(values[-12:]) and not STATE["alerta"]:
-                STATE["alerta"] = {"tipo":"anomalia","msg":"Variação atípica detectada nos pedidos (última hora)."}
-            yield f"data: {json.dumps(STATE['kpis'])}\n\n"
-            time.sleep(3)
-    return Response(gen(), mimetype="text/event-stream")
+        try:
+            while not sub.dropped:
+                msg = sub.get(timeout=SSE_HEARTBEAT_SECONDS)
+                yield msg if msg is not None else SSE_PING
+        finally:
+            kpi_hub.unsubscribe(sub)
+    return Response(gen(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/dev/sse")
+@admin_required
+def dev_sse():
+    return jsonify({**kpi_hub.stats(), "alerts": alert_ring.stats()})
+
+# ---------------------------------------------------------------------
+# INGESTÃO DE PEDIDOS (PDV / integrações de delivery)
+# ---------------------------------------------------------------------
+ORDERS_BATCH_MAX_ROWS = int(os.getenv("ORDERS_BATCH_MAX_ROWS", "5000"))
+ORDERS_BATCH_MAX_BYTES = int(os.getenv("ORDERS_BATCH_MAX_BYTES", str(4 * 1024 * 1024)))
+
+def idempotent_replay(prev, body_hash):
+    if prev.body_sha256 != body_hash:
+        return jsonify({"error": "Idempotency-Key já usada com outro conteúdo"}), 409
+    resp = Response(prev.response, status=200, mimetype="application/json")
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+@app.post("/orders/batch")
+@jwt_required()
+def orders_batch():
+    """Grava um lote de pedidos (NDJSON ou array JSON) numa transação.
+
+    Pedidos inválidos voltam em "errors" com a posição no corpo; os válidos são
+    gravados. Com o cabeçalho Idempotency-Key, repetir o mesmo lote devolve a
+    resposta original sem gravar de novo (mesma chave com outro corpo: 409).
+    Cliente grava no próprio CNPJ; admin pode informar "cnpj" (aprovado) por pedido.
+    """
+    claims = get_jwt()
+    role = claims.get("role")
+    cnpj = claims.get("cnpj") if role == "cliente" else None
+    if role not in ("admin", "cliente") or (role == "cliente" and not cnpj):
+        return jsonify({"error": "sem permissão para enviar pedidos"}), 403
+
+    # corpo grande é recusado antes do parse: pelo Content-Length, sem ler nada, ou
+    # (chunked) lendo no máximo 1 byte além do limite, o que basta para saber que passou
+    request.max_content_length = ORDERS_BATCH_MAX_BYTES + 1
+    try:
+        raw = request.get_data()
+    except RequestEntityTooLarge:
+        raw = None
+    if raw is None or len(raw) > ORDERS_BATCH_MAX_BYTES:
+        return jsonify({"error": f"corpo acima de {ORDERS_BATCH_MAX_BYTES} bytes"}), 413
+    body_hash = hashlib.sha256(raw).hexdigest()
+    client = f"{role}:{get_jwt_identity()}"
+    key = (request.headers.get("Idempotency-Key") or "").strip() or None
+    if key is not None:
+        if len(key) > 120:
+            return jsonify({"error": "Idempotency-Key muito longa (máx. 120)"}), 400
+        prev = db.session.get(IngestBatch, (client, key))
+        if prev is not None:
+            return idempotent_replay(prev, body_hash)
+
+    try:
+        rows, errors = ingest.parse_body(raw, request.mimetype)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if len(rows) + len(errors) > ORDERS_BATCH_MAX_ROWS:
+        return jsonify({"error": f"lote acima de {ORDERS_BATCH_MAX_ROWS} pedidos"}), 413
+
+    snap = dims.snapshot()
+    allowed = None
+    if role == "admin":
+        allowed = {c for (c,) in db.session.query(CnpjRegistry.cnpj)
+                                           .filter(CnpjRegistry.approved.is_(True))}
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    valid, positions = [], []
+    for i, obj in rows:
+        try:
+            valid.append(ingest.validate_order(obj, snap, cnpj, allowed, now))
+            positions.append(i)
+        except ingest.RowError as e:
+            errors.append({"row": i, "error": str(e)})
+
+    ids = write_order_batch(ingest.to_batch(valid)).tolist() if valid else []
+    result = {
+        "accepted": len(valid),
+        "rejected": len(errors),
+        "orders": [{"row": i, "id": oid} for i, oid in zip(positions, ids)],
+        "errors": sorted(errors, key=lambda e: e["row"]),
+    }
+    if key is not None:
+        db.session.add(IngestBatch(client=client, idempotency_key=key, body_sha256=body_hash,
+                                   created_at=now, response=json.dumps(result)))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        if key is None:
+            raise
+        # retry concorrente com a mesma chave gravou primeiro: devolve o dele
+        return idempotent_replay(db.session.get(IngestBatch, (client, key)), body_hash)
+    return jsonify(result), 200
 
 # ---------------------------------------------------------------------
 # EXPORT & SIMULADOR
 # ---------------------------------------------------------------------
-@app.get("/export/csv")
-def export_csv():
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "5000"))
+
+def export_rows(f):
+    return (orders_query(f)
+            .with_entities(Order.id, Order.customer_email, Order.channel_id, Order.location_id,
+                           Order.ordered_at, Order.total)
+            .order_by(Order.ordered_at.desc(), Order.id.desc())
+            .yield_per(EXPORT_BATCH))
+
+def export_query():
+    """Linhas de exportação (filtros period/channel/location + escopo), em lotes.
+
+    Sem escopo no modo sharded: intercala o fluxo de cada shard, já ordenado.
+    """
     period  = request.args.get("period","24h")
     channel = request.args.get("channel") or None
     location= request.args.get("location") or None
-    q = base_orders_query(period, channel, location)
-
-    output = io.StringIO()
-    w = csv.writer(output)
-    w.writerow(["order_id","email","canal","loja","data","total"])
-    rows = (db.session.query(Order.id, Order.customer_email, Channel.name, Location.name, Order.ordered_at, Order.total)
-            .join(Channel, Channel.id==Order.channel_id)
-            .join(Location, Location.id==Order.location_id)
-            .filter(Order.id.in_(q.with_entities(Order.id)))
-            .order_by(Order.ordered_at.desc()).all())
+    f = resolve_filters(period, channel, location)
+    if fans_out(f):
+        return heapq.merge(*(export_rows({**f, "shard": k}) for k in shards.keys()),
+                           key=lambda r: (r[4], r[0]), reverse=True)
+    return export_rows(f)
+
+def stream_export(body):
+    """stream_with_context que solta as sessões de leitura no fim do fluxo.
+
+    A consulta da exportação é montada e executada dentro do gerador, depois do
+    teardown da requisição: sem isto cada download deixava uma conexão do pool
+    presa à sessão da thread (sob carga concorrente o pool esgotava).
+    """
+    def run():
+        try:
+            yield from body
+        finally:
+            release_read_sessions()
+    return stream_with_context(run())
+
+def iter_export_batches(rows):
+    batch = []
     for r in rows:
-        w.writerow([r[0], r[1], r[2], r[3], r[4].isoformat(), r[5]])
+        batch.append(r)
+        if len(batch) >= EXPORT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    return Response(output.getvalue(), mimetype="text/csv",
-                    headers={"Content-Disposition":"attachment; filename=pedidos.csv"})
+@app.get("/export/csv")
+def export_csv():
+    """CSV em streaming: lê em lotes de EXPORT_BATCH linhas e escreve à medida.
+
+    `?gzip=1` devolve o corpo com Content-Encoding: gzip (comprimido em fluxo).
+    """
+    use_gzip = (request.args.get("gzip") or "").lower() in ("1", "true", "yes")
+
+    def generate_csv():
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(["order_id","email","canal","loja","data","total"])
+        for batch in iter_export_batches(export_query()):
+            for r in batch:
+                w.writerow([r[0], r[1], dims.channel_name(r[2]), dims.location_name(r[3]),
+                            r[4].isoformat(), r[5]])
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0); buf.truncate()
+        yield buf.getvalue().encode("utf-8")
+
+    def generate_gzip():
+        z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> cabeçalho gzip
+        for chunk in generate_csv():
+            out = z.compress(chunk)
+            if out:
+                yield out
+        yield z.flush()
+
+    headers = {"Content-Disposition": "attachment; filename=pedidos.csv"}
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+    body = generate_gzip() if use_gzip else generate_csv()
+    return Response(stream_export(body), mimetype="text/csv", headers=headers)
+
+# ---- Exportação colunar (Parquet / Arrow IPC) - requer pyarrow ----
+class _ChunkSink:
+    """Arquivo "de mentira" para o pyarrow: acumula o que foi escrito até o próximo yield."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
 
-@app.post("/simulate/campaign")
-@admin_required
-def simulate_campaign():
-    data = request.get_json() or {}
-    canal = data.get("canal","Delivery Próprio")
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        out = b"".join(self.chunks)
+        self.chunks.clear()
+        return out
+
+def export_arrow_schema():
+    return pa.schema([
+        ("order_id", pa.int64()),
+        ("email", pa.string()),
+        ("canal", pa.dictionary(pa.int32(), pa.string())),
+        ("loja", pa.dictionary(pa.int32(), pa.string())),
+        ("data", pa.timestamp("us", tz="UTC")),
+        ("total", pa.float64()),
+    ])
+
+def iter_export_record_batches(rows, schema):
+    """Lotes tipados; canal/loja usam sempre o mesmo dicionário (vindo de `dims`)."""
+    channels = dims.channel_list()
+    locations = dims.location_list()
+    ch_index = {dims.channel_id(n): i for i, n in enumerate(channels)}
+    loc_index = {dims.location_id(n): i for i, n in enumerate(locations)}
+    ch_dict = pa.array(channels, type=pa.string())
+    loc_dict = pa.array(locations, type=pa.string())
+    for batch in iter_export_batches(rows):
+        ids, emails, chs, locs, stamps, totals = zip(*batch)
+        yield pa.record_batch([
+            pa.array(ids, type=pa.int64()),
+            pa.array(emails, type=pa.string()),
+            pa.DictionaryArray.from_arrays(
+                pa.array([ch_index[c] for c in chs], type=pa.int32()), ch_dict),
+            pa.DictionaryArray.from_arrays(
+                pa.array([loc_index[l] for l in locs], type=pa.int32()), loc_dict),
+            pa.array(stamps, type=pa.timestamp("us", tz="UTC")),
+            pa.array(totals, type=pa.float64()),
+        ], schema=schema)
+
+def _columnar_export(fmt):
+    if pa is None:
+        return jsonify({"error": "exportação colunar indisponível: instale o pacote pyarrow"}), 501
+    schema = export_arrow_schema()
+
+    def generate():
+        rows = export_query()
+        sink = _ChunkSink()
+        if fmt == "parquet":
+            writer = pq.ParquetWriter(sink, schema, compression="zstd")
+            write = writer.write_batch  # um row group por lote
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+            write = writer.write_batch
+        for rb in iter_export_record_batches(rows, schema):
+            write(rb)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+        writer.close()
+        yield sink.drain()
+
+    if fmt == "parquet":
+        mimetype, filename = "application/vnd.apache.parquet", "pedidos.parquet"
+    else:
+        mimetype, filename = "application/vnd.apache.arrow.stream", "pedidos.arrows"
+    return Response(stream_export(generate()), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.get("/export/parquet")
+def export_parquet():
+    return _columnar_export("parquet")
+
+@app.get("/export/arrow")
+def export_arrow():
+    return _columnar_export("arrow")
+
+SIM_HISTORY_DAYS = int(os.getenv("SIM_HISTORY_DAYS", "28"))   # dias fechados na base histórica
+SIM_PATHS        = int(os.getenv("SIM_PATHS", "2000"))
+SIM_MAX_PATHS    = 20000
+SIM_MAX_SCENARIOS = 200
+
+# base histórica por canal: mesma invalidação do cache de respostas (marca d'água)
+sim_baselines = ResponseCache(max_entries=64,
+                              ttl=float(os.getenv("SIM_BASELINE_TTL_SECONDS", "600")))
+
+def sim_baseline(channel_id):
+    """Pedidos e receita por dia do canal nos últimos SIM_HISTORY_DAYS dias fechados."""
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    key = (channel_id, today.date())
+    version = data_watermark()
+    hit = sim_baselines.get(key, version)
+    if hit is not None:
+        return hit
+
+    start = hour_bucket(today - timedelta(days=SIM_HISTORY_DAYS))
+    last = hour_bucket(today - timedelta(hours=1))
+    rows = channel_hourly({"channel_id": channel_id, "cnpj": None}, start, last)
+    buckets, orders, revenue = zip(*rows) if rows else ((), (), ())
+    _, orders = timeseries.fill_series(buckets, orders, start, last, "day")
+    _, revenue = timeseries.fill_series(buckets, revenue, start, last, "day")
+    # dias antes do primeiro pedido do canal não entram no bootstrap
+    first = int(np.argmax(orders > 0)) if orders.any() else orders.size
+    base = simulation.Baseline(orders[first:], revenue[first:])
+    sim_baselines.set(key, version, base)
+    return base
+
+def channel_hourly(f, start, last):
+    """(balde, pedidos, receita) do canal de `f` entre `start` e `last` (baldes repetidos entre shards)."""
+    if fans_out(f):
+        return [r for part in fan_out(channel_hourly, f, start, last) for r in part]
+    return (tenant_session(f).query(OrderHourly.bucket, func.sum(OrderHourly.orders),
+                                    func.sum(OrderHourly.revenue))
+            .filter(OrderHourly.channel_id == f["channel_id"],
+                    OrderHourly.bucket >= start, OrderHourly.bucket <= last)
+            .group_by(OrderHourly.bucket).all())
+
+def parse_scenario(data):
+    canal = data.get("canal", "Delivery Próprio")
+    channel_id = dims.channel_id(canal)
+    if channel_id is None:
+        raise ValueError(f"canal desconhecido: {canal}")
     investimento = float(data.get("investimento", 1000))
     dias = int(data.get("duracaoDias", 7))
+    if investimento < 0 or not 1 <= dias <= 365:
+        raise ValueError("investimento >= 0 e duracaoDias entre 1 e 365")
+    return canal, channel_id, investimento, dias
 
-    rows = (db.session.query(func.count(Order.id))
-            .join(Channel, Channel.id==Order.channel_id)
-            .filter(Channel.name==canal, Order.ordered_at >= period_to_dt("7d"))).first()
-    base_vendas = int(rows[0] or 150)
+@app.post("/simulate/campaign")
+@admin_required
+def simulate_campaign():
+    """Projeção de campanha por Monte Carlo sobre o histórico do canal.
 
-    coef = 0.12 if canal=="Delivery Próprio" else 0.09
-    uplift = int((investimento/1000.0) * coef * dias * 10)
-    receita_media = 58.0
-    receita = round((base_vendas + uplift) * receita_media, 2)
+    Corpo com um cenário ({"canal", "investimento", "duracaoDias"}) devolve o
+    resultado dele; com {"scenarios": [...]} devolve todos numa chamada. Opcionais:
+    "paths" (caminhos por cenário) e "seed" (reprodutível; a usada volta na resposta).
+    """
+    data = request.get_json() or {}
+    batch = data.get("scenarios")
+    try:
+        scenarios = [parse_scenario(sc) for sc in (batch if batch is not None else [data])]
+        paths = int(data.get("paths", SIM_PATHS))
+        seed = int(data["seed"]) if data.get("seed") is not None else int(np.random.SeedSequence().entropy % 2**32)
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": f"cenário inválido: {e}"}), 400
+    if not scenarios or len(scenarios) > SIM_MAX_SCENARIOS:
+        return jsonify({"error": f"entre 1 e {SIM_MAX_SCENARIOS} cenários"}), 400
+    if not 100 <= paths <= SIM_MAX_PATHS:
+        return jsonify({"error": f"paths entre 100 e {SIM_MAX_PATHS}"}), 400
+
+    results = []
+    for i, (canal, channel_id, investimento, dias) in enumerate(scenarios):
+        rng = np.random.default_rng([seed, i])  # cada cenário reprodutível por si
+        sim = simulation.simulate(sim_baseline(channel_id), canal, investimento, dias, paths, rng)
+        results.append(simulation.summarize(sim, canal, investimento, dias))
+
+    meta = {"paths": paths, "seed": seed, "historico_dias": SIM_HISTORY_DAYS}
+    if batch is None:
+        return jsonify({**results[0], **meta})
+    return jsonify({"scenarios": results, **meta})
 
-    return jsonify({
-        "canal": canal,
-        "uplift_pedidos": uplift,
-        "proj_receita": receita,
-        "kpi_esperado": {
-            "ticketMedio": round(receita_media + (uplift*0.01), 2),
-            "conversoes": int((base_vendas + uplift) * 0.4)
-        }
-    })
+# ---------------------------------------------------------------------
+# RETENÇÃO: pedidos antigos -> arquivo NDJSON gzip + VACUUM incremental
+# ---------------------------------------------------------------------
+# Pedidos anteriores a RETENTION_DAYS saem de orders/order_items (ver
+# retention.py); os rollups continuam com eles. Os painéis leem pedidos brutos
+# de até 30 dias, por isso o horizonte mínimo é 31.
+RETENTION_DAYS        = int(os.getenv("RETENTION_DAYS", "90"))
+RETENTION_MIN_DAYS    = 31
+RETENTION_BATCH       = int(os.getenv("RETENTION_BATCH", "5000"))
+RETENTION_ARCHIVE_DIR = (os.getenv("RETENTION_ARCHIVE_DIR")
+                         or os.path.join(os.path.dirname(os.path.abspath(db_path)), "archive"))
+
+def retention_cutoff(days) -> datetime:
+    """Meia-noite (UTC) de `days` dias atrás: os baldes por hora/dia não ficam partidos."""
+    today = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days)
+
+def archived_until():
+    """Maior corte de retenção entre os bancos de pedidos (None se nada foi arquivado)."""
+    cuts = [c for c in (s.query(func.max(RetentionRun.cutoff)).scalar() for s in order_sessions()) if c]
+    return max(cuts) if cuts else None
+
+def retention_targets():
+    """[(nome, caminho do arquivo SQLite)] com pedidos: o banco principal ou cada shard."""
+    if SHARDED:
+        return [(k, str(shards.path(k))) for k in shards.keys()]
+    return [("main", db_path)]
+
+def run_retention(days=RETENTION_DAYS, batch=RETENTION_BATCH, dry_run=False, convert=False, log=print):
+    """Aplica a retenção em cada banco de pedidos; devolve um relatório por banco."""
+    days = max(days, RETENTION_MIN_DAYS)
+    cutoff = seedgen.db_timestamp(retention_cutoff(days))
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    os.makedirs(RETENTION_ARCHIVE_DIR, exist_ok=True)
+    reports = {}
+    for name, path in retention_targets():
+        conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+        try:
+            apply_sqlite_pragmas(conn)
+            archive = os.path.join(RETENTION_ARCHIVE_DIR, f"orders-{name}-{stamp}.ndjson.gz")
+            report = retention.run(conn, cutoff, archive, batch=batch, convert=convert,
+                                   dry_run=dry_run, log=log)
+            if report.get("pedidos"):
+                with conn:
+                    conn.execute(
+                        "INSERT INTO retention_runs (ran_at, cutoff, orders, items, archive, "
+                        "bytes_before, bytes_after) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (seedgen.db_timestamp(datetime.now(timezone.utc)), cutoff,
+                         report["pedidos"], report["itens"], archive,
+                         report["antes"]["arquivo"], report["depois"]["arquivo"]))
+        finally:
+            conn.close()
+        reports[name] = report
+    if any(r.get("pedidos") for r in reports.values()):
+        data_version.bump()
+    return reports
+
+@app.cli.command("retention")
+@click.option("--days", type=int, default=RETENTION_DAYS, show_default=True,
+              help=f"horizonte em dias (mínimo {RETENTION_MIN_DAYS})")
+@click.option("--batch", type=int, default=RETENTION_BATCH, show_default=True)
+@click.option("--dry-run", is_flag=True, help="só conta os pedidos e mede o banco")
+@click.option("--convert", is_flag=True,
+              help="converte o banco para auto_vacuum=INCREMENTAL (VACUUM completo)")
+def retention_command(days, batch, dry_run, convert):
+    """Arquiva e remove pedidos anteriores ao horizonte e compacta o banco."""
+    mb = lambda n: f"{n / 2**20:.1f} MB"
+    for name, r in run_retention(days, batch, dry_run, convert).items():
+        print(f"[retention] {name}: corte {r['cutoff']}, {r['pendentes']} pedidos a arquivar")
+        if "reducao" not in r:
+            continue
+        print(f"[retention] {name}: {r['pedidos']} pedidos / {r['itens']} itens -> {r['arquivo']}")
+        print(f"[retention] {name}: arquivo {mb(r['antes']['arquivo'])} -> "
+              f"{mb(r['depois']['arquivo'])} (-{mb(r['reducao']['arquivo'])})")
+        for group in ("tabelas", "indices"):
+            for k, v in r["reducao"].get(group, {}).items():
+                print(f"[retention] {name}:   {k}: -{mb(v)} (de {mb(r['antes'][group][k])})")
+
+@app.route("/dev/retention", methods=["GET", "POST"])
+@admin_required
+def dev_retention():
+    """GET: execuções anteriores. POST {"days", "dry_run"}: roda a retenção (sem --convert)."""
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        try:
+            days = int(data.get("days", RETENTION_DAYS))
+        except (TypeError, ValueError):
+            return jsonify({"error": "days inválido"}), 400
+        return jsonify({"ok": True, "bancos": run_retention(
+            days, dry_run=bool(data.get("dry_run")), log=lambda msg: None)})
+    runs = [{"ran_at": r.ran_at.isoformat(), "cutoff": r.cutoff.isoformat(), "orders": r.orders,
+             "items": r.items, "archive": r.archive, "bytes_before": r.bytes_before,
+             "bytes_after": r.bytes_after}
+            for s in order_sessions() for r in s.query(RetentionRun).order_by(RetentionRun.id)]
+    return jsonify({"days": RETENTION_DAYS, "archive_dir": RETENTION_ARCHIVE_DIR,
+                    "runs": sorted(runs, key=lambda r: r["ran_at"])})
 
 # --------- DEV: reseed / seed-more / peek ----------
 @app.post("/dev/reseed")
@@ -910,6 +2710,9 @@ def simulate_campaign():
 def dev_reseed():
     db.drop_all()
     db.create_all()
+    if SHARDED:
+        shards.drop_all()
+    dims.invalidate()
 
     u = User(
         nome="Admin InovaTech",
@@ -930,6 +2733,10 @@ def dev_reseed():
     db.session.commit()
 
     seed_business_data_if_empty()
+    # a tabela alerts foi recriada: ids recomeçam, a cauda em memória também
+    alert_ring.clear()
+    sync_alert_ring()
+    data_version.bump()  # usuários/CNPJs também foram recriados
     return jsonify({"ok": True, "msg": "Banco reseedado"}), 200
 
 @app.post("/dev/seed-more")
@@ -943,74 +2750,46 @@ def dev_seed_more():
         seed_business_data_if_empty()
         return jsonify({"ok": True, "msg": "Seed base criado"}), 200
 
-    chmap = {c.name: c.id for c in Channel.query.all()}
-    locmap = {l.name: l.id for l in Location.query.all()}
-    itmap = {i.name: i for i in MenuItem.query.all()}
-
-    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
-    random.seed()
-
-    def base_by_hour(h):
-        if 11 <= h <= 14: return 9
-        if 18 <= h <= 22: return 11
-        return 3
-
-    added = 0
-    for d in range(extra_days):
-        day = now - timedelta(days=d)
-        for h in range(24):
-            base = base_by_hour(h)
-            vol = {
-                "Delivery Próprio": base + random.randint(0,3),
-                "iFood": int(base*1.6) + random.randint(0,3),
-                "Balcão": int(base*0.7) + random.randint(0,2),
-                "WhatsApp": int(base*1.1) + random.randint(0,2),
-            }
-            for loc in ["SP","RJ","BH","POA"]:
-                loc_mult = 1.25 if loc=="SP" else 1.0
-                for ch, n in vol.items():
-                    n = int(n * loc_mult)
-                    for _ in range(n):
-                        ts = day.replace(hour=h)
-                        o = Order(
-                            customer_email=f"cliente{random.randint(1,400)}@mail.com",
-                            channel_id=chmap[ch],
-                            location_id=locmap[loc],
-                            ordered_at=ts,
-                            total=0.0,
-                            owner_cnpj=random.choice(cnpjs)
-                        )
-                        total = 0.0
-                        for _ in range(random.randint(1,3)):
-                            item = random.choice(list(itmap.values()))
-                            qty = random.randint(1,2)
-                            total += item.price * qty
-                            o.items.append(OrderItem(item_id=item.id, qty=qty, unit_price=item.price))
-                        o.total = round(total, 2)
-                        db.session.add(o)
-                        added += 1
-    db.session.commit()
+    added = seed_orders("seed-more", extra_days, 1.0, cnpjs, seed=data.get("seed"))
     return jsonify({"ok": True, "added": added}), 200
 
+@app.get("/dev/cache")
+@admin_required
+def dev_cache():
+    return jsonify({"data_version": data_version.value, **response_cache.stats()})
+
+@app.get("/dev/perf")
+@admin_required
+def dev_perf():
+    """Histogramas de tempo por rota e de SQL por requisição, em texto do Prometheus."""
+    if perf_metrics is None:
+        return jsonify({"error": "instrumentação desligada (PERF_METRICS=0)"}), 404
+    return Response(perf_metrics.render(), content_type=perf.CONTENT_TYPE)
+
 @app.get("/dev/peek")
 def dev_peek():
     try:
+        sessions = order_sessions()
         totals = {
             "users": User.query.count(),
-            "orders": Order.query.count(),
-            "order_items": OrderItem.query.count(),
+            "orders": sum(s.query(Order).count() for s in sessions),
+            "order_items": sum(s.query(OrderItem).count() for s in sessions),
             "channels": Channel.query.count(),
             "locations": Location.query.count(),
-            "db_path": db_path
+            "db_path": db_path,
+            "storage": STORAGE_MODE,
         }
-        sample = db.session.execute(
+        if SHARDED:
+            totals["shards"] = len(sessions)
+        sample = sorted((dict(r) for s in sessions for r in s.execute(
             text("SELECT ordered_at,total FROM orders ORDER BY ordered_at DESC LIMIT 3;")
-        ).mappings().all()
-        return jsonify({"ok": True, "totals": totals, "latest": [dict(r) for r in sample]})
+        ).mappings()), key=lambda r: r["ordered_at"], reverse=True)[:3]
+        return jsonify({"ok": True, "totals": totals, "latest": sample})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
 # ---------------------------------------------------------------------
 if __name__ == "__main__":
     print(f"[boot] usando banco: {db_path}")
+    print("[boot] servidor de desenvolvimento; em produção: uvicorn asgi:app (ver asgi.py)")
     app.run(port=5001, debug=True)
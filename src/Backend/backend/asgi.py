@@ -0,0 +1,63 @@
+"""Entrada de produção: /stream/kpis assíncrono, resto do app Flask via WsgiToAsgi.
+
+No servidor WSGI (flask run / app.py) cada conexão SSE ocupa uma thread. Aqui
+cada dashboard aberto é só uma corrotina esperando a fila dele no hub, então
+1000 conexões não precisam de 1000 threads. É o deploy padrão sempre que o
+stream de KPIs estiver em uso; `asgiref` e `uvicorn` estão no requirements.txt:
+
+    pip install -r requirements.txt
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+
+`python app.py` continua servindo tudo (inclusive o stream) para desenvolvimento.
+"""
+import asyncio, json
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app as flask_app, kpi_hub, stream_topic, SSE_HEARTBEAT_SECONDS
+from sse import SSE_PING
+
+wsgi = WsgiToAsgi(flask_app)
+
+async def stream_kpis(scope, receive, send):
+    qs = parse_qs(scope.get("query_string", b"").decode())
+    with flask_app.app_context():
+        topic = stream_topic(*((qs.get(k) or [None])[0]
+                               for k in ("period", "channel", "location", "ticket")))
+    if topic is None:  # ticket inválido, expirado ou já usado
+        await send({"type": "http.response.start", "status": 401, "headers": [
+            (b"content-type", b"application/json"),
+            (b"access-control-allow-origin", b"*"),
+        ]})
+        body = json.dumps({"error": "ticket inválido ou expirado"}).encode()
+        await send({"type": "http.response.body", "body": body})
+        return
+    sub = kpi_hub.subscribe(topic, loop=asyncio.get_running_loop())
+
+    async def wait_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    try:
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+            (b"access-control-allow-origin", b"*"),
+        ]})
+        while not sub.dropped and not disconnected.done():
+            msg = await sub.get(SSE_HEARTBEAT_SECONDS)
+            await send({"type": "http.response.body",
+                        "body": (msg if msg is not None else SSE_PING).encode(),
+                        "more_body": True})
+    finally:
+        disconnected.cancel()
+        kpi_hub.unsubscribe(sub)
+
+async def app(scope, receive, send):
+    if scope["type"] == "http" and scope["path"] == "/stream/kpis" and scope["method"] == "GET":
+        await stream_kpis(scope, receive, send)
+    else:
+        await wsgi(scope, receive, send)
@@ -0,0 +1,327 @@
+"""Benchmark de carga dos endpoints de leitura (latência, vazão e memória).
+
+Para cada tamanho de base (SEED_DAYS x SEED_SCALE) sobe um subprocesso com um
+banco temporário próprio, semeado pelo app na importação, e mede cada endpoint
+de duas formas:
+
+- "client": sequencial pelo test client do Flask (custo da view, sem rede);
+- "http": clientes HTTP concorrentes (threads com keep-alive) contra o servidor
+  do werkzeug em modo threaded, rodando no subprocesso.
+
+O relatório JSON traz p50/p95/p99 (ms), vazão (req/s) e o pico de RSS do
+processo do app. Cada tamanho roda --repeat vezes (subprocesso e banco novos a
+cada vez) e o relatório guarda a mediana de cada número: entre duas rodadas do
+mesmo código o p95 de uma rodada só oscila uns 30%. Com --baseline compara com
+um relatório anterior e sai com código 1 se algum p50/p95 ou vazão piorar além
+de --threshold (padrão 50%).
+
+Uso (a partir de src/Backend/backend):
+    python bench/bench_endpoints.py                       # bases 8x0.5 e 30x2
+    python bench/bench_endpoints.py --sizes 8x0.5 --reps 50 --out antes.json
+    python bench/bench_endpoints.py --baseline antes.json --repeat 5 --threshold 0.3
+    python bench/bench_endpoints.py --only metrics dashboard --no-http
+
+O cache de respostas fica desligado (CACHE_TTL_SECONDS=0) para medir o cálculo;
+--cache mantém a configuração do ambiente.
+"""
+import argparse, http.client, json, logging, os, platform, statistics, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+try:  # só POSIX; sem ele o relatório sai sem RSS
+    import resource
+except ImportError:
+    resource = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+TAG = "BENCH "  # prefixo das linhas do protocolo worker -> pai (o app também escreve no stdout)
+
+# (nome, caminho, papel do token)
+ENDPOINTS = [
+    ("metrics_24h", "/metrics?period=24h", "admin"),
+    ("metrics_30d", "/metrics?period=30d", "admin"),
+    ("metrics_30d_ifood", "/metrics?period=30d&channel=iFood", "admin"),
+    ("metrics_30d_day", "/metrics?period=30d&granularity=day", "admin"),
+    ("metrics_7d_cliente", "/metrics?period=7d", "cliente"),
+    ("panel_by_channel_7d", "/panel/by-channel?period=7d", "admin"),
+    ("panel_top_items_30d", "/panel/top-items?period=30d", "admin"),
+    ("series_by_channel_7d", "/series/by-channel?period=7d", "admin"),
+    ("dashboard_24h", "/dashboard?period=24h", "admin"),
+    ("dashboard_30d", "/dashboard?period=30d", "admin"),
+    ("dashboard_7d_cliente", "/dashboard?period=7d", "cliente"),
+    ("filters_options", "/filters/options", "admin"),
+    ("suggestions", "/suggestions", "admin"),
+    ("insights_rfm_30d", "/insights/rfm?days=30", "admin"),
+    ("insights_health", "/insights/health", "admin"),
+    ("alerts", "/alerts", "admin"),
+    ("export_csv_24h", "/export/csv?period=24h", "admin"),
+    ("export_parquet_24h", "/export/parquet?period=24h", "admin"),
+]
+CLIENT_CNPJ = "11111111000191"
+
+
+def percentiles(samples_ms, wall_s):
+    """p50/p95/p99/média (ms) e vazão (req/s) de uma série de latências."""
+    s = sorted(samples_ms)
+    q = statistics.quantiles(s, n=100, method="inclusive") if len(s) > 1 else s * 99
+    return {"n": len(s), "p50": round(q[49], 3), "p95": round(q[94], 3), "p99": round(q[98], 3),
+            "mean": round(statistics.fmean(s), 3), "rps": round(len(s) / wall_s, 1) if wall_s else None}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(kb / (2**20 if sys.platform == "darwin" else 2**10), 1)  # macOS devolve bytes
+
+
+def emit(obj):
+    print(TAG + json.dumps(obj), flush=True)
+
+
+# --- subprocesso: app + test client + servidor HTTP ---
+def worker(args):
+    sys.path.insert(0, BACKEND)
+    t0 = time.perf_counter()
+    import app as app_mod
+    seed_s = time.perf_counter() - t0
+    from flask_jwt_extended import create_access_token
+
+    app = app_mod.app
+    with app.app_context():
+        orders = sum(s.query(app_mod.Order.id).count() for s in app_mod.order_sessions())
+        tokens = {
+            "admin": create_access_token("1", additional_claims={"role": "admin"}),
+            "cliente": create_access_token("2", additional_claims={"role": "cliente", "cnpj": CLIENT_CNPJ}),
+        }
+    rss_seed = peak_rss_mb()
+
+    client = app.test_client()
+    results = {}
+    for name, path, role in selected(args.only):
+        headers = {"Authorization": f"Bearer {tokens[role]}"}
+        # buffered: respostas em streaming (export) são lidas dentro da requisição
+        r = client.get(path, headers=headers, buffered=True)  # aquece (páginas, imports tardios)
+        if r.status_code != 200:
+            results[name] = {"status": r.status_code}
+            continue
+        samples = []
+        wall = time.perf_counter()
+        for _ in range(args.reps):
+            t = time.perf_counter()
+            client.get(path, headers=headers, buffered=True)
+            samples.append((time.perf_counter() - t) * 1000)
+        results[name] = percentiles(samples, time.perf_counter() - wall)
+    emit({"event": "client", "orders": orders, "seed_s": round(seed_s, 2),
+          "rss_seed_mb": rss_seed, "endpoints": results})
+
+    if not args.no_http:
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)  # sem log por requisição
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        emit({"event": "ready", "port": server.server_port, "tokens": tokens})
+        sys.stdin.readline()  # o pai avisa quando a carga HTTP terminou
+        server.shutdown()
+    emit({"event": "done", "rss_peak_mb": peak_rss_mb()})
+
+
+def selected(only):
+    return [e for e in ENDPOINTS if not only or any(o in e[0] for o in only)]
+
+
+# --- processo pai: clientes HTTP concorrentes ---
+def http_load(port, path, token, requests, concurrency):
+    """Latências (ms) de `requests` GETs repartidos entre `concurrency` conexões keep-alive."""
+    headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+    per_thread = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+
+    def run(n):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        samples, errors = [], 0
+        try:
+            for _ in range(n):
+                t = time.perf_counter()
+                conn.request("GET", path, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                samples.append((time.perf_counter() - t) * 1000)
+                errors += resp.status != 200
+        finally:
+            conn.close()
+        return samples, errors
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        parts = list(pool.map(run, per_thread))
+    wall = time.perf_counter() - wall
+    out = percentiles([x for s, _ in parts for x in s], wall)
+    out["errors"] = sum(e for _, e in parts)
+    out["concurrency"] = concurrency
+    return out
+
+
+def read_event(proc, name):
+    for line in proc.stdout:
+        if line.startswith(TAG):
+            msg = json.loads(line[len(TAG):])
+            if msg["event"] == name:
+                return msg
+    raise RuntimeError(f"worker terminou antes do evento {name!r} (código {proc.wait()})")
+
+
+def run_size(size, args, tmp, run=0):
+    days, scale = size.split("x")
+    env = dict(os.environ, DB_PATH=os.path.join(tmp, f"bench_{size}_{run}.db"),
+               SEED_DAYS=days, SEED_SCALE=scale)
+    if not args.cache:
+        env["CACHE_TTL_SECONDS"] = "0"
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", "--reps", str(args.reps)]
+    cmd += ["--no-http"] if args.no_http else []
+    cmd += ["--only", *args.only] if args.only else []
+    proc = subprocess.Popen(cmd, env=env, cwd=BACKEND, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, text=True)
+    try:
+        res = read_event(proc, "client")
+        endpoints = {name: {"client": stats} for name, stats in res.pop("endpoints").items()}
+        if not args.no_http:
+            ready = read_event(proc, "ready")
+            for name, path, role in selected(args.only):
+                if "status" in endpoints[name]["client"]:
+                    continue
+                endpoints[name]["http"] = http_load(ready["port"], path, ready["tokens"][role],
+                                                    args.requests, args.concurrency)
+            proc.stdin.write("\n")
+            proc.stdin.flush()
+        res.update(read_event(proc, "done"))
+        res.pop("event")
+    finally:
+        proc.stdin.close()
+        proc.wait()
+    res["endpoints"] = endpoints
+    return res
+
+
+def median_runs(runs):
+    """Junta as rodadas de um tamanho: mediana de cada número, campo a campo."""
+    first = runs[0]
+    if not isinstance(first, dict):
+        nums = [r for r in runs if isinstance(r, (int, float)) and not isinstance(r, bool)]
+        if len(nums) != len(runs):
+            return first
+        m = statistics.median(nums)
+        return m if isinstance(first, float) else round(m)
+    return {k: median_runs([r[k] for r in runs if k in r]) for k in first}
+
+
+# --- relatório e comparação com a linha de base ---
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, threshold, min_ms):
+    """Regressões de `report` frente a `baseline`: [(onde, medida, antes, depois)].
+
+    Latência (p50/p95) conta só se piorar mais que `threshold` (fração) e mais
+    que `min_ms` em valor absoluto; vazão, se cair mais que `threshold` e o
+    tempo por requisição (1000/rps) subir pelo menos `min_ms`; RSS, se subir
+    mais que `threshold`.
+    """
+    out = []
+    for size, cur in report["sizes"].items():
+        base = baseline.get("sizes", {}).get(size)
+        if base is None:
+            continue
+        if cur.get("rss_peak_mb") and base.get("rss_peak_mb") \
+                and cur["rss_peak_mb"] > base["rss_peak_mb"] * (1 + threshold):
+            out.append((size, "rss_peak_mb", base["rss_peak_mb"], cur["rss_peak_mb"]))
+        for name, modes in cur["endpoints"].items():
+            for mode, stats in modes.items():
+                old = base["endpoints"].get(name, {}).get(mode)
+                if not old or "p50" not in old or "p50" not in stats:
+                    continue
+                where = f"{size} {name} [{mode}]"
+                for k in ("p50", "p95"):
+                    if stats[k] > old[k] * (1 + threshold) and stats[k] - old[k] >= min_ms:
+                        out.append((where, k, old[k], stats[k]))
+                if (old.get("rps") and stats.get("rps") and stats["rps"] < old["rps"] / (1 + threshold)
+                        and 1000 / stats["rps"] - 1000 / old["rps"] >= min_ms):
+                    out.append((where, "rps", old["rps"], stats["rps"]))
+    return out
+
+
+def print_size(size, res):
+    print(f"\n{size} (SEED_DAYS x SEED_SCALE)  pedidos={res['orders']}  seed={res['seed_s']}s  "
+          f"RSS pico={res.get('rss_peak_mb')} MB")
+    print(f"  {'endpoint':<24}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}"
+          f"{'http p50':>10}{'p95':>9}{'p99':>9}{'req/s':>9}")
+    for name, modes in res["endpoints"].items():
+        c, h = modes["client"], modes.get("http", {})
+        if "status" in c:
+            print(f"  {name:<24}  HTTP {c['status']}")
+            continue
+        row = f"  {name:<24}{c['p50']:>9.2f}{c['p95']:>9.2f}{c['p99']:>9.2f}{c['rps']:>9.1f}"
+        if h:
+            row += f"{h['p50']:>10.2f}{h['p95']:>9.2f}{h['p99']:>9.2f}{h['rps']:>9.1f}"
+            row += f"  ({h['errors']} erros)" if h["errors"] else ""
+        print(row)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", nargs="+", default=["8x0.5", "30x2"],
+                    help="bases como SEED_DAYSxSEED_SCALE")
+    ap.add_argument("--reps", type=int, default=30, help="requisições por endpoint no test client")
+    ap.add_argument("--requests", type=int, default=200, help="requisições HTTP por endpoint")
+    ap.add_argument("--concurrency", type=int, default=8, help="clientes HTTP simultâneos")
+    ap.add_argument("--only", nargs="+", help="só endpoints cujo nome contém um destes trechos")
+    ap.add_argument("--no-http", action="store_true", help="só o test client")
+    ap.add_argument("--cache", action="store_true", help="mantém o cache de respostas ligado")
+    ap.add_argument("--out", default="bench_endpoints.json", help="relatório JSON")
+    ap.add_argument("--baseline", help="relatório anterior para comparar")
+    ap.add_argument("--repeat", type=int, default=3, help="rodadas por tamanho (vale a mediana)")
+    ap.add_argument("--threshold", type=float, default=0.5, help="piora tolerada (fração)")
+    ap.add_argument("--min-ms", type=float, default=1.0, help="piora mínima de latência (ms) que conta")
+    ap.add_argument("--worker", action="store_true")
+    args = ap.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: getattr(args, k) for k in ("reps", "requests", "concurrency", "repeat", "cache")},
+        "sizes": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            runs = [run_size(size, args, tmp, run) for run in range(max(args.repeat, 1))]
+            report["sizes"][size] = median_runs(runs)
+            print_size(size, report["sizes"][size])
+
+    with open(args.out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nrelatório: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        regressions = compare(report, baseline, args.threshold, args.min_ms)
+        print(f"linha de base: {args.baseline} ({baseline.get('git')}, {baseline.get('created_at')})")
+        for where, metric, old, new in regressions:
+            print(f"  REGRESSÃO {where} {metric}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print(f"  sem regressões acima de {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark: compute_kpis (1 varredura / rollups) vs. a versão antiga com 4 consultas.
+
+Uso (a partir de src/Backend/backend):
+    python bench/bench_kpis.py                 # SEED_SCALE 0.5 e 5 (~10 s)
+    python bench/bench_kpis.py --scales 50     # ~730 mil pedidos (~45 s)
+    python bench/bench_kpis.py --reps 20 --legacy-reps 5
+
+Cada escala roda num subprocesso com um banco temporário próprio (DB_PATH),
+semeado pelo próprio app na importação; o resultado de cada escala sai assim
+que ela termina. Tempos medidos com 8 dias: ~3 s na escala 0.5, ~4 s na 5 e
+~40 s na 50 (metade na versão antiga, um terço na semeadura).
+
+A versão antiga (legacy_kpis) é a compute_kpis_from_query original com a soma
+da receita corrigida: a original somava Order.total sobre q.subquery(), um
+produto cartesiano quadrático que sozinho leva minutos a partir da escala 5.
+Os clientes usam o mesmo escopo (canal/loja/CNPJ) da versão nova, então as
+duas devolvem os mesmos KPIs (conferido a cada caso e em tests/test_kpis.py).
+"""
+import argparse, json, os, statistics, subprocess, sys, tempfile, time
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+
+FILTERS = [
+    ("24h", None, None),
+    ("7d", None, None),
+    ("30d", None, None),
+    ("7d", "iFood", "SP"),
+]
+
+def legacy_kpis(app_mod, f):
+    """compute_kpis_from_query original: 4 idas ao banco + sets em Python (ver docstring)."""
+    Order, func = app_mod.Order, app_mod.func
+    session = app_mod.tenant_session(f)
+    q = app_mod.orders_query(f)
+    pedidos = q.count()
+    total_receita = q.with_entities(func.coalesce(func.sum(Order.total), 0.0)).scalar()
+    now = datetime.now(timezone.utc)
+    d30 = now - timedelta(days=30)
+    d7  = now - timedelta(days=7)
+    cli_30 = set(e[0] for e in app_mod.apply_order_filters(
+        session.query(Order.customer_email).filter(Order.ordered_at >= d30), f)
+        .group_by(Order.customer_email).all())
+    cli_7  = set(e[0] for e in app_mod.apply_order_filters(
+        session.query(Order.customer_email).filter(Order.ordered_at >= d7), f)
+        .group_by(Order.customer_email).all())
+    return {
+        "conversoes": int(pedidos * 0.4),
+        "ticketMedio": round((total_receita / pedidos), 2) if pedidos else 0.0,
+        "pedidos": pedidos,
+        "churn": round((len(cli_30 - cli_7) / len(cli_30)), 3) if cli_30 else 0.0,
+        "totalVendas": round(float(total_receita or 0.0), 2),
+        "clientesAtivos": len(cli_7),
+        "clientesInativos": len(cli_30 - cli_7),
+    }
+
+def timeit(fn, reps):
+    fn()  # aquece cache de páginas do SQLite
+    out = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+def worker(reps, legacy_reps):
+    sys.path.insert(0, BACKEND)
+    t0 = time.perf_counter()
+    import app as app_mod
+    seed_s = time.perf_counter() - t0
+
+    res = {"seed_s": round(seed_s, 2), "cases": []}
+    with app_mod.app.test_request_context():
+        res["orders"] = app_mod.Order.query.count()
+        for period, channel, location in FILTERS:
+            f = app_mod.resolve_filters(period, channel, location)
+            old = timeit(lambda: legacy_kpis(app_mod, f), legacy_reps)
+            new = timeit(lambda: app_mod.compute_kpis(f), reps)
+            assert app_mod.compute_kpis(f) == legacy_kpis(app_mod, f), (period, channel, location)
+            res["cases"].append({
+                "filters": [period, channel, location],
+                "old_ms": round(statistics.median(old), 2),
+                "new_ms": round(statistics.median(new), 2),
+            })
+    print(json.dumps(res))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scales", nargs="+", type=float, default=[0.5, 5])
+    ap.add_argument("--days", type=int, default=8)
+    ap.add_argument("--reps", type=int, default=10)
+    ap.add_argument("--legacy-reps", type=int, default=3, help="repetições da versão antiga")
+    ap.add_argument("--worker", action="store_true")
+    args = ap.parse_args()
+
+    if args.worker:
+        worker(args.reps, args.legacy_reps)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales:
+            env = dict(os.environ,
+                       DB_PATH=os.path.join(tmp, f"bench_{scale}.db"),
+                       SEED_SCALE=str(scale), SEED_DAYS=str(args.days))
+            out = subprocess.run([sys.executable, __file__, "--worker", "--reps", str(args.reps),
+                                  "--legacy-reps", str(args.legacy_reps)],
+                                 env=env, capture_output=True, text=True, check=True)
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"\nSEED_SCALE={scale}  pedidos={res['orders']}  seed={res['seed_s']}s")
+            print(f"  {'filtros':<28}{'antigo (ms)':>12}{'novo (ms)':>12}{'ganho':>8}")
+            for c in res["cases"]:
+                gain = c["old_ms"] / c["new_ms"] if c["new_ms"] else float("inf")
+                label = "/".join(x or "*" for x in c["filters"])
+                print(f"  {label:<28}{c['old_ms']:>12}{c['new_ms']:>12}{gain:>7.1f}x", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark: semeadura inicial (seedgen + write_order_batch) até N pedidos.
+
+Uso (a partir de src/Backend/backend):
+    python bench/bench_seed.py                       # 1 milhão de pedidos (~20 s)
+    python bench/bench_seed.py --orders 10000000     # alvo de 10M em menos de 1 minuto
+    python bench/bench_seed.py --orders 200000 2000000 --days 60
+
+Cada alvo roda num subprocesso com um banco temporário próprio (DB_PATH): o app
+sobe sem pedidos (SEED_DAYS=0) e o worker cronometra seed_business_data_if_empty
+com SEED_DAYS/SEED_SCALE calibrados para chegar perto de N pedidos (o gerador
+arredonda por hora, então o total real varia alguns por cento). O tempo de
+"gerar" é só o NumPy (generate_day em todos os dias, sem banco); "total" é a
+semeadura inteira, com a escrita, os rollups e a recriação dos índices.
+
+Medido numa sandbox de 1 vCPU, já com os rollups item_sales_daily e
+customer_activity mantidos na escrita: 1M de pedidos em ~17 s e 11,2M
+(+16,9M itens) em ~206 s, ~55-60 mil pedidos/s; gerar os 11,2M leva ~1,4 s.
+A escrita no SQLite (executemany linha a linha + rollups) é quase todo o custo:
+nessa máquina o alvo de 10M abaixo de 1 minuto NÃO é atingido.
+"""
+import argparse, json, os, subprocess, sys, tempfile, time
+from datetime import datetime, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(HERE)
+sys.path.insert(0, BACKEND)
+import seedgen  # noqa: E402
+
+CNPJS = ["12345678000190", "11111111000191", "22222222000192"]
+MENU = [(1, 16.0), (2, 18.0), (3, 22.0), (4, 19.0), (5, 8.0)]
+
+def orders_per_day(scale=1.0, days=7):
+    """Média de pedidos/dia do perfil "seed" na escala dada (sem banco)."""
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    n = sum(len(seedgen.generate_day(42, d, now, seedgen.PROFILES["seed"], scale,
+                                     [1, 2, 3, 4], [1, 2, 3, 4], MENU, CNPJS)["total"])
+            for d in range(days))
+    return n / days
+
+def worker(days, scale):
+    t0 = time.perf_counter()
+    import app as app_mod
+    boot_s = time.perf_counter() - t0
+
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    t0 = time.perf_counter()
+    for d in range(days):
+        seedgen.generate_day(42, d, now, seedgen.PROFILES["seed"], scale,
+                             [1, 2, 3, 4], [1, 2, 3, 4], MENU, CNPJS)
+    gen_s = time.perf_counter() - t0
+
+    os.environ.update(SEED_DAYS=str(days), SEED_SCALE=str(scale))
+    with app_mod.app.app_context():
+        t0 = time.perf_counter()
+        app_mod.seed_business_data_if_empty()
+        seed_s = time.perf_counter() - t0
+        s = app_mod.db.session
+        orders = s.execute(app_mod.text("SELECT count(*) FROM orders")).scalar()
+        items = s.execute(app_mod.text("SELECT count(*) FROM order_items")).scalar()
+    print(json.dumps({"orders": orders, "items": items, "boot_s": round(boot_s, 2),
+                      "gen_s": round(gen_s, 2), "seed_s": round(seed_s, 2)}))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--orders", nargs="+", type=int, default=[1_000_000])
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--worker", action="store_true")
+    ap.add_argument("--scale", type=float, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        worker(args.days, args.scale)
+        return
+
+    base = orders_per_day()
+    print(f"{'alvo':>12}{'pedidos':>12}{'itens':>12}{'gerar (s)':>11}{'total (s)':>11}"
+          f"{'pedidos/s':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for target in args.orders:
+            scale = target / (args.days * base)
+            scale *= target / (args.days * orders_per_day(scale))  # o floor pesa menos em escala alta
+            env = dict(os.environ, DB_PATH=os.path.join(tmp, f"seed_{target}.db"),
+                       SEED_DAYS="0", STORAGE_MODE="single")
+            out = subprocess.run([sys.executable, __file__, "--worker", "--days", str(args.days),
+                                  "--scale", repr(scale)],
+                                 env=env, capture_output=True, text=True, check=True)
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            rate = res["orders"] / res["seed_s"] if res["seed_s"] else float("inf")
+            print(f"{target:>12}{res['orders']:>12}{res['items']:>12}{res['gen_s']:>11}"
+                  f"{res['seed_s']:>11}{rate:>12,.0f}", flush=True)
+
+if __name__ == "__main__":
+    main()
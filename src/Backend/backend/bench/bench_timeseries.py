@@ -0,0 +1,116 @@
+"""Microbenchmark: montagem das séries (/metrics e /series/by-channel).
+
+Compara os laços antigos (strptime por rótulo; dicts aninhados re-percorridos
+por canal) com timeseries.fill_series / fill_matrix sobre linhas sintéticas no
+formato do rollup, com ~20% das horas sem pedidos.
+
+Uso (a partir de src/Backend/backend):
+    python bench/bench_timeseries.py
+    python bench/bench_timeseries.py --days 90 --channels 8 --reps 50
+"""
+import argparse, os, statistics, sys, time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import timeseries  # noqa: E402
+
+def synthetic_rows(days, channels, seed=7):
+    rng = np.random.default_rng(seed)
+    start = datetime(2025, 1, 1)
+    rows = []
+    for h in range(days * 24):
+        if rng.random() < 0.2:
+            continue  # hora sem pedidos
+        bucket = (start + timedelta(hours=h)).strftime("%Y-%m-%d %H:00")
+        for cid in range(1, channels + 1):
+            rows.append((bucket, cid, int(rng.integers(1, 40))))
+    end = (start + timedelta(hours=days * 24 - 1)).strftime("%Y-%m-%d %H:00")
+    return rows, start.strftime("%Y-%m-%d %H:00"), end
+
+# --- versões antigas (copiadas dos endpoints) ---
+def legacy_metrics(rows, period):
+    totals = {}
+    for h, _, c in rows:
+        totals[h] = totals.get(h, 0) + c
+    serie = []
+    for h_str, c in sorted(totals.items()):
+        label = h_str
+        for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d %H:00"):
+            try:
+                dt = datetime.strptime(h_str, fmt)
+                label = dt.strftime("%H") if period == "24h" else dt.strftime("%d/%m")
+                break
+            except Exception:
+                pass
+        serie.append({"hora": label, "pedidos": int(c)})
+    return serie
+
+def legacy_series(rows, channels):
+    data = {}
+    for h, cid, cnt in rows:
+        data.setdefault(h, {})[f"c{cid}"] = int(cnt)
+    labels = sorted(data.keys())
+    series = {ch: [data.get(h, {}).get(ch, 0) for h in labels] for ch in channels}
+    return labels, series
+
+# --- versões novas ---
+def new_metrics(rows, start, end, period):
+    totals = {}
+    for h, _, c in rows:  # no app o GROUP BY bucket já vem do SQL
+        totals[h] = totals.get(h, 0) + c
+    buckets, counts = zip(*totals.items())
+    axis, counts = timeseries.fill_series(buckets, counts, start, end)
+    style = "hour" if period == "24h" else "day"
+    return [{"hora": h, "pedidos": int(c)}
+            for h, c in zip(timeseries.labels(axis, style), counts.tolist())]
+
+def new_series(rows, channels, start, end):
+    buckets, cids, counts = zip(*rows)
+    axis, m = timeseries.fill_matrix(buckets, cids, counts, list(range(1, len(channels) + 1)),
+                                     start, end)
+    m = m.astype(np.int64)
+    return timeseries.labels(axis, "bucket"), {ch: m[i].tolist() for i, ch in enumerate(channels)}
+
+def timeit(fn, reps):
+    fn()
+    out = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(out)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--channels", type=int, default=4)
+    ap.add_argument("--reps", type=int, default=30)
+    args = ap.parse_args()
+
+    rows, start, end = synthetic_rows(args.days, args.channels)
+    channels = [f"c{i}" for i in range(1, args.channels + 1)]
+
+    # mesmas contagens nos baldes com dado; o resto do eixo é zero
+    labels, series = new_series(rows, channels, start, end)
+    old_labels, old_series = legacy_series(rows, channels)
+    pos = {l: i for i, l in enumerate(labels)}
+    assert len(labels) == args.days * 24
+    assert all(series[ch][pos[l]] == old_series[ch][i]
+               for ch in channels for i, l in enumerate(old_labels))
+
+    cases = [
+        ("/metrics (30d)", lambda: legacy_metrics(rows, "30d"),
+         lambda: new_metrics(rows, start, end, "30d")),
+        ("/series/by-channel", lambda: legacy_series(rows, channels),
+         lambda: new_series(rows, channels, start, end)),
+    ]
+    print(f"linhas={len(rows)}  baldes={args.days * 24}  canais={args.channels}")
+    print(f"  {'caso':<22}{'antigo (ms)':>12}{'novo (ms)':>12}{'ganho':>8}")
+    for name, old, new in cases:
+        o, n = timeit(old, args.reps), timeit(new, args.reps)
+        print(f"  {name:<22}{o:>12.2f}{n:>12.2f}{o / n:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Cache em memória (LRU + TTL) para respostas dos endpoints de leitura.
+
+Cada entrada guarda a versão dos dados com que foi calculada; quando algum
+caminho de escrita incrementa a versão, as entradas antigas viram "stale" e
+são descartadas no próximo acesso.
+"""
+import threading, time
+from collections import OrderedDict
+
+
+class DataVersion:
+    """Contador monotônico incrementado a cada escrita confirmada de pedidos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def bump(self) -> int:
+        with self._lock:
+            self._value += 1
+            return self._value
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 256, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expira_em, versao, valor)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = self.stale = 0
+
+    def get(self, key, version):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, entry_version, value = entry
+            if entry_version != version:
+                del self._data[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            if expires_at <= now:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, version, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "stale": self.stale,
+            }
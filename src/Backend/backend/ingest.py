@@ -0,0 +1,173 @@
+"""Ingestão de pedidos em lote (POST /orders/batch): leitura, validação e lote colunar.
+
+Corpo em NDJSON (um pedido por linha) ou array JSON (também aceito como
+{"orders": [...]}). Cada pedido:
+
+    {"customer_email": "a@b.com",
+     "channel": "iFood"            | "channel_id": 2,
+     "location": "SP"              | "location_id": 1,
+     "ordered_at": "2025-10-18T12:30:00-03:00",   # sem fuso = UTC
+     "items": [{"item": "Cannoli"  | "item_id": 3, "qty": 2, "unit_price": 12.5}],
+     "total": 25.0,                # opcional: soma dos itens
+     "cnpj": "..."}                # só admin; cliente grava sempre no próprio CNPJ
+
+`unit_price` ausente usa o preço do cardápio. Um pedido inválido não derruba o
+lote: vira {"row": <posição no corpo>, "error": "..."} e os demais seguem.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from seedgen import db_timestamp
+from serialization import orjson
+
+NDJSON_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl",
+                "application/x-jsonlines"}
+MAX_ITEMS_PER_ORDER = 100
+MAX_QTY = 999
+CLOCK_SKEW = timedelta(minutes=5)  # tolerância para relógios de PDV adiantados
+
+loads = orjson.loads if orjson is not None else json.loads
+
+
+class RowError(ValueError):
+    """Pedido inválido (só a linha é rejeitada)."""
+
+
+def parse_body(raw, mimetype):
+    """([(posição, objeto)], [erro por linha]); ValueError se o corpo todo é ilegível."""
+    if mimetype in NDJSON_TYPES:
+        rows, errors = [], []
+        for i, line in enumerate(l for l in raw.splitlines() if l.strip()):
+            try:
+                rows.append((i, loads(line)))
+            except ValueError:
+                errors.append({"row": i, "error": "JSON inválido"})
+        return rows, errors
+    try:
+        data = loads(raw)
+    except ValueError:
+        raise ValueError("corpo não é JSON válido")
+    if isinstance(data, dict):
+        data = data.get("orders")
+    if not isinstance(data, list):
+        raise ValueError("esperado um array de pedidos (ou NDJSON)")
+    return list(enumerate(data)), []
+
+
+def _number(value, field):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        raise RowError(f"{field} deve ser numérico")
+    if value < 0:
+        raise RowError(f"{field} não pode ser negativo")
+    return float(value)
+
+
+def _lookup(obj, field, by_name, by_id, label):
+    """Id de uma dimensão, pelo nome (`field`) ou pelo id (`field`_id)."""
+    name, key = obj.get(field), obj.get(field + "_id")
+    if name is not None:
+        found = by_name.get(name) if isinstance(name, str) else None
+        if found is None:
+            raise RowError(f"{label} desconhecido: {name}")
+        return found
+    if key is not None:
+        if isinstance(key, bool) or not isinstance(key, int) or key not in by_id:
+            raise RowError(f"{label} desconhecido: id {key}")
+        return key
+    raise RowError(f"{field} obrigatório")
+
+
+def _timestamp(value, now):
+    if not isinstance(value, str):
+        raise RowError("ordered_at obrigatório (ISO 8601)")
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        raise RowError(f"ordered_at inválido: {value}")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    if dt > now + CLOCK_SKEW:
+        raise RowError("ordered_at no futuro")
+    return db_timestamp(dt)
+
+
+def validate_order(obj, snap, cnpj=None, allowed_cnpjs=None, now=None):
+    """Pedido validado como tupla (email, canal, loja, ts, cnpj, total, [(item, qtd, preço)]).
+
+    `snap` é o snapshot de DimensionRegistry. `cnpj` fixa o dono (cliente);
+    senão o pedido pode trazer "cnpj", que precisa estar em `allowed_cnpjs`.
+    """
+    if not isinstance(obj, dict):
+        raise RowError("pedido deve ser um objeto")
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+
+    email = obj.get("customer_email")
+    if not isinstance(email, str) or "@" not in email or len(email.strip()) > 160:
+        raise RowError("customer_email inválido")
+    email = email.strip().lower()
+
+    channel_id = _lookup(obj, "channel", snap["channel_ids"], snap["channel_names"], "canal")
+    location_id = _lookup(obj, "location", snap["location_ids"], snap["location_names"], "loja")
+    ts = _timestamp(obj.get("ordered_at"), now)
+
+    owner = obj.get("cnpj") or None
+    if cnpj is not None:
+        if owner is not None and owner != cnpj:
+            raise RowError("cnpj diferente do CNPJ do token")
+        owner = cnpj
+    elif owner is not None and (allowed_cnpjs is None or owner not in allowed_cnpjs):
+        raise RowError(f"cnpj não aprovado: {owner}")
+
+    items = obj.get("items")
+    if not isinstance(items, list) or not items:
+        raise RowError("items obrigatório (lista não vazia)")
+    if len(items) > MAX_ITEMS_PER_ORDER:
+        raise RowError(f"no máximo {MAX_ITEMS_PER_ORDER} itens por pedido")
+    lines = []
+    for it in items:
+        if not isinstance(it, dict):
+            raise RowError("item deve ser um objeto")
+        entry = snap["items_by_id"][_lookup(it, "item", snap["item_ids"], snap["items_by_id"], "item")]
+        qty = it.get("qty", 1)
+        if isinstance(qty, bool) or not isinstance(qty, int) or not 1 <= qty <= MAX_QTY:
+            raise RowError(f"qty inválida para {entry.name}")
+        price = entry.price if it.get("unit_price") is None else _number(it["unit_price"], "unit_price")
+        lines.append((entry.id, qty, price))
+
+    if obj.get("total") is None:
+        total = round(sum(q * p for _, q, p in lines), 2)
+    else:
+        total = _number(obj["total"], "total")
+    return (email, channel_id, location_id, ts, owner, total, lines)
+
+
+def _encode(values):
+    """Codificação em dicionário (valores únicos ordenados + códigos)."""
+    uniq, code = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+    return uniq.tolist(), code.astype(np.int64)
+
+
+def to_batch(orders):
+    """Pedidos validados -> lote colunar no formato de seedgen (ver write_order_batch)."""
+    email_values, email_code = _encode([o[0] for o in orders])
+    ts_values, ts_code = _encode([o[3] for o in orders])  # texto ISO: ordem = cronológica
+    cnpj_values, cnpj_code = _encode([o[4] or "" for o in orders])
+    item_order = [i for i, o in enumerate(orders) for _ in o[6]]
+    lines = [line for o in orders for line in o[6]]
+    return {
+        "email_code": email_code,
+        "email_values": email_values,
+        "cnpj_code": cnpj_code,
+        "cnpj_values": [v or None for v in cnpj_values],
+        "ts_code": ts_code,
+        "ts_values": ts_values,
+        "channel_id": np.array([o[1] for o in orders], dtype=np.int64),
+        "location_id": np.array([o[2] for o in orders], dtype=np.int64),
+        "total": np.array([o[5] for o in orders], dtype=np.float64),
+        "item_order": np.array(item_order, dtype=np.int64),
+        "item_id": np.array([l[0] for l in lines], dtype=np.int64),
+        "qty": np.array([l[1] for l in lines], dtype=np.int64),
+        "unit_price": np.array([l[2] for l in lines], dtype=np.float64),
+    }
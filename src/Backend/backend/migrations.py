@@ -0,0 +1,130 @@
+"""Migrações versionadas do schema (SQLite).
+
+Cada migração tem um número de versão crescente e é aplicada uma única vez;
+as versões aplicadas ficam registradas em `schema_migrations`. Os passos são
+idempotentes (IF NOT EXISTS / checagem via PRAGMA), porque num banco novo o
+`db.create_all()` já cria tabelas e índices declarados nos models.
+
+Migrações que criam índices trazem `checks`: consultas no formato usado pelos
+endpoints, cujo EXPLAIN QUERY PLAN precisa mencionar o índice esperado.
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+
+Migration = namedtuple("Migration", "version name apply checks")
+
+# (sql, parâmetros, trecho esperado no EXPLAIN QUERY PLAN)
+PlanCheck = namedtuple("PlanCheck", "sql params expect")
+
+MIGRATIONS = []
+
+def migration(version, name, checks=()):
+    def deco(fn):
+        MIGRATIONS.append(Migration(version, name, fn, tuple(checks)))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return deco
+
+# ---------------------------------------------------------------------
+# Migrações
+# ---------------------------------------------------------------------
+@migration(1, "orders.owner_cnpj")
+def _orders_owner_cnpj(conn):
+    cols = {r[1] for r in conn.exec_driver_sql("PRAGMA table_info(orders);")}
+    if "owner_cnpj" not in cols:
+        conn.exec_driver_sql("ALTER TABLE orders ADD COLUMN owner_cnpj VARCHAR(20);")
+
+_TS = "2000-01-01 00:00:00.000000"
+
+@migration(2, "orders: índices compostos de cobertura", checks=[
+    # KPIs com escopo de CNPJ (+ canal/loja)
+    PlanCheck("SELECT count(*), sum(total), count(DISTINCT customer_email) FROM orders "
+              "WHERE owner_cnpj = ? AND ordered_at >= ? AND channel_id = ? AND location_id = ?",
+              ("00000000000000", _TS, 1, 1), "COVERING INDEX ix_orders_cnpj_time_cover"),
+    # KPIs/sugestões sem escopo
+    PlanCheck("SELECT count(*), sum(total), count(DISTINCT customer_email) FROM orders "
+              "WHERE ordered_at >= ? AND channel_id = ?",
+              (_TS, 1), "COVERING INDEX ix_orders_time_cover"),
+    PlanCheck("SELECT channel_id, count(id) FROM orders WHERE ordered_at >= ? GROUP BY channel_id",
+              (_TS,), "COVERING INDEX ix_orders_time_cover"),
+])
+def _orders_cover_indexes(conn):
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_orders_cnpj_time_cover ON orders "
+        "(owner_cnpj, ordered_at, channel_id, location_id, total, customer_email);")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_orders_time_cover ON orders "
+        "(ordered_at, channel_id, location_id, owner_cnpj, total, customer_email);")
+    # prefixo de ix_orders_cnpj_time_cover: só custava escrita
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_orders_owner_cnpj;")
+
+@migration(3, "order_items(item_id, order_id)", checks=[
+    PlanCheck("SELECT order_id FROM order_items WHERE item_id = ?",
+              (1,), "COVERING INDEX ix_order_items_item_order"),
+])
+def _order_items_item_order(conn):
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_order_items_item_order ON order_items (item_id, order_id);")
+
+@migration(4, "item_sales_daily(owner_cnpj, day)", checks=[
+    # top itens com escopo de CNPJ (dias inteiros do período)
+    PlanCheck("SELECT item_id, sum(qty), sum(revenue) FROM item_sales_daily "
+              "WHERE day >= ? AND owner_cnpj = ? GROUP BY item_id",
+              ("2000-01-01", "00000000000000"), "INDEX ix_item_sales_daily_cnpj_day"),
+])
+def _item_sales_daily_cnpj_day(conn):
+    # a tabela vem do create_all(); o preenchimento é do ensure_rollups_built()
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_item_sales_daily_cnpj_day ON item_sales_daily "
+        "(owner_cnpj, day);")
+
+# ---------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------
+def _ensure_table(conn):
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version INTEGER PRIMARY KEY,"
+        " name VARCHAR(120) NOT NULL,"
+        " applied_at VARCHAR(32) NOT NULL);")
+
+def applied_versions(conn):
+    _ensure_table(conn)
+    return {v for (v,) in conn.exec_driver_sql("SELECT version FROM schema_migrations;")}
+
+def current_version(conn) -> int:
+    return max(applied_versions(conn), default=0)
+
+def explain(conn, check):
+    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + check.sql, check.params).all()
+    return [r[-1] for r in rows]
+
+def check_plans(conn, migrations=None):
+    """[(migração, check, ok, plano)] para as migrações dadas (padrão: todas)."""
+    out = []
+    for m in (MIGRATIONS if migrations is None else migrations):
+        for c in m.checks:
+            plan = explain(conn, c)
+            out.append((m, c, any(c.expect in step for step in plan), plan))
+    return out
+
+def run_migrations(engine, log=print):
+    """Aplica as migrações pendentes, cada uma na sua transação. Devolve as versões aplicadas."""
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+
+    applied = []
+    for m in MIGRATIONS:
+        if m.version in done:
+            continue
+        with engine.begin() as conn:
+            m.apply(conn)
+            conn.exec_driver_sql(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?);",
+                (m.version, m.name, datetime.now(timezone.utc).isoformat(timespec="seconds")))
+            for _, c, ok, plan in check_plans(conn, [m]):
+                if not ok:
+                    log(f"[migrate] aviso: v{m.version} esperava '{c.expect}', plano: {plan}")
+        log(f"[migrate] v{m.version} aplicada: {m.name}")
+        applied.append(m.version)
+    return applied
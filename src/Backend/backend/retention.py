@@ -0,0 +1,164 @@
+"""Retenção de pedidos antigos: arquivo compactado, remoção em lotes e VACUUM incremental.
+
+Os rollups (orders_hourly, item_sales_daily, customer_activity) já contêm todos
+os pedidos, porque são mantidos a cada escrita, e os painéis só leem pedidos
+brutos dos últimos 30 dias. Passado o horizonte, cada lote de pedidos anteriores
+a `cutoff`:
+
+1. vai para um arquivo NDJSON gzip (um pedido por linha, com os itens, nos
+   campos de POST /orders/batch), gravado em disco antes do commit;
+2. soma os totais por cliente em archived_customers, de onde o rebuild de
+   customer_activity parte (ver app.py);
+3. sai de orders/order_items numa transação curta (BEGIN IMMEDIATE), para
+   que os escritores só esperem um lote.
+
+No fim, PRAGMA incremental_vacuum devolve as páginas livres ao sistema (o banco
+precisa de auto_vacuum=INCREMENTAL; `convert=True` converte com um VACUUM
+completo). Funciona sobre uma conexão sqlite3 (DB-API) e não depende do app.
+"""
+import gzip, json, os, sqlite3
+
+INCREMENTAL = 2  # PRAGMA auto_vacuum
+
+# pedidos do próximo lote: os mais antigos primeiro (índice em ordered_at)
+BATCH_IDS = "SELECT id FROM orders WHERE ordered_at < ? ORDER BY ordered_at, id LIMIT ?"
+
+ARCHIVED_CUSTOMERS_UPSERT = f"""
+    INSERT INTO archived_customers (owner_cnpj, customer_email, first_order_at, last_order_at,
+                                    order_count, total_spent)
+    SELECT COALESCE(owner_cnpj, ''), customer_email, MIN(ordered_at), MAX(ordered_at),
+           COUNT(*), COALESCE(SUM(total), 0.0)
+    FROM orders WHERE id IN ({BATCH_IDS})
+    GROUP BY 1, 2
+    ON CONFLICT (owner_cnpj, customer_email) DO UPDATE SET
+        first_order_at = MIN(first_order_at, excluded.first_order_at),
+        last_order_at = MAX(last_order_at, excluded.last_order_at),
+        order_count = order_count + excluded.order_count,
+        total_spent = total_spent + excluded.total_spent
+"""
+
+
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def space(conn) -> dict:
+    """Bytes do arquivo, das páginas livres e de cada tabela/índice de pedidos.
+
+    O detalhe por tabela/índice vem da tabela virtual dbstat, quando o SQLite
+    foi compilado com ela.
+    """
+    page = _pragma(conn, "page_size")
+    out = {"arquivo": _pragma(conn, "page_count") * page,
+           "livre": _pragma(conn, "freelist_count") * page}
+    try:
+        rows = conn.execute(
+            "SELECT m.type, s.name, SUM(s.pgsize) FROM dbstat s "
+            "JOIN sqlite_master m ON m.name = s.name "
+            "WHERE m.tbl_name IN ('orders', 'order_items') GROUP BY s.name").fetchall()
+    except sqlite3.OperationalError:
+        return out
+    out["tabelas"] = {name: size for kind, name, size in rows if kind == "table"}
+    out["indices"] = {name: size for kind, name, size in rows if kind == "index"}
+    return out
+
+
+def shrink(before, after) -> dict:
+    """Quanto cada medida de `space` diminuiu (bytes)."""
+    out = {k: before[k] - after[k] for k in ("arquivo", "livre")}
+    for group in ("tabelas", "indices"):
+        if group in before and group in after:
+            out[group] = {k: v - after[group].get(k, 0) for k, v in before[group].items()}
+    return out
+
+
+def pending(conn, cutoff) -> int:
+    return conn.execute("SELECT count(*) FROM orders WHERE ordered_at < ?", (cutoff,)).fetchone()[0]
+
+
+def archive_batch(conn, cutoff, limit, gz, raw):
+    """Arquiva e remove até `limit` pedidos anteriores a `cutoff`. Devolve (pedidos, itens).
+
+    `gz` escreve em `raw` (arquivo aberto); o lote vai para o disco (fsync) antes
+    do commit, então um pedido removido sempre está no arquivo. Se o processo
+    cair entre os dois, o lote continua no banco e sai de novo na próxima rodada.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        params = (cutoff, limit)
+        orders = conn.execute(
+            "SELECT id, customer_email, channel_id, location_id, ordered_at, total, owner_cnpj "
+            f"FROM orders WHERE id IN ({BATCH_IDS}) ORDER BY ordered_at, id", params).fetchall()
+        if not orders:
+            conn.rollback()
+            return 0, 0
+        items = {}
+        for oid, item_id, qty, price in conn.execute(
+                f"SELECT order_id, item_id, qty, unit_price FROM order_items "
+                f"WHERE order_id IN ({BATCH_IDS}) ORDER BY order_id, id", params):
+            items.setdefault(oid, []).append({"item_id": item_id, "qty": qty, "unit_price": price})
+
+        for oid, email, ch, loc, ts, total, cnpj in orders:
+            gz.write(json.dumps({
+                "id": oid, "customer_email": email, "channel_id": ch, "location_id": loc,
+                "ordered_at": ts, "total": total, "cnpj": cnpj, "items": items.get(oid, []),
+            }, ensure_ascii=False).encode("utf-8") + b"\n")
+        gz.flush()
+        raw.flush()
+        os.fsync(raw.fileno())
+
+        conn.execute(ARCHIVED_CUSTOMERS_UPSERT, params)
+        n_items = conn.execute(f"DELETE FROM order_items WHERE order_id IN ({BATCH_IDS})",
+                               params).rowcount
+        conn.execute(f"DELETE FROM orders WHERE id IN ({BATCH_IDS})", params)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return len(orders), n_items
+
+
+def incremental_vacuum(conn, pages=2048) -> int:
+    """Devolve as páginas livres em fatias de `pages`; devolve quantas saíram do arquivo."""
+    if _pragma(conn, "auto_vacuum") != INCREMENTAL:
+        return 0
+    freed = 0
+    while True:
+        free = _pragma(conn, "freelist_count")
+        if not free:
+            return freed
+        # executescript executa o PRAGMA até o fim (execute() libera só uma página)
+        conn.executescript(f"PRAGMA incremental_vacuum({pages});")
+        freed += free - _pragma(conn, "freelist_count")
+
+
+def run(conn, cutoff, archive_path, batch=5000, convert=False, dry_run=False, log=print):
+    """Aplica a retenção em `conn` e devolve o relatório (pedidos, itens, espaço antes/depois)."""
+    report = {"cutoff": cutoff, "pendentes": pending(conn, cutoff), "antes": space(conn)}
+    if dry_run or not report["pendentes"]:
+        return report
+
+    n_orders = n_items = 0
+    with open(archive_path, "ab") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+        while True:
+            n, m = archive_batch(conn, cutoff, batch, gz, raw)
+            if not n:
+                break
+            n_orders += n
+            n_items += m
+            log(f"[retention] {n_orders}/{report['pendentes']} pedidos arquivados")
+
+    mode = _pragma(conn, "auto_vacuum")
+    if mode != INCREMENTAL and convert:
+        log("[retention] convertendo para auto_vacuum=INCREMENTAL (VACUUM completo, uma vez)")
+        conn.executescript("PRAGMA auto_vacuum=INCREMENTAL; VACUUM;")
+    elif mode != INCREMENTAL:
+        log("[retention] auto_vacuum desligado: as páginas livres ficam para reuso "
+            "(converta uma vez com `flask retention --convert`)")
+    pages = incremental_vacuum(conn)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+    report.update(pedidos=n_orders, itens=n_items, arquivo=str(archive_path),
+                  paginas_liberadas=pages, depois=space(conn))
+    report["reducao"] = shrink(report["antes"], report["depois"])
+    return report
@@ -0,0 +1,52 @@
+"""Pontuação RFM (recência, frequência, valor) vetorizada com NumPy.
+
+Entrada: um array por métrica, uma posição por cliente (saída do GROUP BY em
+app.py). Cada métrica é normalizada min-max em [0, 1]; a recência é invertida
+(compra mais recente = 1). O score é a média ponderada das três.
+"""
+import math
+
+import numpy as np
+
+DEFAULT_WEIGHTS = (0.4, 0.4, 0.2)  # (F, M, R)
+
+def _minmax(x):
+    if not x.size:
+        return x
+    lo, hi = x.min(), x.max()
+    return (x - lo) / ((hi - lo) or 1)
+
+def normalize_weights(weights):
+    """Pesos (F, M, R) finitos e não negativos, reescalados para somar 1."""
+    w = np.asarray(weights, dtype=np.float64)
+    if (w.shape != (3,) or not all(map(math.isfinite, w.tolist())) or (w < 0).any()
+            or not 0 < w.sum() < math.inf):
+        raise ValueError("pesos devem ser 3 números finitos e não negativos, com soma > 0")
+    return w / w.sum()
+
+def scores(frequency, monetary, recency_days, weights=DEFAULT_WEIGHTS):
+    f = _minmax(np.asarray(frequency, dtype=np.float64))
+    m = _minmax(np.asarray(monetary, dtype=np.float64))
+    r = 1 - _minmax(np.asarray(recency_days, dtype=np.float64))
+    wf, wm, wr = normalize_weights(weights)
+    return wf*f + wm*m + wr*r
+
+def top_k(score, k, tiebreak=None):
+    """Índices dos k maiores scores, em ordem decrescente, sem ordenar o array todo.
+
+    `argpartition` separa os candidatos; só eles são ordenados (score desc e,
+    em empate, `tiebreak` asc — ex.: e-mails — para a ordem ser estável).
+    """
+    n = score.size
+    if k <= 0 or not n:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        kth = score[np.argpartition(-score, k - 1)[k - 1]]
+        cand = np.flatnonzero(score >= kth)  # inclui empates na fronteira
+    else:
+        cand = np.arange(n)
+    if tiebreak is None:
+        order = np.argsort(-score[cand], kind="stable")
+    else:
+        order = np.lexsort((tiebreak[cand], -score[cand]))
+    return cand[order][:k]
@@ -0,0 +1,140 @@
+"""Gerador vetorizado de pedidos sintéticos (NumPy).
+
+Produz lotes colunares (um por dia) com o mesmo formato do seed original:
+volume por hora (almoço/jantar), multiplicador por canal e por loja, clientes
+`clienteN@mail.com`, 1..k itens por pedido. Cada dia usa um gerador derivado
+de (seed, índice do dia), então a saída é determinística para um mesmo seed,
+independente do tamanho do chunk de escrita.
+
+Formato do lote (dict), com strings codificadas em dicionário (código + valores):
+    email_code/email_values, cnpj_code/cnpj_values, ts_code/ts_values,
+    channel_id, location_id, total                       -> um por pedido
+    item_order, item_id, qty, unit_price                 -> um por item
+`ts_values` vem em ordem crescente, no formato de DateTime do SQLAlchemy/SQLite.
+"""
+from datetime import timedelta
+import numpy as np
+
+CHANNELS  = ["Delivery Próprio", "iFood", "Balcão", "WhatsApp"]
+LOCATIONS = ["SP", "RJ", "BH", "POA"]
+
+PROFILES = {
+    # seed inicial (seed_business_data_if_empty)
+    "seed": {
+        "hour_base": (2, 6, 8),  # demais horas, almoço 11-14h, jantar 18-22h
+        "channel_mult": (1.0, 1.4, 0.6, 0.9),
+        "channel_jitter": (2, 2, 1, 1),  # + randint(0, j) por hora e canal
+        "location_mult": (1.15, 1.0, 1.0, 1.0),
+        "customers": 120,
+        "items_per_order": (1, 2),
+        "qty": (1, 1),
+        "cnpj_weights": (5, 2, 2),
+    },
+    # /dev/seed-more: volume maior e mais clientes
+    "seed-more": {
+        "hour_base": (3, 9, 11),
+        "channel_mult": (1.0, 1.6, 0.7, 1.1),
+        "channel_jitter": (3, 3, 2, 2),
+        "location_mult": (1.25, 1.0, 1.0, 1.0),
+        "customers": 400,
+        "items_per_order": (1, 3),
+        "qty": (1, 2),
+        "cnpj_weights": None,  # uniforme
+    },
+}
+
+def _hour_base(profile):
+    other, lunch, dinner = profile["hour_base"]
+    base = np.full(24, other, dtype=np.float64)
+    base[11:15] = lunch
+    base[18:23] = dinner
+    return base
+
+def db_timestamp(dt) -> str:
+    """Mesmo texto que o tipo DateTime do SQLAlchemy grava no SQLite."""
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+def generate_day(seed, day_index, day_start, profile, scale, channel_ids, location_ids,
+                 menu, cnpjs):
+    """Pedidos de um dia (24 horas a partir de `day_start`) como lote colunar.
+
+    `channel_ids`/`location_ids` seguem a ordem de CHANNELS/LOCATIONS;
+    `menu` é uma sequência de (id, preço).
+    """
+    rng = np.random.default_rng([seed, day_index]) if seed is not None else np.random.default_rng()
+
+    base = _hour_base(profile)                                   # (24,)
+    mult = np.asarray(profile["channel_mult"])                   # (C,)
+    jitter = rng.integers(0, np.asarray(profile["channel_jitter"]) + 1, size=(24, len(mult)))
+    vol = np.floor((base[:, None] * mult[None, :] + jitter) * scale)            # (24, C)
+    loc_mult = np.asarray(profile["location_mult"])
+    counts = np.floor(vol[:, None, :] * loc_mult[None, :, None]).astype(np.int64)  # (24, L, C)
+    counts = np.maximum(counts, 0)
+
+    hours, locs, chans = np.indices(counts.shape)
+    n_cells = counts.ravel()
+    n = int(n_cells.sum())
+    ts_code = np.repeat(hours.ravel(), n_cells)
+    location_id = np.asarray(location_ids, dtype=np.int64)[np.repeat(locs.ravel(), n_cells)]
+    channel_id = np.asarray(channel_ids, dtype=np.int64)[np.repeat(chans.ravel(), n_cells)]
+
+    customers = profile["customers"]
+    email_code = rng.integers(0, customers, size=n)
+    weights = profile["cnpj_weights"]
+    if weights and len(weights) == len(cnpjs):
+        p = np.asarray(weights, dtype=np.float64) / sum(weights)
+        cnpj_code = rng.choice(len(cnpjs), size=n, p=p)
+    else:
+        cnpj_code = rng.integers(0, len(cnpjs), size=n)
+
+    lo, hi = profile["items_per_order"]
+    n_items = rng.integers(lo, hi + 1, size=n)
+    item_order = np.repeat(np.arange(n), n_items)
+    menu_ids = np.asarray([m[0] for m in menu], dtype=np.int64)
+    menu_prices = np.asarray([m[1] for m in menu], dtype=np.float64)
+    pick = rng.integers(0, len(menu), size=item_order.size)
+    qlo, qhi = profile["qty"]
+    qty = rng.integers(qlo, qhi + 1, size=item_order.size)
+    unit_price = menu_prices[pick]
+    total = np.round(np.bincount(item_order, weights=unit_price * qty, minlength=n), 2)
+
+    return {
+        "email_code": email_code,
+        "email_values": [f"cliente{i}@mail.com" for i in range(1, customers + 1)],
+        "cnpj_code": cnpj_code,
+        "cnpj_values": list(cnpjs),
+        "ts_code": ts_code,
+        "ts_values": [db_timestamp(day_start + timedelta(hours=h)) for h in range(24)],
+        "channel_id": channel_id,
+        "location_id": location_id,
+        "total": total,
+        "item_order": item_order,
+        "item_id": menu_ids[pick],
+        "qty": qty,
+        "unit_price": unit_price,
+    }
+
+def slice_batch(batch, start, stop):
+    """Sub-lote com os pedidos [start, stop) e seus itens (dicionários preservados)."""
+    i0, i1 = np.searchsorted(batch["item_order"], [start, stop])
+    out = dict(batch)
+    for k in ("email_code", "cnpj_code", "ts_code", "channel_id", "location_id", "total"):
+        out[k] = batch[k][start:stop]
+    for k in ("item_id", "qty", "unit_price"):
+        out[k] = batch[k][i0:i1]
+    out["item_order"] = batch["item_order"][i0:i1] - start
+    return out
+
+def select_batch(batch, rows):
+    """Sub-lote com os pedidos de índices `rows` (em ordem crescente) e seus itens."""
+    rows = np.asarray(rows, dtype=np.int64)
+    remap = np.full(len(batch["total"]), -1, dtype=np.int64)
+    remap[rows] = np.arange(rows.size)
+    keep = remap[batch["item_order"]] >= 0
+    out = dict(batch)
+    for k in ("email_code", "cnpj_code", "ts_code", "channel_id", "location_id", "total"):
+        out[k] = batch[k][rows]
+    for k in ("item_id", "qty", "unit_price"):
+        out[k] = batch[k][keep]
+    out["item_order"] = remap[batch["item_order"][keep]]
+    return out
@@ -0,0 +1,93 @@
+"""Serialização JSON rápida e compressão negociada das respostas.
+
+- `FastJSONProvider`: substitui o provider JSON do Flask (usado por `jsonify`).
+  Com `orjson` instalado serializa em C; sem ele cai no `json` da stdlib. A saída
+  segue as regras do provider padrão: chaves ordenadas, datas no formato HTTP,
+  indentação só em modo debug.
+- `init_app`: comprime (brotli, se instalado, ou gzip, conforme Accept-Encoding)
+  respostas JSON/CSV/texto acima de `min_bytes` e publica os tempos de
+  serialização e compressão no cabeçalho Server-Timing.
+
+    pip install orjson brotli   # ambos opcionais
+"""
+import gzip, time
+
+from flask import g, request
+from flask.json.provider import DefaultJSONProvider
+
+try:  # opcional
+    import orjson
+except ImportError:
+    orjson = None
+
+try:  # opcional
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {"application/json", "text/csv", "text/plain", "text/html"}
+
+
+def add_timing(name, seconds, desc=None):
+    """Acumula uma medida (segundos) da requisição atual para o Server-Timing."""
+    timings = g.setdefault("server_timing", {})
+    timings[name] = timings.get(name, 0.0) + seconds
+    if desc is not None:
+        g.setdefault("server_timing_desc", {})[name] = desc
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        t0 = time.perf_counter()
+        if orjson is not None:
+            option = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+                      | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME)
+            if pretty:
+                option |= orjson.OPT_INDENT_2
+            body = orjson.dumps(obj, default=self.default, option=option) + b"\n"
+        else:
+            dump_args = {"indent": 2} if pretty else {"separators": (",", ":")}
+            body = f"{self.dumps(obj, **dump_args)}\n"
+        add_timing("json", time.perf_counter() - t0)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def negotiate_encoding():
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return request.accept_encodings.best_match(offered)
+
+
+def init_app(app, min_bytes=1024, gzip_level=6, brotli_quality=5):
+    app.json = FastJSONProvider(app)
+
+    @app.after_request
+    def _compress_and_time(resp):
+        if (resp.status_code == 200 and not resp.direct_passthrough and not resp.is_streamed
+                and "Content-Encoding" not in resp.headers
+                and resp.mimetype in COMPRESSIBLE):
+            encoding = negotiate_encoding()
+            if encoding and resp.content_length is not None and resp.content_length >= min_bytes:
+                t0 = time.perf_counter()
+                data = resp.get_data()
+                if encoding == "br":
+                    data = brotli.compress(data, quality=brotli_quality)
+                else:
+                    data = gzip.compress(data, compresslevel=gzip_level, mtime=0)
+                add_timing("compress", time.perf_counter() - t0)
+                resp.set_data(data)
+                resp.headers["Content-Encoding"] = encoding
+                # mesmo conteúdo, outra codificação: o ETag vira fraco
+                etag, weak = resp.get_etag()
+                if etag and not weak:
+                    resp.set_etag(etag, weak=True)
+            resp.vary.add("Accept-Encoding")
+
+        timings = g.get("server_timing")
+        if timings:
+            desc = g.get("server_timing_desc", {})
+            resp.headers["Server-Timing"] = ", ".join(
+                f"{name};dur={seconds * 1000:.2f}" + (f';desc="{desc[name]}"' if name in desc else "")
+                for name, seconds in timings.items())
+        return resp
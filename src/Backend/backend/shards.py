@@ -0,0 +1,120 @@
+"""Armazenamento particionado por CNPJ dono (STORAGE_MODE=sharded).
+
+Cada CNPJ tem o próprio arquivo SQLite em `directory` (<cnpj>.db; pedidos sem
+dono vão para _.db) com as tabelas de pedidos e os rollups delas. Um tenant
+grande só trava e só varre o arquivo dele: as escritas de tenants diferentes
+não disputam a mesma trava do SQLite e o cache de páginas de um não expulsa o
+do outro. O banco principal continua com usuários, dimensões, EWMA e alertas.
+
+Consultas sem escopo (admin) rodam uma vez por shard, em paralelo, num pool de
+threads (`fan_out`); quem chama junta os agregados parciais (ver app.py).
+"""
+import re, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+UNOWNED = "_"        # shard dos pedidos sem CNPJ dono
+_EMPTY = "_vazio"    # banco vazio (só schema) para leituras de um CNPJ sem shard
+_KEY = re.compile(r"^\d{1,20}$")
+
+
+class ShardRouter:
+    def __init__(self, directory, tables, configure=None, on_create=None, workers=4):
+        """`tables`: tabelas (SQLAlchemy) de cada shard; `configure(dbapi_conn, read_only)`
+        aplica os PRAGMAs; `on_create(engine)` roda ao abrir o shard para escrita
+        (ex.: migrações)."""
+        self.directory = Path(directory)
+        self.tables = list(tables)
+        self.configure = configure
+        self.on_create = on_create
+        self._lock = threading.Lock()
+        self._engines = {}   # (chave, somente leitura) -> engine
+        self._sessions = {}  # (chave, somente leitura) -> scoped_session
+        self._pool = (ThreadPoolExecutor(workers, thread_name_prefix="shard")
+                      if workers > 0 else None)
+
+    @staticmethod
+    def key(cnpj):
+        return cnpj or UNOWNED
+
+    @staticmethod
+    def valid(key) -> bool:
+        return key == UNOWNED or bool(_KEY.match(key or ""))
+
+    def path(self, key) -> Path:
+        return self.directory / f"{key}.db"
+
+    def keys(self):
+        """Shards existentes (arquivos no diretório, visíveis a todos os processos)."""
+        return sorted(p.stem for p in self.directory.glob("*.db") if self.valid(p.stem))
+
+    def _engine(self, key, read_only):
+        with self._lock:
+            engine = self._engines.get((key, read_only))
+            if engine is not None:
+                return engine
+        if read_only:
+            self._engine(key, False)  # garante arquivo, schema e migrações antes
+            uri = self.path(key).resolve().as_uri() + "?mode=ro"
+            engine = create_engine(f"sqlite:///{self.path(key)}", creator=lambda: sqlite3.connect(
+                uri, uri=True, check_same_thread=False))
+        else:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            engine = create_engine(f"sqlite:///{self.path(key)}")
+        if self.configure is not None:
+            event.listen(engine, "connect",
+                         lambda conn, record: self.configure(conn, read_only))
+        with self._lock:
+            if (key, read_only) in self._engines:  # outra thread chegou antes
+                engine.dispose()
+                return self._engines[(key, read_only)]
+            if not read_only:
+                self.tables[0].metadata.create_all(engine, tables=self.tables)
+                if self.on_create is not None:
+                    self.on_create(engine)
+            self._engines[(key, read_only)] = engine
+            return engine
+
+    def session(self, key, read_only=True):
+        """Sessão (por thread) do shard `key`.
+
+        Leitura de um CNPJ sem shard (ou de uma chave inválida) cai num banco
+        vazio: devolve resultados vazios sem criar arquivo para o CNPJ.
+        """
+        if read_only and not (self.valid(key) and self.path(key).exists()):
+            key = _EMPTY
+        elif not read_only and not self.valid(key):
+            raise ValueError(f"CNPJ inválido para shard: {key!r}")
+        s = self._sessions.get((key, read_only))
+        if s is None:
+            s = scoped_session(sessionmaker(bind=self._engine(key, read_only)))
+            with self._lock:
+                s = self._sessions.setdefault((key, read_only), s)
+        return s
+
+    def remove_sessions(self):
+        """Fecha as sessões da thread atual (fim da requisição)."""
+        for s in list(self._sessions.values()):
+            s.remove()
+
+    def fan_out(self, fn, keys=None):
+        """[fn(chave) para cada shard], em paralelo no pool; mesma ordem de `keys`."""
+        keys = self.keys() if keys is None else list(keys)
+        if self._pool is None or len(keys) < 2:
+            return [fn(k) for k in keys]
+        return list(self._pool.map(fn, keys))
+
+    def drop_all(self):
+        """Apaga todos os shards (reseed). Chamadores não devem estar lendo."""
+        with self._lock:
+            for s in self._sessions.values():
+                s.remove()
+            for engine in self._engines.values():
+                engine.dispose()
+            self._sessions.clear()
+            self._engines.clear()
+        for p in self.directory.glob("*.db*"):
+            p.unlink()
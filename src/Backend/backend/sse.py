@@ -0,0 +1,146 @@
+"""Hub de broadcast para Server-Sent Events.
+
+Um único produtor (thread em segundo plano) calcula os eventos a cada `tick`
+segundos, só para os tópicos que têm assinantes, e distribui a mensagem pronta
+para todos eles. Cada assinante tem uma fila limitada: quem não consome a tempo
+(fila cheia) é marcado como `dropped` e removido, sem atrasar os demais.
+
+Assinantes síncronos (WSGI, uma thread por conexão) usam `queue.Queue`;
+assinantes assíncronos (ASGI, ver asgi.py) usam `asyncio.Queue` no loop deles.
+"""
+import asyncio, json, queue, threading
+
+
+def sse_message(data, event=None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+SSE_PING = ": ping\n\n"
+
+
+class Subscriber:
+    def __init__(self, topic, maxsize):
+        self.topic = topic
+        self.dropped = False
+        self.queue = queue.Queue(maxsize)
+
+    def offer(self, msg) -> bool:
+        try:
+            self.queue.put_nowait(msg)
+            return True
+        except queue.Full:
+            return False
+
+    def get(self, timeout):
+        """Próxima mensagem, ou None se nada chegou em `timeout` segundos."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscriber(Subscriber):
+    def __init__(self, topic, maxsize, loop):
+        self.topic = topic
+        self.dropped = False
+        self.queue = asyncio.Queue(maxsize)
+        self.loop = loop
+
+    def offer(self, msg) -> bool:
+        if self.queue.full():
+            return False
+        self.loop.call_soon_threadsafe(self._put, msg)
+        return True
+
+    def _put(self, msg):
+        try:
+            self.queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            self.dropped = True
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class BroadcastHub:
+    def __init__(self, produce, tick=3.0, queue_size=16, name="sse-hub"):
+        """`produce(topics)` devolve {tópico: mensagem SSE} para os tópicos pedidos."""
+        self.produce = produce
+        self.tick = tick
+        self.queue_size = queue_size
+        self.name = name
+        self._subs = {}   # tópico -> set(Subscriber)
+        self._last = {}   # tópico -> última mensagem (entregue a quem assina depois)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.ticks = self.published = self.dropped = 0
+
+    # ---- assinantes ----
+    def subscribe(self, topic, loop=None):
+        sub = (AsyncSubscriber(topic, self.queue_size, loop) if loop is not None
+               else Subscriber(topic, self.queue_size))
+        with self._lock:
+            self._subs.setdefault(topic, set()).add(sub)
+            last = self._last.get(topic)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        if last is not None:
+            sub.offer(last)
+        else:
+            self._wake.set()  # tópico novo: produz já, sem esperar o próximo tick
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.topic]
+                    self._last.pop(sub.topic, None)
+
+    # ---- produtor ----
+    def publish(self, topic, msg):
+        with self._lock:
+            if topic not in self._subs:
+                return
+            self._last[topic] = msg
+            subs = list(self._subs[topic])
+        for sub in subs:
+            if sub.dropped or not sub.offer(msg):
+                sub.dropped = True
+                self.dropped += 1
+                self.unsubscribe(sub)
+            else:
+                self.published += 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                topics = list(self._subs)
+            if topics:
+                try:
+                    for topic, msg in self.produce(topics).items():
+                        self.publish(topic, msg)
+                except Exception as e:  # um tick ruim não derruba o hub
+                    print(f"[sse] erro no produtor: {e}")
+                self.ticks += 1
+            self._wake.wait(self.tick)
+            self._wake.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "topics": len(self._subs),
+                "subscribers": sum(len(s) for s in self._subs.values()),
+                "ticks": self.ticks,
+                "published": self.published,
+                "dropped": self.dropped,
+                "tick_s": self.tick,
+                "queue_size": self.queue_size,
+            }
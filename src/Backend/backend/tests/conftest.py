@@ -0,0 +1,75 @@
+"""Fixtures dos testes do backend.
+
+O app semeia o banco na importação, então o ambiente (banco temporário, base
+pequena, cache desligado) precisa estar pronto antes do primeiro `import app`.
+
+    cd src/Backend/backend && python -m pytest tests
+"""
+import os, sys, tempfile
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix="inovatech-tests-")
+
+os.environ.update({
+    "DB_PATH": os.path.join(TMP, "test.db"),
+    "SHARDS_DIR": os.path.join(TMP, "shards"),
+    "STORAGE_MODE": "single",
+    "SEED_DAYS": "3",
+    "SEED_SCALE": "0.3",  # abaixo de ~0.1 o gerador arredonda tudo para zero
+    "CACHE_TTL_SECONDS": "0",
+})
+sys.path.insert(0, BACKEND)
+
+import app as backend  # noqa: E402  (depois do ambiente acima)
+import ingest  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def A():
+    return backend
+
+
+@pytest.fixture
+def client(A):
+    return A.app.test_client()
+
+
+def make_token(A, role, cnpj=None, identity="1"):
+    claims = {"role": role}
+    if cnpj:
+        claims["cnpj"] = cnpj
+    with A.app.app_context():
+        return A.create_access_token(identity=identity, additional_claims=claims)
+
+
+@pytest.fixture(scope="session")
+def admin_token(A):
+    return make_token(A, "admin")
+
+
+@pytest.fixture(scope="session")
+def cliente_token(A):
+    return lambda cnpj: make_token(A, "cliente", cnpj, identity=f"cli-{cnpj}")
+
+
+@pytest.fixture(scope="session")
+def write_orders(A):
+    """Grava pedidos (dicts no formato de POST /orders/batch) por write_order_batch.
+
+    `ordered_at` pode ser datetime (sem fuso = UTC); devolve os ids atribuídos.
+    """
+    def write(orders):
+        with A.app.app_context():
+            snap = A.dims.snapshot()
+            valid = []
+            for o in orders:
+                o = dict(o)
+                if isinstance(o.get("ordered_at"), A.datetime):
+                    o["ordered_at"] = o["ordered_at"].isoformat()
+                valid.append(ingest.validate_order(o, snap, allowed_cnpjs={o.get("cnpj")}))
+            ids = A.write_order_batch(ingest.to_batch(valid)).tolist()
+            A.db.session.commit()
+            return ids
+    return write
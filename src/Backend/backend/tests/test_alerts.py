@@ -0,0 +1,134 @@
+"""/alerts: ordem do cursor, long polling (timeout e despertar) e cauda em memória vs. banco."""
+import itertools, json, threading, time
+
+import pytest
+from sqlalchemy import text
+
+from alertlog import AlertRing
+
+_buckets = (f"1999-01-{d:02d} {h:02d}:00" for d in itertools.count(1) for h in range(24))
+
+
+@pytest.fixture
+def fresh(A, monkeypatch):
+    """Relê o log a cada consulta e fatia a espera em 50 ms.
+
+    O EWMA já avançado antes evita alertas reais no meio dos ids gravados pelo teste.
+    """
+    monkeypatch.setattr(A, "ALERTS_REFRESH_SECONDS", 0.05)
+    monkeypatch.setattr(A, "_alerts_refreshed_at", 0.0)
+    with A.app.app_context():
+        A.advance_ewma()
+
+
+def log_alerts(A, n):
+    """Grava `n` alertas gerais no log (tabela alerts) e devolve os ids."""
+    with A.app.app_context():
+        conn = A.db.session.connection()
+        ids = []
+        for _ in range(n):
+            bucket = next(_buckets)
+            payload = {"tipo": "anomalia", "cnpj": None, "canal": None, "loja": None,
+                       "last_hour": bucket, "msg": f"teste {bucket}"}
+            conn.exec_driver_sql(A.ALERT_INSERT, ("1999-01-01 00:00:00.000000", *A.GLOBAL_SERIES,
+                                                  bucket, "alto", json.dumps(payload)))
+            ids.append(conn.exec_driver_sql("SELECT max(id) FROM alerts").scalar())
+        A.db.session.commit()
+    return ids
+
+
+def last_logged(A):
+    with A.app.app_context():
+        return A.db.session.execute(text("SELECT coalesce(max(id), 0) FROM alerts")).scalar()
+
+
+def log_ids(A, after):
+    with A.app.app_context():
+        return [i for (i,) in A.db.session.execute(
+            text("SELECT id FROM alerts WHERE id > :a ORDER BY id"), {"a": after})]
+
+
+def get_alerts(client, token, **params):
+    query = "&".join(f"{k}={v}" for k, v in params.items())
+    resp = client.get(f"/alerts?{query}", headers={"Authorization": f"Bearer {token}"})
+    assert resp.status_code == 200
+    return [a["id"] for a in resp.get_json()], int(resp.headers["X-Alerts-Cursor"])
+
+
+def walk(client, token, after, limit):
+    """Segue o cursor até não vir mais nada; devolve os ids na ordem recebida."""
+    seen = []
+    while True:
+        ids, cursor = get_alerts(client, token, after=after, limit=limit)
+        assert cursor >= after
+        if not ids:
+            return seen
+        assert ids == sorted(ids) and cursor == ids[-1]
+        seen += ids
+        after = cursor
+
+
+def test_ring_wait_times_out_and_wakes_on_extend():
+    ring = AlertRing(size=4)
+    t0 = time.monotonic()
+    assert ring.wait(0, 0.1) is False
+    assert time.monotonic() - t0 >= 0.1
+
+    threading.Timer(0.05, ring.extend, args=([{"id": 1}, {"id": 2}],)).start()
+    assert ring.wait(0, 5) is True
+    ring.extend([{"id": 2}, {"id": 3}])  # o 2 já foi visto
+    assert [a["id"] for a in ring.since(0)] == [1, 2, 3]
+    assert ring.covers(0) and ring.covers(3)
+    ring.extend([{"id": i} for i in range(4, 7)])
+    assert not ring.covers(1) and ring.covers(2)  # a cauda guarda 3..6
+
+
+def test_cursor_walks_the_log_in_order(A, client, admin_token, fresh):
+    start = last_logged(A)
+    ids = log_alerts(A, 7)
+    assert walk(client, admin_token, start, limit=3) == log_ids(A, start)
+    assert ids == log_ids(A, start)
+
+    latest, cursor = get_alerts(client, admin_token, limit=4)
+    assert latest == ids[-4:] and cursor == ids[-1]
+
+
+def test_long_poll_times_out_with_the_same_cursor(A, client, admin_token, fresh):
+    last = log_alerts(A, 1)[0]
+    t0 = time.monotonic()
+    ids, cursor = get_alerts(client, admin_token, after=last, wait=0.3)
+    elapsed = time.monotonic() - t0
+    assert ids == [] and cursor == last
+    assert 0.3 <= elapsed < 2
+
+
+def test_long_poll_returns_a_new_alert_as_soon_as_it_is_logged(A, client, admin_token, fresh):
+    last = log_alerts(A, 1)[0]
+    later = []
+    timer = threading.Timer(0.2, lambda: later.extend(log_alerts(A, 1)))
+    timer.start()
+    t0 = time.monotonic()
+    ids, cursor = get_alerts(client, admin_token, after=last, wait=10)
+    timer.join()
+    assert ids == later and cursor == later[0]
+    assert time.monotonic() - t0 < 5
+
+
+def test_old_cursor_falls_back_to_the_db(A, client, admin_token, fresh, monkeypatch):
+    start = last_logged(A)
+    ids = log_alerts(A, 8)
+    ring = AlertRing(size=3)
+    monkeypatch.setattr(A, "alert_ring", ring)
+    db_reads = []
+    read = A.read_alert_log
+    monkeypatch.setattr(A, "read_alert_log",
+                        lambda after, limit: db_reads.append(after) or read(after, limit))
+
+    # cursor dentro da cauda: só memória
+    assert get_alerts(client, admin_token, after=ids[-3], limit=10) == (ids[-2:], ids[-1])
+    assert db_reads == []
+    assert A.alert_ring.stats()["first_id"] == ids[-3]
+
+    # cursor anterior à cauda: lê do banco, na mesma ordem e com os mesmos cortes
+    assert walk(client, admin_token, start, limit=3) == ids
+    assert db_reads and all(after < ids[-4] for after in db_reads)
@@ -0,0 +1,108 @@
+"""Cache de respostas: LRU + TTL, invalidação na escrita e chave por escopo/role."""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import cache
+from cache import ResponseCache
+
+CNPJS = ("11111111000191", "12345678000190")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Relógio manual para o TTL do cache."""
+    now = SimpleNamespace(t=1000.0)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: now.t))
+    return now
+
+
+@pytest.fixture
+def cached(A, monkeypatch):
+    """Liga o cache do app (o conftest sobe com TTL 0) e começa vazio."""
+    monkeypatch.setattr(A.response_cache, "ttl", 60.0)
+    A.response_cache.clear()
+    yield A.response_cache
+    A.response_cache.clear()
+
+
+def get(client, path, token=None):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    resp = client.get(path, headers=headers)
+    assert resp.status_code == 200
+    return resp
+
+
+def test_entry_expires_after_ttl(clock):
+    c = ResponseCache(max_entries=4, ttl=30)
+    c.set("k", 1, "v")
+    clock.t += 29.9
+    assert c.get("k", 1) == "v"
+    clock.t += 0.2
+    assert c.get("k", 1) is None
+    assert c.stats()["expired"] == 1 and c.stats()["entries"] == 0
+
+
+def test_new_data_version_drops_the_entry(clock):
+    c = ResponseCache(max_entries=4, ttl=30)
+    c.set("k", 1, "v")
+    assert c.get("k", 2) is None
+    assert c.get("k", 1) is None  # descartada, não só escondida
+    assert c.stats()["stale"] == 1
+
+
+def test_lru_evicts_the_least_recently_used(clock):
+    c = ResponseCache(max_entries=2, ttl=30)
+    c.set("a", 1, "A")
+    c.set("b", 1, "B")
+    assert c.get("a", 1) == "A"  # "a" passa a ser a mais recente
+    c.set("c", 1, "C")
+    assert c.get("b", 1) is None
+    assert (c.get("a", 1), c.get("c", 1)) == ("A", "C")
+    assert c.stats()["evictions"] == 1 and c.stats()["entries"] == 2
+
+
+def test_write_invalidates_cached_view(A, client, cached, admin_token, write_orders):
+    path = "/metrics?period=24h"
+    first = get(client, path, admin_token)
+    again = get(client, path, admin_token)
+    assert (first.headers["X-Cache"], again.headers["X-Cache"]) == ("MISS", "HIT")
+    assert again.get_json() == first.get_json()
+
+    write_orders([{"customer_email": "cache@exemplo.com", "channel_id": 1, "location_id": 1,
+                   "ordered_at": datetime.now(timezone.utc) - timedelta(minutes=5),
+                   "items": [{"item_id": 3, "qty": 1}]}])
+    after = get(client, path, admin_token)
+    assert after.headers["X-Cache"] == "MISS"
+    assert after.get_json()["kpis"]["pedidos"] == first.get_json()["kpis"]["pedidos"] + 1
+    assert get(client, path, admin_token).headers["X-Cache"] == "HIT"
+
+
+def test_cached_view_is_keyed_by_scope_cnpj(A, client, cached, cliente_token):
+    path = "/metrics?period=7d"
+    bodies = {}
+    for cnpj in CNPJS:
+        resp = get(client, path, cliente_token(cnpj))
+        assert resp.headers["X-Cache"] == "MISS"
+        bodies[cnpj] = resp.get_json()
+    assert bodies[CNPJS[0]] != bodies[CNPJS[1]]
+
+    for cnpj in CNPJS:
+        resp = get(client, path, cliente_token(cnpj))
+        assert resp.headers["X-Cache"] == "HIT"
+        assert resp.get_json() == bodies[cnpj]
+    with A.app.test_request_context():
+        for cnpj in CNPJS:
+            f = A.resolve_filters("7d", None, None, force_cnpj=cnpj)
+            assert bodies[cnpj]["kpis"]["pedidos"] == A.compute_kpis(f)["pedidos"]
+
+
+def test_cached_view_is_keyed_by_role(A, client, cached, admin_token):
+    path = "/metrics?period=7d"
+    public = get(client, path)
+    admin = get(client, path, admin_token)
+    assert (public.headers["X-Cache"], admin.headers["X-Cache"]) == ("MISS", "MISS")
+    assert "churn" in admin.get_json()["kpis"]
+    assert "churn" not in public.get_json()["kpis"]
+    assert "churn" not in get(client, path).get_json()["kpis"]
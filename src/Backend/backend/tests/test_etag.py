@@ -0,0 +1,63 @@
+"""ETag das views cacheadas: 304 com If-None-Match, nova marca após escrita, compressão."""
+from datetime import datetime, timedelta, timezone
+
+PATH = "/metrics?period=7d"
+
+
+def get(client, token, **headers):
+    return client.get(PATH, headers={"Authorization": f"Bearer {token}", **headers})
+
+
+def test_if_none_match_returns_304(A, client, admin_token):
+    first = get(client, admin_token)
+    assert first.status_code == 200
+    etag, weak = first.get_etag()
+    assert etag and not weak
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    assert "Authorization" in first.vary
+
+    again = get(client, admin_token, **{"If-None-Match": f'"{etag}"'})
+    assert again.status_code == 304 and again.get_data() == b""
+    assert again.headers["X-Cache"] == "NOT-MODIFIED"
+    assert again.get_etag() == (etag, False)
+    assert "Authorization" in again.vary
+
+    other = get(client, admin_token, **{"If-None-Match": '"outra-coisa"'})
+    assert other.status_code == 200 and other.get_etag()[0] == etag
+
+
+def test_etag_is_per_scope(A, client, admin_token, cliente_token):
+    etag = get(client, admin_token).get_etag()[0]
+    scoped = get(client, cliente_token("12345678000190"), **{"If-None-Match": f'"{etag}"'})
+    assert scoped.status_code == 200
+    assert scoped.get_etag()[0] != etag
+
+
+def test_write_changes_the_etag(A, client, admin_token, write_orders):
+    etag = get(client, admin_token).get_etag()[0]
+    write_orders([{"customer_email": "etag@exemplo.com", "channel_id": 1, "location_id": 2,
+                   "ordered_at": datetime.now(timezone.utc) - timedelta(minutes=2),
+                   "items": [{"item_id": 1, "qty": 1}]}])
+    after = get(client, admin_token, **{"If-None-Match": f'"{etag}"'})
+    assert after.status_code == 200
+    assert after.get_etag()[0] != etag
+
+
+def test_compressed_response_keeps_a_weak_etag_and_vary(A, client, admin_token):
+    plain = get(client, admin_token)
+    etag = plain.get_etag()[0]
+    assert len(plain.get_data()) >= 1024  # acima de COMPRESS_MIN_BYTES
+
+    packed = get(client, admin_token, **{"Accept-Encoding": "gzip"})
+    assert packed.status_code == 200
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert packed.get_etag() == (etag, True)
+    assert {"Authorization", "Accept-Encoding"} <= set(packed.vary)
+    assert packed.headers["Cache-Control"] == "private, no-cache"
+
+    for tag in (f'W/"{etag}"', f'"{etag}"'):
+        revalidated = get(client, admin_token,
+                          **{"Accept-Encoding": "gzip", "If-None-Match": tag})
+        assert revalidated.status_code == 304
+        assert revalidated.get_data() == b""
+        assert "Authorization" in revalidated.vary
@@ -0,0 +1,155 @@
+"""advance_ewma: passo incremental = recálculo completo, reinício, aquecimento e piso do desvio."""
+import math
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import text
+
+QUIET_CNPJ = "99999999000199"
+
+
+@pytest.fixture
+def clock(A, monkeypatch):
+    """Congela o "agora" de advance_ewma: clock(t) passa a valer a partir daí."""
+    def freeze(when):
+        class Frozen(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return when
+        monkeypatch.setattr(A, "datetime", Frozen)
+    return freeze
+
+
+def states(A):
+    with A.app.app_context():
+        return {(s.owner_cnpj, s.channel_id, s.location_id): A.ewma_dict(s)
+                for s in A.EwmaState.query.all()}
+
+
+def restart(A):
+    """Zera todas as séries e recalcula do aquecimento."""
+    with A.app.app_context():
+        A.rebuild_ewma_state()
+        return A.advance_ewma()
+
+
+def advance(A):
+    with A.app.app_context():
+        return A.advance_ewma()
+
+
+def reference_ewma(A, ys, floor=True):
+    """Mesma recorrência de advance_ewma, ponto a ponto, para uma série.
+
+    floor=False é a versão anterior, sem piso (desvio 1 só com variância zero).
+    """
+    a, n, m, v, z = A.EWMA_ALPHA, 0, 0.0, 0.0, 0.0
+    for y in ys:
+        if floor:
+            sd = max(math.sqrt(v), A.EWMA_REL_SD * abs(m), A.EWMA_MIN_SD)
+        else:
+            sd = math.sqrt(v) if v > 0 else 1.0
+        z = abs(y - m) / sd if n >= A.EWMA_MIN_POINTS else 0.0
+        if n == 0:
+            m, v = y, 0.0
+        else:
+            m_new = a * y + (1 - a) * m
+            v = a * (y - m_new) ** 2 + (1 - a) * v
+            m = m_new
+        n += 1
+    return {"n": n, "mean": m, "var": v, "zscore": z}
+
+
+def assert_same_state(got, want, extra_points=0):
+    assert got["last_bucket"] == want["last_bucket"]
+    assert got["n"] == want["n"] + extra_points
+    for k in ("mean", "var", "zscore", "last_value"):
+        assert got[k] == pytest.approx(want[k], rel=1e-9, abs=1e-9), k
+
+
+def test_quiet_series_then_a_normal_order_is_not_an_alert(A, clock, write_orders):
+    t = datetime.now(timezone.utc)
+    key = (QUIET_CNPJ, 2, 3)
+    write_orders([{"customer_email": "calmo@exemplo.com", "channel_id": 2, "location_id": 3,
+                   "cnpj": QUIET_CNPJ, "ordered_at": when, "total": 40.0,
+                   "items": [{"item_id": 3, "qty": 1}]}
+                  for when in (t - timedelta(hours=72), t - timedelta(hours=1))])
+    clock(t)
+    advance(A)
+
+    state = states(A)[key]
+    assert state["last_bucket"] == A.hour_bucket(t - timedelta(hours=1))
+    assert state["last_value"] == 40.0
+    assert A.severity_for(state["zscore"]) == "normal"
+    with A.app.app_context():
+        assert A.db.session.execute(text("SELECT count(*) FROM alerts WHERE owner_cnpj = :c"),
+                                    {"c": QUIET_CNPJ}).scalar() == 0
+
+    # o estado é a recorrência aplicada à série horária preenchida com zeros
+    warm = datetime.strptime(A.first_bucket_from(t - timedelta(days=A.EWMA_WARMUP_DAYS)),
+                             "%Y-%m-%d %H:00")
+    hours = [A.hour_bucket(warm + timedelta(hours=h)) for h in range(7 * 24 - 1)]
+    revenue = {A.hour_bucket(t - timedelta(hours=h)): 40.0 for h in (72, 1)}
+    want = reference_ewma(A, [revenue.get(h, 0.0) for h in hours])
+    assert hours[-1] == state["last_bucket"]
+    assert_same_state(state, {**want, "last_bucket": hours[-1], "last_value": 40.0})
+    # sem o piso, 70 horas paradas deixam a variância ~0 e o mesmo pedido vira pico
+    assert reference_ewma(A, [revenue.get(h, 0.0) for h in hours], floor=False)["zscore"] > 1e3
+
+
+def test_incremental_step_matches_full_recompute(A, clock):
+    t0 = datetime.now(timezone.utc) - timedelta(hours=6)
+    clock(t0)
+    restart(A)
+
+    clock(t0 + timedelta(hours=3))
+    stepped = advance(A)
+    last = A.hour_bucket(t0 + timedelta(hours=2))
+    assert stepped and all(state["last_bucket"] == last for _, state in stepped)
+    incremental = states(A)
+
+    restart(A)
+    full = states(A)
+    assert incremental.keys() == full.keys()
+    for key in full:
+        # o passo incremental carrega 3 horas a mais de histórico (peso (1-alpha)^168 ~ 0)
+        assert_same_state(incremental[key], full[key], extra_points=3)
+
+
+def test_write_into_a_processed_hour_restarts_only_that_series(A, clock, write_orders):
+    t = datetime.now(timezone.utc)
+    clock(t)
+    restart(A)
+    assert advance(A) == []  # nada novo até a próxima hora fechar
+
+    key = ("11111111000191", 1, 1)
+    write_orders([{"customer_email": "tardio@exemplo.com", "channel_id": 1, "location_id": 1,
+                   "cnpj": key[0], "ordered_at": (t - timedelta(hours=5)).isoformat(),
+                   "total": 500.0, "items": [{"item_id": 3, "qty": 1}]}])
+    touched = states(A)
+    assert touched[key]["last_bucket"] is None
+    assert touched[A.GLOBAL_SERIES]["last_bucket"] is None
+
+    restarted = dict(advance(A))
+    assert restarted.keys() == {key, A.GLOBAL_SERIES}
+    after = states(A)
+    restart(A)
+    full = states(A)
+    for k in full:
+        assert_same_state(after[k], full[k])
+
+
+def test_warmup_window_and_min_points(A, clock, monkeypatch):
+    clock(datetime.now(timezone.utc))
+    monkeypatch.setattr(A, "EWMA_WARMUP_DAYS", 1)
+    restart(A)
+    window = states(A)
+    assert {s["n"] for s in window.values()} == {23}  # horas cheias em 24h, sem a corrente
+
+    monkeypatch.setattr(A, "EWMA_MIN_POINTS", 23)
+    restart(A)
+    assert all(s["zscore"] == 0 for s in states(A).values())
+
+    monkeypatch.setattr(A, "EWMA_MIN_POINTS", 22)
+    restart(A)
+    assert any(s["zscore"] > 0 for s in states(A).values())
@@ -0,0 +1,101 @@
+"""/export/csv, /parquet e /arrow: lotes, gzip em fluxo e conexão de leitura devolvida."""
+import csv, gzip, io, math
+
+import pytest
+
+CNPJ = "11111111000191"
+
+
+def auth(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def expected_ids(A, period, cnpj):
+    with A.app.test_request_context():
+        f = A.resolve_filters(period, None, None, force_cnpj=cnpj)
+        return [r[0] for r in A.export_rows(f)]
+
+
+def read_stream(resp):
+    """Consome a resposta não bufferizada e devolve os pedaços não vazios."""
+    try:
+        return [c for c in resp.response if c]
+    finally:
+        resp.close()
+
+
+def test_csv_is_written_batch_by_batch(A, client, cliente_token, monkeypatch):
+    monkeypatch.setattr(A, "EXPORT_BATCH", 7)
+    ids = expected_ids(A, "7d", CNPJ)
+    assert len(ids) > 3 * 7
+
+    resp = client.get("/export/csv?period=7d", headers=auth(cliente_token(CNPJ)), buffered=False)
+    assert resp.status_code == 200 and resp.is_streamed
+    chunks = read_stream(resp)
+    assert len(chunks) == math.ceil(len(ids) / 7)
+    first = list(csv.reader(io.StringIO(chunks[0].decode())))
+    assert first[0] == ["order_id", "email", "canal", "loja", "data", "total"]
+    assert len(first) == 1 + 7
+
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode())))
+    assert [int(r["order_id"]) for r in rows] == ids
+
+
+def test_gzip_export_decompresses_to_the_plain_csv(A, client, cliente_token, monkeypatch):
+    monkeypatch.setattr(A, "EXPORT_BATCH", 50)
+    headers = auth(cliente_token(CNPJ))
+    plain = client.get("/export/csv?period=7d", headers=headers)
+    packed = client.get("/export/csv?period=7d&gzip=1",
+                        headers={**headers, "Accept-Encoding": "gzip, br"})
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in plain.headers
+    body = packed.get_data()
+    assert body[:2] == b"\x1f\x8b"
+    assert gzip.decompress(body) == plain.get_data()  # comprimido uma vez só
+    assert len(body) < len(plain.get_data())
+
+
+def test_read_connection_is_returned_after_the_stream(A, client, admin_token, monkeypatch):
+    monkeypatch.setattr(A, "EXPORT_BATCH", 10)
+    pool = A.analytics_engine.pool
+    A.release_read_sessions()
+    assert pool.checkedout() == 0
+
+    for path in ("/export/csv?period=7d", "/export/csv?period=7d&gzip=1"):
+        resp = client.get(path, headers=auth(admin_token), buffered=False)
+        stream = iter(resp.response)
+        assert next(stream)
+        assert pool.checkedout() == 1  # o fluxo lê pela conexão somente leitura
+        for _ in stream:
+            pass
+        resp.close()
+        assert pool.checkedout() == 0
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_columnar_export_returns_the_read_connection(A, client, cliente_token, monkeypatch, fmt):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+    monkeypatch.setattr(A, "EXPORT_BATCH", 10)
+    ids = expected_ids(A, "7d", CNPJ)
+    pool = A.analytics_engine.pool
+    A.release_read_sessions()
+
+    resp = client.get(f"/export/{fmt}?period=7d", headers=auth(cliente_token(CNPJ)),
+                      buffered=False)
+    assert resp.status_code == 200 and resp.is_streamed
+    stream = iter(resp.response)
+    chunks = [next(stream)]
+    assert pool.checkedout() == 1
+    chunks += [c for c in stream if c]
+    resp.close()
+    assert pool.checkedout() == 0
+
+    body = pa.BufferReader(b"".join(chunks))
+    if fmt == "parquet":
+        f = pq.ParquetFile(body)
+        assert f.metadata.num_row_groups == math.ceil(len(ids) / 10)
+        table = f.read()
+    else:
+        table = pa.ipc.open_stream(body).read_all()
+    assert table.column("order_id").to_pylist() == ids
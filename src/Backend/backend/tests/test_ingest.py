@@ -0,0 +1,157 @@
+"""POST /orders/batch: idempotência, erros por linha, limite do corpo e lotes concorrentes."""
+import io, json, threading, uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func
+
+CNPJ = "11111111000191"
+
+
+def order(**kw):
+    when = datetime.now(timezone.utc) - timedelta(hours=1)
+    return {"customer_email": "teste@exemplo.com", "channel": "iFood", "location": "SP",
+            "ordered_at": when.isoformat(timespec="seconds"),
+            "items": [{"item": "Tiramisu", "qty": 2}], **kw}
+
+
+def ndjson(*lines):
+    return "\n".join(l if isinstance(l, str) else json.dumps(l) for l in lines)
+
+
+def post_batch(client, token, body, key=None):
+    headers = {"Authorization": f"Bearer {token}"}
+    if key:
+        headers["Idempotency-Key"] = key
+    return client.post("/orders/batch", data=body, headers=headers,
+                       content_type="application/x-ndjson")
+
+
+def post_chunked(client, token, body):
+    """Corpo sem Content-Length, como um servidor que repassa Transfer-Encoding: chunked."""
+    return client.post("/orders/batch", input_stream=io.BytesIO(body.encode()),
+                       headers={"Authorization": f"Bearer {token}",
+                                "Transfer-Encoding": "chunked"},
+                       content_type="application/x-ndjson",
+                       environ_overrides={"wsgi.input_terminated": True})
+
+
+def order_count(A):
+    with A.app.app_context():
+        return A.db.session.query(func.count(A.Order.id)).scalar()
+
+
+def test_replay_returns_original_response_without_writing(A, client, cliente_token):
+    token, key = cliente_token(CNPJ), uuid.uuid4().hex
+    body = ndjson(order(), order(customer_email="outro@exemplo.com"))
+    before = order_count(A)
+
+    first = post_batch(client, token, body, key)
+    assert first.status_code == 200
+    assert first.get_json()["accepted"] == 2
+    assert "Idempotent-Replayed" not in first.headers
+
+    again = post_batch(client, token, body, key)
+    assert again.status_code == 200
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert again.get_json() == first.get_json()
+    assert order_count(A) == before + 2
+
+
+def test_key_reused_with_other_body_is_409(A, client, cliente_token):
+    token, key = cliente_token(CNPJ), uuid.uuid4().hex
+    assert post_batch(client, token, ndjson(order()), key).status_code == 200
+    before = order_count(A)
+
+    resp = post_batch(client, token, ndjson(order(total=99.0)), key)
+    assert resp.status_code == 409
+    assert "Idempotency-Key" in resp.get_json()["error"]
+    assert order_count(A) == before
+
+
+def test_invalid_rows_are_reported_by_position(A, client, cliente_token):
+    future = (datetime.now(timezone.utc) + timedelta(hours=2)).isoformat(timespec="seconds")
+    body = ndjson(order(),
+                  order(customer_email="sem-arroba"),
+                  "{não é json",
+                  order(channel="Rappi"),
+                  order(ordered_at=future),
+                  order(items=[{"item": "Tiramisu", "qty": 0}]),
+                  order(cnpj="22222222000192"),
+                  order(location=None, location_id=2, customer_email="ok@exemplo.com"))
+    before = order_count(A)
+
+    resp = post_batch(client, cliente_token(CNPJ), body)
+    assert resp.status_code == 200
+    out = resp.get_json()
+    assert out["accepted"] == 2 and out["rejected"] == 6
+    assert [o["row"] for o in out["orders"]] == [0, 7]
+    assert out["errors"] == [
+        {"row": 1, "error": "customer_email inválido"},
+        {"row": 2, "error": "JSON inválido"},
+        {"row": 3, "error": "canal desconhecido: Rappi"},
+        {"row": 4, "error": "ordered_at no futuro"},
+        {"row": 5, "error": "qty inválida para Tiramisu"},
+        {"row": 6, "error": "cnpj diferente do CNPJ do token"},
+    ]
+    assert order_count(A) == before + 2
+    with A.app.app_context():
+        saved = A.db.session.get(A.Order, out["orders"][1]["id"])
+        assert (saved.customer_email, saved.location_id, saved.owner_cnpj) == \
+            ("ok@exemplo.com", 2, CNPJ)
+
+
+def test_oversized_body_is_rejected_before_parsing(A, client, cliente_token, monkeypatch):
+    parsed = []
+    parse = A.ingest.parse_body
+    monkeypatch.setattr(A.ingest, "parse_body", lambda *a: parsed.append(1) or parse(*a))
+    monkeypatch.setattr(A, "ORDERS_BATCH_MAX_BYTES", 2000)
+    token = cliente_token(CNPJ)
+    body = ndjson(*(order(customer_email=f"grande{i}@exemplo.com") for i in range(20)))
+    assert len(body) > 2000
+    before = order_count(A)
+
+    resp = post_batch(client, token, body)
+    assert resp.status_code == 413
+    assert resp.get_json() == {"error": "corpo acima de 2000 bytes"}
+
+    # sem Content-Length (chunked): corta ao passar do limite durante a leitura
+    assert post_chunked(client, token, body).status_code == 413
+    assert parsed == [] and order_count(A) == before
+
+    small = ndjson(order(customer_email="pequeno@exemplo.com"))
+    monkeypatch.setattr(A, "ORDERS_BATCH_MAX_BYTES", len(small.encode()))  # no limite, passa
+    assert post_batch(client, token, small).get_json()["accepted"] == 1
+    assert post_chunked(client, token, small).get_json()["accepted"] == 1
+    assert post_chunked(client, token, small + " ").status_code == 413
+    assert len(parsed) == 2 and order_count(A) == before + 2
+
+
+def test_concurrent_batches_get_distinct_ids(A, cliente_token):
+    token = cliente_token(CNPJ)
+    threads, batches, per_batch = 6, 4, 25
+    before = order_count(A)
+    results, lock = [], threading.Lock()
+
+    def send(t):
+        client = A.app.test_client()
+        for b in range(batches):
+            body = ndjson(*(order(customer_email=f"c{t}-{b}-{i}@exemplo.com")
+                            for i in range(per_batch)))
+            resp = post_batch(client, token, body, f"conc-{t}-{b}-{uuid.uuid4().hex}")
+            with lock:
+                results.append((resp.status_code, resp.get_json()))
+
+    workers = [threading.Thread(target=send, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    assert [status for status, _ in results] == [200] * (threads * batches)
+    ids = [o["id"] for _, out in results for o in out["orders"]]
+    assert len(ids) == threads * batches * per_batch
+    assert len(set(ids)) == len(ids)
+    assert order_count(A) == before + len(ids)
+    with A.app.app_context():
+        stored = A.db.session.query(func.count(A.Order.id)).filter(A.Order.id.in_(ids)).scalar()
+    assert stored == len(ids)
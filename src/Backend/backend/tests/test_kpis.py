@@ -0,0 +1,26 @@
+"""compute_kpis (rollups / varredura única) devolve o mesmo que as 4 consultas antigas."""
+import pytest
+
+from bench.bench_kpis import legacy_kpis
+
+CASES = [
+    # caminho dos rollups (orders_hourly + customer_activity)
+    ("24h", None, None, None),
+    ("7d", None, None, None),
+    ("30d", None, None, None),
+    ("7d", None, None, "11111111000191"),
+    # caminho filtrado (uma varredura de orders com agregados condicionais)
+    ("7d", "iFood", None, None),
+    ("30d", None, "SP", None),
+    ("7d", "iFood", "SP", None),
+    ("30d", "iFood", None, "12345678000190"),
+]
+
+
+@pytest.mark.parametrize("period,channel,location,cnpj", CASES)
+def test_compute_kpis_matches_legacy_queries(A, period, channel, location, cnpj):
+    with A.app.test_request_context():
+        f = A.resolve_filters(period, channel, location, force_cnpj=cnpj)
+        new, old = A.compute_kpis(f), legacy_kpis(A, f)
+    assert old["pedidos"] > 0
+    assert new == old
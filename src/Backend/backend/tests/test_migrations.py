@@ -0,0 +1,72 @@
+"""migrations.py: banco novo e banco antigo chegam ao mesmo schema, e os planos usam os índices."""
+from sqlalchemy import create_engine, inspect
+
+import migrations
+
+COVER_INDEXES = {"ix_orders_cnpj_time_cover", "ix_orders_time_cover",
+                 "ix_order_items_item_order", "ix_item_sales_daily_cnpj_day"}
+
+
+def fresh_engine(A, path):
+    engine = create_engine(f"sqlite:///{path}")
+    A.db.metadata.create_all(engine)  # como o app: create_all() e depois as migrações
+    return engine
+
+
+def indexes(engine):
+    with engine.connect() as conn:
+        return {name for (name,) in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL;")}
+
+
+def failed_checks(engine):
+    with engine.connect() as conn:
+        return [(m.version, c.expect, plan)
+                for m, c, ok, plan in migrations.check_plans(conn) if not ok]
+
+
+def test_fresh_db_gets_every_migration_and_the_covering_plans(A, tmp_path):
+    engine = fresh_engine(A, tmp_path / "novo.db")
+    log = []
+    versions = [m.version for m in migrations.MIGRATIONS]
+    assert migrations.run_migrations(engine, log=log.append) == versions
+    assert not any("aviso" in line for line in log)
+    assert COVER_INDEXES <= indexes(engine)
+    assert failed_checks(engine) == []
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == versions[-1]
+
+
+def test_runner_is_idempotent(A, tmp_path):
+    engine = fresh_engine(A, tmp_path / "novo.db")
+    migrations.run_migrations(engine, log=lambda msg: None)
+    before = indexes(engine)
+
+    log = []
+    assert migrations.run_migrations(engine, log=log.append) == []
+    assert log == []
+    assert indexes(engine) == before
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql("SELECT version FROM schema_migrations ORDER BY 1;").all()
+    assert [v for (v,) in rows] == [m.version for m in migrations.MIGRATIONS]
+
+
+def test_old_schema_is_brought_up_to_date(A, tmp_path):
+    engine = fresh_engine(A, tmp_path / "antigo.db")
+    with engine.begin() as conn:  # schema de antes das migrações
+        for name in COVER_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX {name};")
+        conn.exec_driver_sql("ALTER TABLE orders DROP COLUMN owner_cnpj;")
+    assert "owner_cnpj" not in {c["name"] for c in inspect(engine).get_columns("orders")}
+    assert not COVER_INDEXES & indexes(engine)
+
+    assert migrations.run_migrations(engine, log=lambda msg: None) == \
+        [m.version for m in migrations.MIGRATIONS]
+    assert "owner_cnpj" in {c["name"] for c in inspect(engine).get_columns("orders")}
+    assert COVER_INDEXES <= indexes(engine)
+    assert failed_checks(engine) == []
+
+
+def test_app_db_plans_use_the_covering_indexes(A):
+    with A.app.app_context():
+        assert failed_checks(A.db.engine) == []
@@ -0,0 +1,168 @@
+"""Retenção: arquivo NDJSON gzip fiel, remoção em lotes, rollups após o rebuild e horizonte mínimo."""
+import glob, gzip, json, sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import bindparam, text
+
+import retention
+
+CNPJ = "12345678000190"
+
+
+@pytest.fixture
+def archive_dir(A, tmp_path, monkeypatch):
+    monkeypatch.setattr(A, "RETENTION_ARCHIVE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def order(when, email, qty=1, cnpj=CNPJ):
+    return {"customer_email": email, "channel_id": 1 + qty % 3, "location_id": 1 + qty % 2,
+            "cnpj": cnpj, "ordered_at": when,
+            "items": [{"item_id": 1, "qty": qty}, {"item_id": 3, "qty": 1}]}
+
+
+def archived(archive_dir):
+    lines = []
+    for path in sorted(glob.glob(str(archive_dir / "orders-main-*.ndjson.gz"))):
+        with gzip.open(path, "rt", encoding="utf-8") as fh:
+            lines += [json.loads(line) for line in fh]
+    return lines
+
+
+def raw_orders(A, where, params):
+    """Pedidos e itens no formato do arquivo de retenção, por id."""
+    with A.app.app_context():
+        s = A.db.session
+        rows = s.execute(text(
+            "SELECT id, customer_email, channel_id, location_id, ordered_at, total, owner_cnpj "
+            f"FROM orders WHERE {where} ORDER BY ordered_at, id"), params).all()
+        out = {}
+        for oid, email, ch, loc, ts, total, cnpj in rows:
+            items = s.execute(text("SELECT item_id, qty, unit_price FROM order_items "
+                                   "WHERE order_id = :o ORDER BY id"), {"o": oid}).all()
+            out[oid] = {"id": oid, "customer_email": email, "channel_id": ch, "location_id": loc,
+                        "ordered_at": ts, "total": total, "cnpj": cnpj,
+                        "items": [{"item_id": i, "qty": q, "unit_price": p} for i, q, p in items]}
+    return out
+
+
+def test_archive_round_trips_the_pruned_orders(A, write_orders, archive_dir):
+    now = datetime.now(timezone.utc)
+    ids = write_orders([order(now - timedelta(days=40 + d, hours=h), f"velho{h}@exemplo.com",
+                              qty=1 + h)
+                        for d in range(3) for h in (1, 7)])
+    cutoff = A.seedgen.db_timestamp(A.retention_cutoff(31))
+    expected = raw_orders(A, "ordered_at < :c", {"c": cutoff})
+    assert set(ids) <= expected.keys()
+
+    report = A.run_retention(days=31, log=lambda msg: None)["main"]
+    assert report["pedidos"] == len(expected)
+    assert report["itens"] == sum(len(o["items"]) for o in expected.values())
+    assert raw_orders(A, "ordered_at < :c", {"c": cutoff}) == {}
+
+    lines = archived(archive_dir)
+    assert [o["id"] for o in lines] == list(expected)  # mais antigos primeiro
+    assert lines == list(expected.values())
+    with A.app.app_context():
+        last = A.db.session.query(A.RetentionRun).order_by(A.RetentionRun.id.desc()).first()
+        assert last.orders == len(expected) and last.archive == report["arquivo"]
+
+    # as linhas voltam pelo mesmo validador de POST /orders/batch
+    with A.app.app_context():
+        snap = A.dims.snapshot()
+        for o in lines:
+            back = A.ingest.validate_order(dict(o), snap, allowed_cnpjs={o["cnpj"]})
+            assert back is not None
+
+
+def test_orders_leave_in_batches_each_in_its_own_transaction(A, write_orders, archive_dir,
+                                                             monkeypatch):
+    now = datetime.now(timezone.utc)
+    write_orders([order(now - timedelta(days=50, minutes=7 * i), f"lote{i % 3}@exemplo.com")
+                  for i in range(11)])
+    cutoff = A.seedgen.db_timestamp(A.retention_cutoff(31))
+    with A.app.app_context():
+        total = A.db.session.execute(text("SELECT count(*) FROM orders WHERE ordered_at < :c"),
+                                     {"c": cutoff}).scalar()
+    assert total >= 11
+
+    batches, left = [], []
+    archive_batch = retention.archive_batch
+
+    def spy(conn, cut, limit, gz, raw):
+        n, m = archive_batch(conn, cut, limit, gz, raw)
+        batches.append(n)
+        # outra conexão já enxerga o lote removido: cada lote é um commit
+        with sqlite3.connect(A.db_path) as other:
+            left.append(retention.pending(other, cut))
+        return n, m
+
+    monkeypatch.setattr(retention, "archive_batch", spy)
+    logs = []
+    report = A.run_retention(days=31, batch=4, log=logs.append)["main"]
+
+    full, rest = divmod(total, 4)
+    assert batches == [4] * full + ([rest] if rest else []) + [0]
+    assert left == [total - sum(batches[:i + 1]) for i in range(len(batches))]
+    assert report["pedidos"] == total
+    assert sum("pedidos arquivados" in msg for msg in logs) == len(batches) - 1
+    assert len(archived(archive_dir)) == total
+
+
+def test_rollups_keep_the_pruned_orders_after_a_rebuild(A, write_orders, archive_dir):
+    now = datetime.now(timezone.utc)
+    email = "arquivado@exemplo.com"
+    old = [now - timedelta(days=45, hours=h) for h in (3, 9)]
+    write_orders([order(when, email, qty=2) for when in old]
+                 + [order(now - timedelta(hours=3), email, qty=1)])
+
+    def snapshot():
+        with A.app.app_context():
+            s = A.db.session
+            customer = s.execute(text(
+                "SELECT first_order_at, last_order_at, order_count, round(total_spent, 4) "
+                "FROM customer_activity WHERE owner_cnpj = :c AND customer_email = :e"),
+                {"c": CNPJ, "e": email}).one()
+            hourly = s.execute(text(
+                "SELECT bucket, channel_id, location_id, orders, round(revenue, 4), items_qty "
+                "FROM orders_hourly WHERE owner_cnpj = :c AND bucket < :b ORDER BY 1, 2, 3"),
+                {"c": CNPJ, "b": A.hour_bucket(now - timedelta(days=31))}).all()
+            items = s.execute(text(
+                "SELECT day, item_id, qty FROM item_sales_daily "
+                "WHERE owner_cnpj = :c AND day < :d ORDER BY 1, 2"),
+                {"c": CNPJ, "d": (now - timedelta(days=31)).strftime("%Y-%m-%d")}).all()
+        return tuple(customer), hourly, items
+
+    before = snapshot()
+    assert before[0][2] >= 3 and before[1] and before[2]
+    A.run_retention(days=31, log=lambda msg: None)
+    with A.app.app_context():
+        assert A.db.session.execute(text("SELECT count(*) FROM orders WHERE customer_email = :e"),
+                                    {"e": email}).scalar() == 1
+        A.rebuild_orders_hourly()
+        A.rebuild_item_sales_daily()
+        A.rebuild_customer_activity()
+    # o cliente segue com os pedidos arquivados (archived_customers) e os baldes antigos ficam
+    assert snapshot() == before
+
+
+def test_horizon_never_goes_below_the_minimum(A, write_orders, archive_dir):
+    now = datetime.now(timezone.utc)
+    recent = write_orders([order(now - timedelta(days=d), f"recente{d}@exemplo.com")
+                           for d in (6, 20, A.RETENTION_MIN_DAYS - 1)])
+    old = write_orders([order(now - timedelta(days=A.RETENTION_MIN_DAYS + 2),
+                              "antigo@exemplo.com")])
+
+    dry = A.run_retention(days=5, dry_run=True, log=lambda msg: None)["main"]
+    assert dry["cutoff"] == A.seedgen.db_timestamp(A.retention_cutoff(A.RETENTION_MIN_DAYS))
+    assert "pedidos" not in dry
+
+    report = A.run_retention(days=5, log=lambda msg: None)["main"]
+    assert report["cutoff"] == dry["cutoff"] and report["pedidos"] == dry["pendentes"]
+    assert [o["id"] for o in archived(archive_dir)] == old
+    with A.app.app_context():
+        kept = A.db.session.execute(text("SELECT id FROM orders WHERE id IN :ids")
+                                    .bindparams(bindparam("ids", expanding=True)),
+                                    {"ids": recent}).scalars().all()
+    assert sorted(kept) == sorted(recent)
@@ -0,0 +1,89 @@
+"""RFM: top-k igual à ordenação completa, pesos normalizados e paginação de /insights/rfm."""
+import math
+
+import numpy as np
+import pytest
+
+import rfm
+
+CNPJ = "12345678000190"
+
+
+def full_sort(score, tiebreak=None):
+    if tiebreak is None:
+        return np.argsort(-score, kind="stable")
+    return np.lexsort((tiebreak, -score))
+
+
+@pytest.mark.parametrize("k", [1, 2, 17, 199, 200, 250])
+def test_top_k_matches_a_full_sort(k):
+    rng = np.random.default_rng(k)
+    score = rng.integers(0, 40, size=200) / 8  # muitos empates, inclusive na fronteira do k
+    emails = np.array([f"c{i:03d}@exemplo.com" for i in rng.permutation(200)])
+    assert rfm.top_k(score, k, emails).tolist() == full_sort(score, emails)[:k].tolist()
+    assert rfm.top_k(score, k).tolist() == full_sort(score)[:k].tolist()
+
+
+def test_top_k_edge_cases():
+    assert rfm.top_k(np.array([]), 5).size == 0
+    assert rfm.top_k(np.array([0.3, 0.1]), 0).size == 0
+
+
+def test_weights_are_rescaled_to_sum_one():
+    assert rfm.normalize_weights((2, 2, 1)).tolist() == pytest.approx([0.4, 0.4, 0.2])
+    assert rfm.normalize_weights((0, 0, 3)).tolist() == [0.0, 0.0, 1.0]
+    for bad in ((0, 0, 0), (1, -1, 1), (1, math.nan, 1), (1, math.inf, 1), (1, 1),
+                (1e308, 1e308, 1e308)):
+        with pytest.raises(ValueError):
+            rfm.normalize_weights(bad)
+
+    rng = np.random.default_rng(3)
+    f, m, r = rng.integers(1, 9, 50), rng.random(50) * 300, rng.integers(0, 30, 50)
+    s = rfm.scores(f, m, r, (0.5, 0.3, 0.2))
+    assert rfm.scores(f, m, r, (5, 3, 2)) == pytest.approx(s)
+    assert s.min() >= 0 and s.max() <= 1
+
+
+def get_rfm(client, token, **params):
+    query = "&".join(f"{k}={v}" for k, v in params.items())
+    resp = client.get(f"/insights/rfm?{query}", headers={"Authorization": f"Bearer {token}"})
+    return resp.status_code, resp.get_json()
+
+
+def test_rfm_pages_follow_the_full_ranking(A, client, admin_token):
+    status, full = get_rfm(client, admin_token, cnpj=CNPJ, days=7, page_size=200)
+    assert status == 200
+    total, ranked = full["total"], full["items"]
+    assert 7 < total <= 200 and len(ranked) == total
+    scores = [r["score"] for r in ranked]
+    assert scores == sorted(scores, reverse=True)
+
+    pages, page = [], 1
+    while True:
+        status, out = get_rfm(client, admin_token, cnpj=CNPJ, days=7, page_size=7, page=page)
+        assert status == 200 and out["total"] == total
+        if not out["items"]:
+            break
+        assert len(out["items"]) == min(7, total - 7 * (page - 1))
+        pages += out["items"]
+        page += 1
+    assert page == math.ceil(total / 7) + 1
+    assert pages == ranked
+
+
+def test_rfm_scope_and_weights(A, client, admin_token, cliente_token):
+    status, own = get_rfm(client, cliente_token(CNPJ), cnpj="22222222000192", days=7,
+                          page_size=200)
+    assert status == 200 and own["cnpj"] == CNPJ  # cliente não escolhe outro CNPJ
+    assert own["items"] == get_rfm(client, admin_token, cnpj=CNPJ, days=7, page_size=200)[1]["items"]
+
+    _, scaled = get_rfm(client, admin_token, cnpj=CNPJ, days=7, page_size=200, wf=2, wm=2, wr=1)
+    assert scaled["weights"] == {"f": 0.4, "m": 0.4, "r": 0.2}
+    assert scaled["items"] == own["items"]
+
+    _, recency = get_rfm(client, admin_token, cnpj=CNPJ, days=7, page_size=200, wf=0, wm=0, wr=1)
+    ages = [r["recencia_dias"] for r in recency["items"]]
+    assert ages == sorted(ages)
+
+    assert get_rfm(client, admin_token, wf=-1)[0] == 400
+    assert get_rfm(client, admin_token, wf=0, wm=0, wr=0)[0] == 400
@@ -0,0 +1,236 @@
+"""Rollups mantidos na escrita batem com o GROUP BY sobre os pedidos brutos."""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+RAW_HOURLY = """
+    SELECT strftime('%Y-%m-%d %H:00', o.ordered_at), o.channel_id, o.location_id,
+           COALESCE(o.owner_cnpj, ''), COUNT(*), SUM(o.total), COALESCE(SUM(i.qty), 0)
+    FROM orders o
+    LEFT JOIN (SELECT order_id, SUM(qty) AS qty FROM order_items GROUP BY order_id) i
+           ON i.order_id = o.id
+    WHERE o.ordered_at >= :cut
+    GROUP BY 1, 2, 3, 4
+"""
+
+RAW_ITEMS = """
+    SELECT strftime('%Y-%m-%d', o.ordered_at), o.channel_id, o.location_id,
+           COALESCE(o.owner_cnpj, ''), i.item_id, SUM(i.qty), SUM(i.qty * i.unit_price)
+    FROM order_items i
+    JOIN orders o ON o.id = i.order_id
+    WHERE o.ordered_at >= :cut
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+RAW_CUSTOMERS = """
+    SELECT owner_cnpj, customer_email, MIN(first_at), MAX(last_at), SUM(n), SUM(spent)
+    FROM (SELECT COALESCE(owner_cnpj, '') AS owner_cnpj, customer_email,
+                 MIN(ordered_at) AS first_at, MAX(ordered_at) AS last_at,
+                 COUNT(*) AS n, SUM(total) AS spent
+          FROM orders GROUP BY 1, 2
+          UNION ALL
+          SELECT owner_cnpj, customer_email, first_order_at, last_order_at, order_count, total_spent
+          FROM archived_customers)
+    GROUP BY 1, 2
+"""
+
+
+def rows_by_key(rows, width):
+    """{chave (primeiras `width` colunas): demais colunas, receitas arredondadas}."""
+    return {tuple(r[:width]): tuple(round(v, 4) if isinstance(v, float) else v for v in r[width:])
+            for r in rows}
+
+
+def hourly_mismatches(A):
+    with A.app.app_context():
+        s = A.db.session
+        cut = A.archived_before(s)
+        raw = rows_by_key(s.execute(text(RAW_HOURLY), {"cut": cut}).all(), 4)
+        rollup = rows_by_key(s.execute(text(
+            "SELECT bucket, channel_id, location_id, owner_cnpj, orders, revenue, items_qty "
+            "FROM orders_hourly WHERE bucket >= :b"), {"b": cut[:13]}).all(), 4)
+    return {k: (raw.get(k), rollup.get(k)) for k in raw.keys() | rollup.keys()
+            if raw.get(k) != rollup.get(k)}
+
+
+def item_mismatches(A):
+    with A.app.app_context():
+        s = A.db.session
+        cut = A.archived_before(s)
+        raw = rows_by_key(s.execute(text(RAW_ITEMS), {"cut": cut}).all(), 5)
+        rollup = rows_by_key(s.execute(text(
+            "SELECT day, channel_id, location_id, owner_cnpj, item_id, qty, revenue "
+            "FROM item_sales_daily WHERE day >= :d"), {"d": cut[:10]}).all(), 5)
+    return {k: (raw.get(k), rollup.get(k)) for k in raw.keys() | rollup.keys()
+            if raw.get(k) != rollup.get(k)}
+
+
+def rollup_tables(A):
+    with A.app.app_context():
+        s = A.db.session
+        return {
+            "orders_hourly": rows_by_key(s.execute(text(
+                "SELECT bucket, channel_id, location_id, owner_cnpj, orders, revenue, items_qty "
+                "FROM orders_hourly")).all(), 4),
+            "item_sales_daily": rows_by_key(s.execute(text(
+                "SELECT day, channel_id, location_id, owner_cnpj, item_id, qty, revenue "
+                "FROM item_sales_daily")).all(), 5),
+            "customer_activity": rows_by_key(s.execute(text(
+                "SELECT owner_cnpj, customer_email, first_order_at, last_order_at, order_count, "
+                "total_spent FROM customer_activity")).all(), 2),
+        }
+
+
+def customer_mismatches(A):
+    with A.app.app_context():
+        s = A.db.session
+        raw = rows_by_key(s.execute(text(RAW_CUSTOMERS)).all(), 2)
+        rollup = rows_by_key(s.execute(text(
+            "SELECT owner_cnpj, customer_email, first_order_at, last_order_at, order_count, "
+            "total_spent FROM customer_activity")).all(), 2)
+    return {k: (raw.get(k), rollup.get(k)) for k in raw.keys() | rollup.keys()
+            if raw.get(k) != rollup.get(k)}
+
+
+def order(when, channel_id=2, location_id=1, total=None, qty=1, email="rollup@exemplo.com",
+          cnpj=None):
+    o = {"customer_email": email, "channel_id": channel_id, "location_id": location_id,
+         "ordered_at": when, "items": [{"item_id": 3, "qty": qty}]}
+    if total is not None:
+        o["total"] = total
+    if cnpj:
+        o["cnpj"] = cnpj
+    return o
+
+
+def test_orders_hourly_matches_raw_after_seed(A):
+    with A.app.app_context():
+        assert A.db.session.query(A.OrderHourly).count() > 0
+    assert hourly_mismatches(A) == {}
+
+
+def test_orders_hourly_follows_write_order_batch(A, write_orders):
+    now = datetime.now(timezone.utc)
+    write_orders([order(now - timedelta(hours=h, minutes=m), channel_id=1 + h % 4,
+                        location_id=1 + m % 4, qty=1 + h % 3, total=10.5 + h,
+                        cnpj="12345678000190" if h % 2 else None)
+                  for h in range(0, 30, 3) for m in (1, 17, 44)])
+    write_orders([order(now - timedelta(hours=3, minutes=17), channel_id=1, location_id=2)])
+    assert hourly_mismatches(A) == {}
+
+
+def test_partial_first_hour_counts_only_orders_after_dt_from(A, write_orders):
+    hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=5)
+    dt_from = hour + timedelta(minutes=25)
+    write_orders([order(hour + timedelta(minutes=10), total=7.0),       # antes do recorte
+                  order(hour + timedelta(minutes=40), total=11.0),
+                  order(hour + timedelta(minutes=50), channel_id=3, total=13.0)])
+    base = {"period": "24h", "dt_from": dt_from, "channel_id": None, "location_id": None,
+            "cnpj": None}
+
+    with A.app.app_context():
+        for f in (base, {**base, "channel_id": 3}, {**base, "cnpj": "12345678000190"}):
+            where = ["ordered_at >= :d"]
+            params = {"d": A.seedgen.db_timestamp(dt_from)}
+            if f["channel_id"]:
+                where.append("channel_id = :c"); params["c"] = f["channel_id"]
+            if f["cnpj"]:
+                where.append("owner_cnpj = :cnpj"); params["cnpj"] = f["cnpj"]
+            raw = A.db.session.execute(text(
+                "SELECT strftime('%Y-%m-%d %H:00', ordered_at), channel_id, COUNT(*), SUM(total) "
+                f"FROM orders WHERE {' AND '.join(where)} GROUP BY 1, 2"), params).all()
+
+            served = A.hourly_rows(f)
+            assert rows_by_key(served, 2) == rows_by_key(raw, 2)
+            orders, revenue = A.rollup_totals(f)
+            assert orders == sum(r[2] for r in raw)
+            assert revenue == pytest.approx(sum(r[3] for r in raw))
+            assert A.compute_kpis(f)["pedidos"] == orders
+
+        head = {r[1]: r[2] for r in A.hourly_rows(base) if r[0] == A.hour_bucket(dt_from)}
+        assert head[2] >= 1 and head[3] >= 1
+
+
+def test_customer_activity_matches_raw_after_seed(A):
+    with A.app.app_context():
+        assert A.db.session.query(A.CustomerActivity).count() > 0
+    assert customer_mismatches(A) == {}
+
+
+def test_customer_activity_follows_write_order_batch(A, write_orders):
+    cnpj = "11111111000191"
+    with A.app.app_context():
+        known = (A.db.session.query(A.CustomerActivity)
+                 .filter_by(owner_cnpj=cnpj).order_by(A.CustomerActivity.customer_email).first())
+        email, first_at = known.customer_email, known.first_order_at
+    now = datetime.now(timezone.utc)
+    write_orders([
+        order(now - timedelta(days=20), email=email, cnpj=cnpj, total=30.0),  # antecipa o 1º
+        order(now - timedelta(minutes=3), email=email, cnpj=cnpj),
+        order(now - timedelta(hours=2), email=email, cnpj="12345678000190"),  # outro CNPJ
+        order(now - timedelta(hours=1), email="nova.cliente@exemplo.com", cnpj=cnpj),
+        order(now - timedelta(hours=1, minutes=5), email="nova.cliente@exemplo.com", cnpj=cnpj),
+    ])
+    assert customer_mismatches(A) == {}
+    with A.app.app_context():
+        row = A.db.session.get(A.CustomerActivity, (cnpj, email))
+        assert row.first_order_at < first_at
+        assert A.db.session.get(A.CustomerActivity, (cnpj, "nova.cliente@exemplo.com")).order_count == 2
+
+
+def test_item_sales_daily_matches_raw_after_seed(A):
+    with A.app.app_context():
+        assert A.db.session.query(A.ItemSalesDaily).count() > 0
+    assert item_mismatches(A) == {}
+
+
+def test_item_sales_daily_follows_write_order_batch(A, write_orders):
+    now = datetime.now(timezone.utc)
+    orders = [order(now - timedelta(days=d, hours=h), channel_id=1 + d % 4, qty=1 + h,
+                    cnpj="22222222000192" if d % 2 else None)
+              for d in range(3) for h in range(3)]
+    orders.append({**order(now - timedelta(hours=1)),
+                   "items": [{"item_id": 1, "qty": 2, "unit_price": 15.5},
+                             {"item_id": 3, "qty": 1}, {"item_id": 1, "qty": 1}]})
+    write_orders(orders)
+    assert item_mismatches(A) == {}
+
+
+def test_rollups_survive_retention_and_rebuild(A, write_orders, tmp_path, monkeypatch):
+    monkeypatch.setattr(A, "RETENTION_ARCHIVE_DIR", str(tmp_path))
+    now = datetime.now(timezone.utc)
+    cnpj = "12345678000190"
+    write_orders([order(now - timedelta(days=d, hours=h), email=f"antigo{d % 3}@exemplo.com",
+                        channel_id=1 + h % 4, qty=1 + d % 2, cnpj=cnpj if h % 2 else None)
+                  for d in (33, 40, 47) for h in range(0, 24, 5)]
+                 + [order(now - timedelta(hours=2), email="antigo0@exemplo.com")])
+    before = rollup_tables(A)
+
+    report = A.run_retention(days=31, log=lambda msg: None)["main"]
+    assert report["pedidos"] == 15
+    with A.app.app_context():
+        assert A.archived_before(A.db.session).endswith(" 00:00:00.000000")
+    # os rollups já tinham os pedidos arquivados: nada muda na retenção nem no rebuild
+    assert rollup_tables(A) == before
+    with A.app.app_context():
+        A.rebuild_orders_hourly()
+        A.rebuild_item_sales_daily()
+        A.rebuild_customer_activity()
+    assert rollup_tables(A) == before
+    assert hourly_mismatches(A) == {} and item_mismatches(A) == {}
+    assert customer_mismatches(A) == {}
+
+
+def test_rebuild_rejects_a_cutoff_inside_a_bucket(A):
+    engine = create_engine("sqlite://")
+    A.RetentionRun.__table__.create(engine)
+    with Session(engine) as s:
+        s.add(A.RetentionRun(ran_at=datetime(2025, 3, 2), cutoff=datetime(2025, 1, 31)))
+        s.commit()
+        assert A.archived_before(s) == "2025-01-31 00:00:00.000000"
+        s.add(A.RetentionRun(ran_at=datetime(2025, 3, 3), cutoff=datetime(2025, 2, 1, 12, 30)))
+        s.commit()
+        with pytest.raises(ValueError, match="meia-noite"):
+            A.archived_before(s)
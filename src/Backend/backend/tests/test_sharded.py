@@ -0,0 +1,100 @@
+"""Modo sharded: consultas sem escopo juntam os shards como se fossem um banco só."""
+import csv, io, json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from shards import ShardRouter
+
+CNPJS = ("12345678000190", "22222222000192")
+CHANNELS = ("iFood", "Balcão", "WhatsApp")
+
+
+@pytest.fixture
+def sharded(A, tmp_path, monkeypatch):
+    """Liga o modo sharded do app com shards vazios em `tmp_path`."""
+    router = ShardRouter(tmp_path / "shards", A.shards.tables, configure=A.apply_sqlite_pragmas,
+                         on_create=A.shards.on_create, workers=2)
+    monkeypatch.setattr(A, "SHARDED", True)
+    monkeypatch.setattr(A, "shards", router)
+    A.response_cache.clear()
+    yield router
+    A.response_cache.clear()
+    router.drop_all()
+
+
+def seed_shard(client, token, cnpj, n):
+    now = datetime.now(timezone.utc)
+    orders = [{"customer_email": f"c{i % 7}@{cnpj}.com", "channel": CHANNELS[i % 3],
+               "location": "SP" if i % 2 else "RJ",
+               "ordered_at": (now - timedelta(minutes=37 * i + 5)).isoformat(timespec="seconds"),
+               "items": [{"item": "Tiramisu", "qty": 1 + i % 3}, {"item": "Espresso"}]}
+              for i in range(n)]
+    resp = client.post("/orders/batch", data="\n".join(map(json.dumps, orders)),
+                       headers={"Authorization": f"Bearer {token}"},
+                       content_type="application/x-ndjson")
+    assert resp.status_code == 200 and resp.get_json()["accepted"] == n
+
+
+def get(client, token, path):
+    resp = client.get(path, headers={"Authorization": f"Bearer {token}"})
+    assert resp.status_code == 200
+    return resp
+
+
+def csv_rows(resp):
+    return list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+
+
+def test_unscoped_reads_merge_the_shards(A, client, sharded, admin_token, cliente_token):
+    tokens = {cnpj: cliente_token(cnpj) for cnpj in CNPJS}
+    for cnpj, n in zip(CNPJS, (23, 31)):
+        seed_shard(client, tokens[cnpj], cnpj, n)
+    assert sharded.keys() == sorted(CNPJS)
+
+    total = get(client, admin_token, "/metrics?period=24h").get_json()
+    parts = [get(client, tokens[c], "/metrics?period=24h").get_json() for c in CNPJS]
+    assert [p["kpis"]["pedidos"] for p in parts] == [23, 31]
+    for k in ("pedidos", "clientesAtivos"):
+        assert total["kpis"][k] == sum(p["kpis"][k] for p in parts)
+    assert total["kpis"]["totalVendas"] == pytest.approx(sum(p["kpis"]["totalVendas"] for p in parts))
+    assert [h["pedidos"] for h in total["serie"]] == \
+        [sum(hs) for hs in zip(*([h["pedidos"] for h in p["serie"]] for p in parts))]
+
+    merged = csv_rows(get(client, admin_token, "/export/csv?period=24h"))
+    per_shard = [csv_rows(get(client, tokens[c], "/export/csv?period=24h")) for c in CNPJS]
+    assert len(merged) == 23 + 31
+    assert sorted(map(tuple, (r.values() for r in merged))) == \
+        sorted(tuple(r.values()) for rows in per_shard for r in rows)
+    stamps = [r["data"] for r in merged]
+    assert stamps == sorted(stamps, reverse=True)
+
+
+def test_order_ids_are_unique_across_shards(A, client, sharded, admin_token, cliente_token):
+    tokens = {cnpj: cliente_token(cnpj) for cnpj in CNPJS}
+    for cnpj, n in zip(CNPJS, (23, 31)):
+        seed_shard(client, tokens[cnpj], cnpj, n)
+    with A.app.app_context():
+        before = A.data_watermark()
+    seed_shard(client, tokens[CNPJS[0]], CNPJS[0], 2)
+
+    merged = csv_rows(get(client, admin_token, "/export/csv?period=24h"))
+    ids = [int(r["order_id"]) for r in merged]
+    assert len(ids) == 23 + 31 + 2 and len(set(ids)) == len(ids)
+    per_shard = [{int(r["order_id"]) for r in csv_rows(get(client, tokens[c], "/export/csv?period=24h"))}
+                 for c in CNPJS]
+    assert not per_shard[0] & per_shard[1]
+    with A.app.app_context():
+        after = A.data_watermark()
+        assert after[0][0] > before[0][0] and after[0][1] == before[0][1]
+        assert max(after[0]) == max(ids)
+        # cada pedido continua com os seus itens no próprio shard
+        for key in sharded.keys():
+            s = sharded.session(key)
+            assert s.execute(A.text("SELECT count(*) FROM order_items i LEFT JOIN orders o "
+                                    "ON o.id = i.order_id WHERE o.id IS NULL")).scalar() == 0
+
+        # sem sequência (ex.: depois de split-shards) a reserva parte do maior id dos shards
+        A.db.session.execute(A.text("DELETE FROM id_blocks WHERE name = 'orders'"))
+        assert A.reserve_order_ids(3).tolist() == [max(ids) + 1, max(ids) + 2, max(ids) + 3]
+        A.db.session.rollback()
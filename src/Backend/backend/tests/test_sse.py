@@ -0,0 +1,121 @@
+"""Hub de SSE: um cálculo por tópico para N assinantes, descarte do lento e ticket de uso único."""
+import asyncio, json, threading
+
+import pytest
+
+from sse import BroadcastHub, sse_message
+
+CNPJ = "22222222000192"
+
+
+class Producer:
+    """produce() de teste: registra os tópicos pedidos a cada tick."""
+
+    def __init__(self, publish=True):
+        self.calls = []
+        self.publish = publish
+        self.lock = threading.Lock()
+
+    def __call__(self, topics):
+        with self.lock:
+            self.calls.append(list(topics))
+            n = len(self.calls)
+        return {t: sse_message({"topic": t, "tick": n}) for t in topics} if self.publish else {}
+
+
+def next_tick(sub, after):
+    """Primeira mensagem do assinante produzida depois do tick `after`."""
+    while True:
+        msg = sub.get(timeout=5)
+        assert msg is not None
+        if json.loads(msg[len("data: "):])["tick"] > after:
+            return msg
+
+
+def test_one_computation_per_topic_fans_out_to_every_subscriber():
+    produce = Producer()
+    hub = BroadcastHub(produce, tick=3600, queue_size=8, name="test-hub")
+    subs = {"24h": [hub.subscribe("24h") for _ in range(3)], "7d": [hub.subscribe("7d")]}
+    for group in subs.values():
+        for sub in group:
+            next_tick(sub, 0)  # primeira mensagem: tick disparado pela assinatura ou a última
+
+    with produce.lock:
+        done = len(produce.calls)
+    hub._wake.set()  # próximo tick sem esperar os 3600 s
+    got = {topic: {next_tick(sub, done) for sub in group} for topic, group in subs.items()}
+
+    assert got == {t: {sse_message({"topic": t, "tick": done + 1})} for t in subs}
+    assert sorted(produce.calls[done]) == ["24h", "7d"]  # 4 assinantes, 2 cálculos
+    assert all(len(set(call)) == len(call) for call in produce.calls)
+    assert hub.stats()["subscribers"] == 4 and hub.stats()["topics"] == 2
+
+    for group in subs.values():
+        for sub in group:
+            hub.unsubscribe(sub)
+    assert hub.stats()["topics"] == 0
+
+
+def test_slow_subscriber_is_dropped_without_holding_the_others():
+    hub = BroadcastHub(Producer(publish=False), tick=3600, queue_size=2, name="test-hub")
+    slow, fast = hub.subscribe("24h"), hub.subscribe("24h")
+    received = []
+    for i in range(5):
+        hub.publish("24h", f"m{i}")
+        received.append(fast.get(timeout=1))
+
+    assert received == [f"m{i}" for i in range(5)]
+    assert slow.dropped and not fast.dropped
+    assert [slow.get(timeout=0) for _ in range(3)] == ["m0", "m1", None]  # nada depois da fila cheia
+    assert hub.dropped == 1
+    assert hub.stats()["subscribers"] == 1
+
+    late = hub.subscribe("24h")  # quem chega depois recebe a última mensagem
+    assert late.get(timeout=1) == "m4"
+
+
+def ticket(client, token):
+    resp = client.post("/stream/ticket", headers={"Authorization": f"Bearer {token}"})
+    assert resp.status_code == 200
+    return resp.get_json()["ticket"]
+
+
+def test_stream_ticket_is_single_use_and_carries_the_scope(A, client, cliente_token, admin_token):
+    t = ticket(client, cliente_token(CNPJ))
+    with A.app.app_context():
+        assert A.stream_topic("7d", None, None, t) == ("7d", None, None, CNPJ, False)
+        assert A.stream_topic("7d", None, None, t) is None
+    resp = client.get(f"/stream/kpis?ticket={t}")
+    assert resp.status_code == 401
+
+    with A.app.app_context():
+        assert A.stream_topic("30d", "iFood", None, ticket(client, admin_token)) == \
+            ("30d", A.dims.channel_id("iFood"), None, None, True)
+        assert A.stream_topic("24h", None, None, t[:-2] + "xx") is None
+
+
+def test_expired_ticket_is_rejected(A, client, cliente_token, monkeypatch):
+    t = ticket(client, cliente_token(CNPJ))
+    monkeypatch.setattr(A, "SSE_TICKET_SECONDS", -1)
+    assert client.get(f"/stream/kpis?ticket={t}").status_code == 401
+
+
+def test_asgi_stream_rejects_a_used_ticket(A, client, cliente_token):
+    pytest.importorskip("asgiref")
+    import asgi
+
+    t = ticket(client, cliente_token(CNPJ))
+    with A.app.app_context():
+        assert A.stream_topic("24h", None, None, t) is not None
+    sent = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(msg):
+        sent.append(msg)
+
+    scope = {"type": "http", "method": "GET", "path": "/stream/kpis",
+             "query_string": f"ticket={t}".encode()}
+    asyncio.run(asgi.app(scope, receive, send))
+    assert sent[0]["status"] == 401
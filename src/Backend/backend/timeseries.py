@@ -0,0 +1,69 @@
+"""Séries temporais com eixo completo (sem buracos), montadas com NumPy.
+
+Os baldes vêm do rollup como texto "YYYY-MM-DD HH:00" (UTC). O eixo vai do
+primeiro balde do período até max(hora atual, último balde com dado) e as
+horas/dias sem pedidos entram com zero, então todo gráfico tem espaçamento
+uniforme. As funções devolvem arrays NumPy; `.tolist()` já sai pronto para JSON.
+
+Granularidades: "hour" (datetime64[h]) e "day" (datetime64[D]).
+"""
+import numpy as np
+
+UNITS = {"hour": "h", "day": "D"}
+
+def to_datetime64(buckets, granularity="hour"):
+    """Textos de balde -> datetime64 truncado na granularidade."""
+    return np.asarray(buckets, dtype="datetime64[h]").astype(f"datetime64[{UNITS[granularity]}]")
+
+def bucket_axis(start, end, granularity="hour"):
+    """Todos os baldes de `start` a `end` (inclusive)."""
+    unit = UNITS[granularity]
+    start = np.datetime64(start, unit)
+    end = np.datetime64(end, unit)
+    if end < start:
+        return np.empty(0, dtype=f"datetime64[{unit}]")
+    return np.arange(start, end + 1, dtype=f"datetime64[{unit}]")
+
+def _axis_for(bucket_arr, start, now, granularity):
+    end = np.datetime64(now, UNITS[granularity])
+    if bucket_arr.size:
+        end = max(end, bucket_arr.max())
+    return bucket_axis(start, end, granularity)
+
+def fill_series(buckets, values, start, now, granularity="hour"):
+    """(eixo, valores) com zeros nos baldes vazios; baldes repetidos são somados."""
+    b = to_datetime64(buckets, granularity)
+    axis = _axis_for(b, start, now, granularity)
+    out = np.zeros(axis.size, dtype=np.float64)
+    if b.size:
+        pos = (b - axis[0]).astype(np.int64)
+        keep = (pos >= 0) & (pos < axis.size)
+        np.add.at(out, pos[keep], np.asarray(values, dtype=np.float64)[keep])
+    return axis, out
+
+def fill_matrix(buckets, keys, values, key_order, start, now, granularity="hour"):
+    """(eixo, matriz len(key_order) x len(eixo)) para séries empilhadas (ex.: por canal).
+
+    Chaves fora de `key_order` são ignoradas.
+    """
+    b = to_datetime64(buckets, granularity)
+    axis = _axis_for(b, start, now, granularity)
+    out = np.zeros((len(key_order), axis.size), dtype=np.float64)
+    if b.size:
+        index = {k: i for i, k in enumerate(key_order)}
+        row = np.fromiter((index.get(k, -1) for k in keys), dtype=np.int64, count=b.size)
+        col = (b - axis[0]).astype(np.int64)
+        keep = (row >= 0) & (col >= 0) & (col < axis.size)
+        np.add.at(out, (row[keep], col[keep]), np.asarray(values, dtype=np.float64)[keep])
+    return axis, out
+
+def labels(axis, style):
+    """Rótulos do eixo: "bucket" (YYYY-MM-DD HH:00), "hour" (HH) ou "day" (dd/mm)."""
+    s = np.datetime_as_string(axis.astype("datetime64[m]"), unit="m").tolist()  # YYYY-MM-DDTHH:MM
+    if style == "bucket":
+        return [x.replace("T", " ") for x in s]
+    if style == "hour":
+        return [x[11:13] for x in s]
+    if style == "day":
+        return [x[8:10] + "/" + x[5:7] for x in s]
+    raise ValueError(f"estilo de rótulo desconhecido: {style}")
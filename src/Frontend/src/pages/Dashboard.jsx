@@ -63,20 +63,54 @@ export default function Dashboard() {
       const { data: f } = await api.get("/filters/options");
       setOpts(f);
       await refreshAll("7d", "", "");
-      await refreshStack("7d", "", "", "");
     })();
-
-    const sse = new EventSource("http://127.0.0.1:5001/stream/kpis");
-    sse.onmessage = (e) =>
-      setKpis((prev) => ({ ...(prev || {}), ...JSON.parse(e.data) }));
-    return () => sse.close();
   }, []);
 
+  // KPIs ao vivo (SSE) no mesmo recorte dos filtros. EventSource não envia
+  // cabeçalhos e o JWT não deve ir na URL (fica nos logs): pede um ticket curto
+  // e de uso único e abre o stream com ?ticket=
+  useEffect(() => {
+    let sse = null;
+    let timer = null;
+    let closed = false;
+    const retry = () => {
+      if (!closed) timer = setTimeout(open, 3000);
+    };
+    const open = async () => {
+      const params = new URLSearchParams({ period });
+      if (channel) params.set("channel", channel);
+      if (location) params.set("location", location);
+      if (user?.token) {
+        try {
+          const { data } = await api.post("/stream/ticket");
+          params.set("ticket", data.ticket);
+        } catch (e) {
+          return retry();
+        }
+      }
+      if (closed) return;
+      sse = new EventSource(`${api.defaults.baseURL}/stream/kpis?${params}`);
+      sse.onmessage = (e) =>
+        setKpis((prev) => ({ ...(prev || {}), ...JSON.parse(e.data) }));
+      // a reconexão automática reusaria o ticket: fecha e reabre com um novo
+      sse.onerror = () => {
+        sse.close();
+        retry();
+      };
+    };
+    open();
+    return () => {
+      closed = true;
+      clearTimeout(timer);
+      sse?.close();
+    };
+  }, [period, channel, location, user?.token]);
+
   // recarrega sempre que muda o filtro
   useEffect(() => {
     refreshAll();
-    refreshStack();
-  }, [period, channel, location]);
+    if (isAdmin && asCnpj.trim()) refreshStack();
+  }, [period, channel, location]); // eslint-disable-line
 
   // quando admin muda “ver como CNPJ” na série empilhada
   useEffect(() => {
@@ -89,36 +123,45 @@ export default function Dashboard() {
     loadAdminOverview();
   }, [isAdmin, kpis, byChannel, opts]); // eslint-disable-line
 
-  // polling de alertas
+  // alertas: últimos do log e depois long polling a partir do cursor
   useEffect(() => {
-    const t = setInterval(async () => {
-      const { data } = await api.get("/alerts");
-      if (data.length) setAlerts((a) => [...data, ...a].slice(0, 5));
-    }, 4000);
-    return () => clearInterval(t);
+    let stop = false;
+    (async () => {
+      let after;
+      while (!stop) {
+        try {
+          const params = after === undefined ? { limit: 5 } : { after, wait: 25 };
+          const res = await api.get("/alerts", { params });
+          after = Number(res.headers["x-alerts-cursor"] ?? after ?? 0);
+          if (!stop && res.data.length)
+            setAlerts((a) => [...res.data.slice().reverse(), ...a].slice(0, 5));
+        } catch (e) {
+          await new Promise((r) => setTimeout(r, 5000)); // backend fora: tenta de novo
+        }
+      }
+    })();
+    return () => {
+      stop = true;
+    };
   }, []);
 
+  // todos os painéis numa requisição (/dashboard)
   async function refreshAll(p = period, c = channel, l = location) {
-    const { data } = await api.get("/metrics", {
+    const { data } = await api.get("/dashboard", {
       params: { period: p, channel: c || undefined, location: l || undefined },
     });
     const out = { ...data.kpis };
     if (!isAdmin) delete out.churn;
     setKpis(out);
     setSerie(data.serie);
-
-    const { data: bc } = await api.get("/panel/by-channel", {
-      params: { period: p, location: l || undefined },
-    });
-    setByChannel(bc || {});
-
-    const { data: ti } = await api.get("/panel/top-items", {
-      params: { period: p, channel: c || undefined, location: l || undefined },
-    });
-    setTopItems(ti || []);
-
-    const { data: sug } = await api.get("/suggestions");
-    setSuggestions(sug || []);
+    setByChannel(data.byChannel || {});
+    setTopItems(data.topItems || []);
+    setSuggestions(data.suggestions || []);
+    if (!(isAdmin && asCnpj.trim())) {
+      setStackLabels(data.stack?.labels || []);
+      setStackSeries(data.stack?.series || {});
+      setStackChannels(data.stack?.channels || []);
+    }
   }
 
   async function refreshStack(
@@ -485,7 +528,7 @@ export default function Dashboard() {
               {alerts.length === 0 ? (
                 <p style={{ opacity: 0.7, marginTop: 8 }}>Sem alertas.</p>
               ) : (
-                <ul style={{ marginTop: 8 }}>{alerts.map((a, i) => (<li key={i}>{a.msg}</li>))}</ul>
+                <ul style={{ marginTop: 8 }}>{alerts.map((a) => (<li key={a.id}>{a.msg}</li>))}</ul>
               )}
             </div>
 
@@ -540,6 +583,12 @@ export default function Dashboard() {
                 <Kpi title="Proj. Receita" value={`R$ ${simResp.proj_receita}`} />
                 <Kpi title="Conversões (proj.)" value={simResp.kpi_esperado.conversoes} />
               </div>
+              {simResp.receita && (
+                <small style={{ opacity: 0.7, display: "block", marginTop: 8 }}>
+                  Receita em {simResp.duracaoDias} dias (90% dos {simResp.paths} cenários simulados):{" "}
+                  {fmtMoeda(simResp.receita.p5)} a {fmtMoeda(simResp.receita.p95)}
+                </small>
+              )}
             </div>
           )}
         </section>